@@ -0,0 +1,98 @@
+import os
+import sys
+import csv
+import time
+import random
+import argparse
+import tempfile
+
+# 剧本渲染基准：生成一份 N 行的合成剧本 CSV，分别测量各输出格式与分片模式的耗时。
+# docx 另测改造前的写法（每段单独设置字号与加粗）作为基线。
+
+PIPELINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PIPELINE_DIR, "script_generate"))
+
+from script_generate import render, render_sharded, iter_script_lines  # noqa: E402
+
+ROLES = ["旁白", "林凡", "苏婉儿", "长老", "旁白", "小红帽", "狼"]
+
+
+def make_script_csv(path, rows, rows_per_window=12, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "role", "text", "window_idx", "dialogue"])
+        for i in range(1, rows + 1):
+            role = rng.choice(ROLES)
+            dialogue = "（语气平缓）" + "山风掠过青石台阶，远处钟声回荡。" * rng.randint(1, 6)
+            writer.writerow([i, role, dialogue[:20], (i - 1) // rows_per_window + 1, dialogue])
+
+
+def render_docx_baseline(lines, output_path):
+    """改造前的 docx 渲染：每段新建 run 并逐个设置字体，不使用段落样式。"""
+    from docx import Document
+    from docx.shared import Pt
+    from docx.oxml.ns import qn
+
+    doc = Document()
+    doc.styles['Normal'].font.name = u'宋体'
+    doc.styles['Normal']._element.rPr.rFonts.set(qn('w:eastAsia'), u'宋体')
+    for role, dialogue in lines:
+        narration = role in ["", "旁白"]
+        run = doc.add_paragraph().add_run(dialogue if narration else f"{role}：{dialogue}")
+        run.font.size = Pt(10 if narration else 12)
+        run.bold = not narration
+    doc.save(output_path)
+
+
+def timed(label, fn, rows):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28}{elapsed:>10.2f}s{rows / elapsed:>14.0f} 行/秒")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="剧本渲染基准")
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--shard-windows", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+
+    try:
+        import docx  # noqa: F401
+        formats = ["txt", "md", "docx"]
+    except ImportError:
+        print("⚠️ 未安装 python-docx，跳过 docx 模式")
+        formats = ["txt", "md"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "script.csv")
+        make_script_csv(src, args.rows)
+        print(f"合成剧本：{args.rows} 行，{os.path.getsize(src) / 1e6:.1f} MB")
+
+        for fmt in formats:
+            out = os.path.join(tmp, f"single.{fmt}")
+
+            def single():
+                with open(src, encoding="utf-8-sig", newline="") as f:
+                    render(iter_script_lines(csv.DictReader(f), "dialogue"), out, fmt)
+
+            def sharded():
+                with open(src, encoding="utf-8-sig", newline="") as f:
+                    render_sharded(csv.DictReader(f), os.path.join(tmp, f"shard.{fmt}"), fmt,
+                                   args.shard_windows, args.workers, "dialogue")
+
+            if fmt == "docx":
+                def baseline():
+                    with open(src, encoding="utf-8-sig", newline="") as f:
+                        render_docx_baseline(iter_script_lines(csv.DictReader(f), "dialogue"),
+                                             os.path.join(tmp, "baseline.docx"))
+
+                timed("docx 基线（逐段设字体）", baseline, args.rows)
+            timed(f"{fmt} 单文件", single, args.rows)
+            timed(f"{fmt} 分片×{args.workers}进程", sharded, args.rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+
+# 用 `python -X importtime <entry> --help` 测量各入口脚本的启动开销。
+# 若任一入口在 --help 时导入了重量级模块，或导入总耗时超过预算，则以非零状态退出，
+# 便于在改动后及时发现启动回归。
+
+PIPELINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (工作目录, 入口脚本)：与 README 中的运行方式保持一致，在脚本所在目录下执行
+ENTRY_POINTS = [
+    ("novel_analysis", "main.py"),
+    ("novel_analysis/emotion_part", "eval.py"),
+    ("novel_analysis/action_part", "predict.py"),
+]
+
+# --help 阶段不应出现的重量级依赖
+HEAVY_MODULES = ["torch", "transformers", "pandas", "numpy", "pyarrow", "openai", "tqdm", "joblib", "sklearn", "httpx"]
+
+BUDGET_MS = 300  # 单个入口的导入总耗时预算（毫秒）
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(workdir: str, script: str) -> dict:
+    """运行一次入口脚本的 --help，返回导入总耗时、墙钟时间与导入过的重量级模块。"""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", script, "--help"],
+        cwd=os.path.join(PIPELINE_DIR, workdir),
+        capture_output=True,
+        text=True,
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    total_us = 0
+    heavy = set()
+    for line in proc.stderr.splitlines():
+        m = IMPORTTIME_LINE.match(line)
+        if not m:
+            continue
+        cumulative, indent, name = int(m.group(2)), m.group(3), m.group(4)
+        # 只累加顶层导入（缩进为一个空格），避免子模块重复计数
+        if len(indent) == 1:
+            total_us += cumulative
+        root = name.split(".")[0]
+        if root in HEAVY_MODULES:
+            heavy.add(root)
+
+    return {
+        "entry": os.path.join(workdir, script),
+        "returncode": proc.returncode,
+        "import_ms": total_us / 1000,
+        "wall_ms": wall_ms,
+        "heavy": sorted(heavy),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="入口脚本启动耗时基准（-X importtime）")
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS, help="单个入口的导入耗时预算")
+    parser.add_argument("--repeat", type=int, default=3, help="每个入口重复次数，取最小值")
+    args = parser.parse_args(argv)
+
+    failed = False
+    print(f"{'entry':<40}{'import(ms)':>12}{'wall(ms)':>12}  heavy")
+    for workdir, script in ENTRY_POINTS:
+        runs = [measure(workdir, script) for _ in range(args.repeat)]
+        best = min(runs, key=lambda r: r["import_ms"])
+        print(f"{best['entry']:<40}{best['import_ms']:>12.1f}{best['wall_ms']:>12.1f}  {','.join(best['heavy']) or '-'}")
+
+        if best["returncode"] != 0:
+            print(f"  ❌ --help 退出码为 {best['returncode']}")
+            failed = True
+        if best["heavy"]:
+            print(f"  ❌ --help 时导入了重量级模块：{best['heavy']}")
+            failed = True
+        if best["import_ms"] > args.budget_ms:
+            print(f"  ❌ 导入耗时超过预算 {args.budget_ms}ms")
+            failed = True
+
+    if failed:
+        sys.exit(1)
+    print("✅ 所有入口启动耗时均在预算内")
+
+
+if __name__ == "__main__":
+    main()
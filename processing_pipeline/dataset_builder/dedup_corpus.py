@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import sqlite3
+import hashlib
+import argparse
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+
+
+# 语料级精确 + 近重复去重，作用于 dataset_builder / mix_corpus.py 产出的 JSON / JSONL（可为多个分片）。
+#
+# 1. 签名：按块并行（多进程）读取记录，取 human / assistant 文本（忽略随机注入的 system 提示），
+#    计算规范化全文的 SHA1（精确重复），并分别计算 human 侧与 assistant 侧的字符 2-gram MinHash 签名；
+# 2. 落盘：签名、精确哈希与 LSH 分带键写入 SQLite 工作库，内存中不保存签名，规模只受磁盘限制；
+# 3. 聚类：精确哈希相同的直接合并；assistant 签名落入同一 LSH 桶的候选与桶内第一条比较，
+#    human 与 assistant 两侧的估计 Jaccard 都不低于阈值才用并查集合并。
+#    分两侧比较是因为第三类数据的 human 侧内嵌同一份完整故事背景，只看全文会把整部故事并成一簇；
+# 4. 输出：每个簇保留编号最小（输入顺序最靠前）的一条，写出保留列表 keep.tsv、
+#    簇报告 clusters.jsonl，以及可选的去重后分片。
+
+THRESHOLD   = 0.8     # 近重复的估计 Jaccard 阈值
+NUM_PERM    = 128
+NGRAM       = 2
+CHUNK_SIZE  = 2000    # 每个并行任务处理的记录数
+WORKERS     = os.cpu_count() or 4
+SEED        = 1
+
+
+def record_text(record) -> tuple:
+    """用于比较的 (human 侧文本, assistant 侧文本)，各自按轮次顺序拼接，不含 system。"""
+    from mix_corpus import to_turns
+
+    turns = to_turns(record) if isinstance(record, dict) else None
+    if turns is None:
+        return json.dumps(record, ensure_ascii=False, sort_keys=True), ""
+    human = "\x1f".join(t["value"] for t in turns if t["from"] == "human")
+    assistant = "\x1f".join(t["value"] for t in turns if t["from"] not in ("system", "human"))
+    return human, assistant
+
+
+def band_keys(sig, bands: int, rows: int) -> list:
+    return [hashlib.blake2b(array("I", sig[i * rows:(i + 1) * rows]).tobytes(), digest_size=8).digest()
+            for i in range(bands)]
+
+
+def _signature_chunk(task):
+    """子进程：计算一个文件中 [start, end) 记录的精确哈希、签名与分带键。"""
+    from json_index import JsonIndex
+    from near_dup import NumpyMinHasher, normalize_text
+
+    path, start, end, num_perm, ngram, seed, bands, rows = task
+    hasher = NumpyMinHasher(num_perm=num_perm, ngram=ngram, seed=seed)
+    out = []
+    with JsonIndex(path) as index:
+        for i in range(start, end):
+            human, assistant = record_text(index[i])
+            exact = hashlib.sha1(normalize_text(human + "\x1f" + assistant).encode("utf-8")).digest()
+            sig_h, sig_a = hasher.signature(human), hasher.signature(assistant)
+            out.append((i, exact, array("I", sig_h).tobytes(), array("I", sig_a).tobytes(),
+                        band_keys(sig_a, bands, rows)))
+    return path, out
+
+
+class UnionFind:
+    def __init__(self, n: int):
+        self.parent = array("q", range(n))
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def union(self, a: int, b: int):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            # 根取较小编号，簇代表即输入顺序最靠前的记录
+            if rb < ra:
+                ra, rb = rb, ra
+            self.parent[rb] = ra
+
+
+def _similarity(sig_a: bytes, sig_b: bytes) -> float:
+    a, b = array("I"), array("I")
+    a.frombytes(sig_a)
+    b.frombytes(sig_b)
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def dedup(paths: list, out_dir: str, threshold: float = THRESHOLD, num_perm: int = NUM_PERM,
+          workers: int = WORKERS, chunk_size: int = CHUNK_SIZE, write_shards: bool = False) -> dict:
+    from json_index import JsonIndex
+    from near_dup import _optimal_bands
+
+    os.makedirs(out_dir, exist_ok=True)
+    bands, rows = _optimal_bands(threshold, num_perm)
+
+    # 全局编号：按输入文件顺序连续编号
+    files, tasks, base = [], [], {}
+    total = 0
+    for path in paths:
+        with JsonIndex(path) as index:
+            n = len(index)
+        base[path] = total
+        files.append((path, n))
+        tasks += [(path, s, min(s + chunk_size, n), num_perm, NGRAM, SEED, bands, rows)
+                  for s in range(0, n, chunk_size)]
+        total += n
+    print(f"共 {len(files)} 个文件、{total} 条记录，LSH 分带 {bands}×{rows}，阈值 {threshold}")
+
+    db_path = os.path.join(out_dir, "dedup_work.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        PRAGMA journal_mode=OFF;
+        PRAGMA synchronous=OFF;
+        CREATE TABLE records (id INTEGER PRIMARY KEY, exact BLOB, sig_h BLOB, sig_a BLOB);
+        CREATE TABLE bands (band INTEGER, key BLOB, id INTEGER);
+    """)
+
+    # 1-2. 并行签名，主进程按块写库
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for path, out in executor.map(_signature_chunk, tasks):
+            offset = base[path]
+            conn.executemany("INSERT INTO records VALUES (?, ?, ?, ?)",
+                             ((offset + i, exact, sig_h, sig_a) for i, exact, sig_h, sig_a, _ in out))
+            conn.executemany("INSERT INTO bands VALUES (?, ?, ?)",
+                             ((b, key, offset + i) for i, _, _, _, keys in out for b, key in enumerate(keys)))
+            conn.commit()
+            done += len(out)
+            print(f"\r签名 {done}/{total}", end="", flush=True)
+    print()
+    conn.execute("CREATE INDEX idx_exact ON records(exact)")
+    conn.execute("CREATE INDEX idx_bands ON bands(band, key, id)")
+
+    # 3. 聚类
+    uf = UnionFind(total)
+    kind = {}   # 被合并记录 → ("exact" | "near", 与代表的相似度)
+    for (ids,) in conn.execute("SELECT group_concat(id) FROM records GROUP BY exact HAVING COUNT(*) > 1"):
+        ids = sorted(map(int, ids.split(",")))
+        for other in ids[1:]:
+            uf.union(ids[0], other)
+            kind[other] = ("exact", 1.0)
+
+    def sigs_of(i):
+        return conn.execute("SELECT sig_h, sig_a FROM records WHERE id = ?", (i,)).fetchone()
+
+    bucket_cursor = conn.cursor()
+    for (ids,) in bucket_cursor.execute(
+            "SELECT group_concat(id) FROM bands GROUP BY band, key HAVING COUNT(*) > 1"):
+        ids = sorted(map(int, ids.split(",")))
+        head = ids[0]
+        head_h, head_a = sigs_of(head)
+        for other in ids[1:]:
+            if uf.find(other) == uf.find(head):
+                continue
+            other_h, other_a = sigs_of(other)
+            sim = min(_similarity(head_a, other_a), _similarity(head_h, other_h))
+            if sim >= threshold:
+                uf.union(head, other)
+                kind.setdefault(other, ("near", sim))
+
+    # 4. 输出
+    clusters = {}
+    for i in range(total):
+        root = uf.find(i)
+        if root != i:
+            clusters.setdefault(root, []).append(i)
+
+    def locate(i):
+        for path, n in reversed(files):
+            if i >= base[path]:
+                return path, i - base[path]
+
+    kept = 0
+    with open(os.path.join(out_dir, "keep.tsv"), "w", encoding="utf-8") as f:
+        f.write("file\tindex\n")
+        for i in range(total):
+            if uf.find(i) == i:
+                path, j = locate(i)
+                f.write(f"{path}\t{j}\n")
+                kept += 1
+
+    with open(os.path.join(out_dir, "clusters.jsonl"), "w", encoding="utf-8") as f:
+        for root in sorted(clusters):
+            path, j = locate(root)
+            members = []
+            for i in clusters[root]:
+                p, k = locate(i)
+                how, sim = kind.get(i, ("near", None))
+                members.append({"file": p, "index": k, "match": how, "similarity": sim})
+            f.write(json.dumps({"keep": {"file": path, "index": j}, "size": len(members) + 1,
+                                "duplicates": members}, ensure_ascii=False) + "\n")
+
+    if write_shards:
+        from mix_corpus import ShardWriter, SHARD_RECORDS
+
+        writer = ShardWriter(os.path.join(out_dir, "shards"), SHARD_RECORDS)
+        for path, n in files:
+            with JsonIndex(path) as index:
+                for j in range(n):
+                    if uf.find(base[path] + j) == base[path] + j:
+                        writer.write(index[j])
+        writer.close()
+
+    conn.close()
+    os.remove(db_path)
+    exact = sum(1 for how, _ in kind.values() if how == "exact")
+    summary = {"records": total, "kept": kept, "removed_exact": exact,
+               "removed_near": total - kept - exact, "clusters": len(clusters)}
+    with open(os.path.join(out_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(dict(summary, threshold=threshold, num_perm=num_perm, files=[p for p, _ in files]),
+                  f, ensure_ascii=False, indent=2)
+    return summary
+
+
+def expand_paths(paths) -> list:
+    """
+    展开目录中的 JSON / JSONL 文件。压缩文件（如 mix_corpus.py --compress 写出的 .jsonl.zst 分片）也会列出，
+    由 JsonIndex 报错提示先解压，而不是被静默跳过。
+    """
+    from stream_io import strip_compression
+
+    out = []
+    for path in paths:
+        if os.path.isdir(path):
+            out += sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names
+                          if strip_compression(name).endswith((".json", ".jsonl")) and not name.endswith(".idx.json")
+                          and name not in ("manifest.json", "summary.json", "clusters.jsonl"))
+        else:
+            out.append(path)
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SFT 语料的精确与近重复去重（MinHash LSH，多进程，落盘）")
+    parser.add_argument("paths", nargs="+", help="JSON / JSONL 文件或目录（如 mix_corpus.py 的分片目录）")
+    parser.add_argument("--out-dir", required=True)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--num-perm", type=int, default=NUM_PERM)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--write-shards", action="store_true", help="同时写出去重后的 JSONL 分片")
+    args = parser.parse_args(argv)
+
+    try:
+        summary = dedup(expand_paths(args.paths), args.out_dir, args.threshold, args.num_perm,
+                        args.workers, args.chunk_size, args.write_shards)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"✅ {summary['records']} 条中保留 {summary['kept']} 条：精确重复 {summary['removed_exact']} 条，"
+          f"近重复 {summary['removed_near']} 条，{summary['clusters']} 个重复簇；结果保存到 {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
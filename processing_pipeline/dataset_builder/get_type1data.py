@@ -3,6 +3,10 @@ import json
 import pathlib
 import random
 import os 
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from stream_io import open_stream, strip_compression, compression_of, with_compression
 
 
 # 系统消息列表（全局配置）
@@ -21,6 +25,8 @@ SYSTEM_MESSAGES = [
 CSV_ENCODING = 'gbk'
 # JSON 文件编码
 JSON_ENCODING = 'utf-8'
+# 输出 JSON 的压缩格式：None 与输入 CSV 相同（a.csv.zst → a.json.zst），"" 不压缩，"zst" / "gz" 指定格式
+JSON_COMPRESSION = None
 
 
 def convert_csv_row_to_sft_sample(text_content: str, dialogue_content: str, system_messages: list) -> dict:
@@ -74,7 +80,7 @@ def process_single_csv_file(csv_input_path: pathlib.Path, json_output_path: path
     print(f"  Processing: {csv_input_path.name}")
 
     try:
-        with open(csv_input_path, mode='r', encoding=csv_encoding) as infile:
+        with open_stream(csv_input_path, mode='r', encoding=csv_encoding, newline='') as infile:
             reader = csv.DictReader(infile)
 
             # 检查必需的列
@@ -95,7 +101,7 @@ def process_single_csv_file(csv_input_path: pathlib.Path, json_output_path: path
                     print(f"  Warning: Skipping row {i+2} in '{csv_input_path.name}' due to empty text or dialogue.") # 行号+2是因为header和0-based index
 
             if sft_data:
-                with open(json_output_path, mode='w', encoding=json_encoding) as outfile:
+                with open_stream(json_output_path, mode='w', encoding=json_encoding) as outfile:
                     json.dump(sft_data, outfile, ensure_ascii=False, indent=2)
                 print(f"  Successfully generated {len(sft_data)} records in '{json_output_path.name}'.")
                 return True # 处理成功
@@ -138,9 +144,11 @@ if __name__ == "__main__":
     failed_conversions = 0
 
     for item in input_directory.iterdir():
-        if item.is_file() and item.suffix.lower() == '.csv':
+        # 输入可为 .csv.zst / .csv.gz，按去掉压缩扩展名后的后缀判断
+        if item.is_file() and strip_compression(item.name).lower().endswith('.csv'):
             total_csv_files += 1
-            json_output_filename = item.with_suffix('.json').name
+            compress = compression_of(item) if JSON_COMPRESSION is None else JSON_COMPRESSION
+            json_output_filename = with_compression(pathlib.Path(strip_compression(item.name)).with_suffix('.json').name, compress)
             json_output_path = output_directory / json_output_filename
 
             # 调用函数处理单个文件
@@ -0,0 +1,279 @@
+import os
+import sys
+import json
+import math
+import random
+import hashlib
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from stream_io import open_stream, iter_records, compression_of, strip_compression, with_compression
+
+
+# 把剧本扩写（一类）、对话剧本（二类）、场景剧本（三类）与常识数据按权重混合成 SFT 语料。
+#
+# - 来源：JSON 数组 / JSONL 文件、包含它们的目录，或 type3_store.py 的紧凑存储目录；
+#   JSON 数组通过 json_index 的偏移索引逐条读取，不整体 json.load；
+#   压缩文件（.json.zst / .jsonl.gz 等）无法随机读取，改为流式解压逐条解析。
+# - 权重：每个来源的采样倍数。2.0 表示每条记录出现两次，0.3 表示按固定种子保留约 30%；
+#   大于 1 时分多轮遍历该来源，重复的样本自然分散在输出中。
+# - 统一格式：Alpaca（instruction/input/output/history/system）与 ShareGPT
+#   （conversation 或 conversations）都规范化为同一种目标格式。
+# - 打乱：各来源按剩余条数加权交错，再经过固定大小的缓冲区随机输出，内存只与缓冲区大小有关；
+#   相同的种子与输入得到完全相同的输出。
+# - 输出：固定条数的 JSONL 分片 part-xxxxx.jsonl 与 manifest.json（来源统计、各分片条数、字节数与校验和）；
+#   --compress zst 时分片为 part-xxxxx.jsonl.zst，字节数与校验和仍按解压后的内容计算，另记压缩后的文件大小。
+
+SHUFFLE_BUFFER = 10000    # 打乱缓冲区条数
+SHARD_RECORDS  = 50000    # 每个分片的记录数
+TARGET_SCHEMA  = "sharegpt"
+SEED           = 42
+SHARD_COMPRESS = ""       # 分片压缩格式："" 不压缩，"zst" / "gz"
+
+ROLE_ALIASES = {"user": "human", "gpt": "assistant", "model": "assistant", "bot": "assistant"}
+
+
+# ———— 格式规范化 ————
+
+def to_turns(record: dict):
+    """把一条 Alpaca 或 ShareGPT 记录转为 [{from, value}, …]；无法识别时返回 None。"""
+    conv = record.get("conversations", record.get("conversation"))
+    if isinstance(conv, list):
+        turns = []
+        for t in conv:
+            role = t.get("from", t.get("role"))
+            turns.append({"from": ROLE_ALIASES.get(role, role), "value": t.get("value", t.get("content", ""))})
+        return turns
+    if "instruction" in record and "output" in record:
+        turns = []
+        if record.get("system"):
+            turns.append({"from": "system", "value": record["system"]})
+        for query, response in record.get("history") or []:
+            turns += [{"from": "human", "value": query}, {"from": "assistant", "value": response}]
+        prompt = record["instruction"]
+        if record.get("input"):
+            prompt = f"{prompt}\n{record['input']}"
+        turns += [{"from": "human", "value": prompt}, {"from": "assistant", "value": record["output"]}]
+        return turns
+    return None
+
+
+def from_turns(turns: list, schema: str) -> dict:
+    """把 [{from, value}, …] 写成目标格式：sharegpt 或 alpaca（最后一轮为 instruction/output，之前为 history）。"""
+    if schema == "sharegpt":
+        return {"conversations": turns}
+    system = "\n".join(t["value"] for t in turns if t["from"] == "system")
+    dialog = [t for t in turns if t["from"] != "system"]
+    pairs = [(dialog[i]["value"], dialog[i + 1]["value"]) for i in range(0, len(dialog) - 1, 2)]
+    if not pairs:
+        raise ValueError("记录中没有完整的一问一答")
+    record = {"instruction": pairs[-1][0], "input": "", "output": pairs[-1][1],
+              "history": [list(p) for p in pairs[:-1]]}
+    if system:
+        record["system"] = system
+    return record
+
+
+# ———— 来源 ————
+
+class Source:
+    """一个加权来源：files 为 JSON / JSONL 文件列表，或 type3 紧凑存储目录。"""
+
+    def __init__(self, path: str, weight: float = 1.0):
+        from type3_store import SAMPLES_FILE
+
+        self.path = path
+        self.weight = weight
+        self.type3 = os.path.isdir(path) and os.path.isfile(os.path.join(path, SAMPLES_FILE))
+        if self.type3:
+            self.files = [path]
+        elif os.path.isdir(path):
+            self.files = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path) for name in names
+                if strip_compression(name).endswith((".json", ".jsonl")) and not name.endswith(".idx.json")
+            )
+        else:
+            self.files = [path]
+        self.count = sum(self._count(f) for f in self.files)
+        self.emitted = 0
+        self.skipped = 0
+
+    def _count(self, path: str) -> int:
+        if self.type3:
+            from type3_store import SAMPLES_FILE
+            with open(os.path.join(path, SAMPLES_FILE), "rb") as f:
+                return sum(1 for line in f if line.strip())
+        if compression_of(path):
+            return sum(1 for _ in iter_records(path))
+        from json_index import JsonIndex
+        with JsonIndex(path) as index:
+            return len(index)
+
+    def _iter_once(self):
+        if self.type3:
+            from type3_store import Type3Store
+            with Type3Store(self.path) as store:
+                yield from store
+            return
+        from json_index import JsonIndex
+        for path in self.files:
+            if compression_of(path):
+                yield from iter_records(path)
+                continue
+            with JsonIndex(path) as index:
+                for i in range(len(index)):
+                    yield index[i]
+
+    def expected(self) -> float:
+        return self.count * self.weight
+
+    def records(self, rng: random.Random):
+        """按权重产出记录：第 p 轮（从 0 起）每条记录以 min(1, weight - p) 的概率保留。"""
+        for p in range(math.ceil(self.weight)):
+            keep = min(1.0, self.weight - p)
+            for record in self._iter_once():
+                if keep >= 1.0 or rng.random() < keep:
+                    yield record
+
+
+def interleave(sources: list, seed: int):
+    """按各来源剩余的期望条数加权随机交错，产出 (source, record)。"""
+    rng = random.Random(seed)
+    streams = [s.records(random.Random(f"{seed}-{i}")) for i, s in enumerate(sources)]
+    remaining = [s.expected() for s in sources]
+    while True:
+        live = [i for i, r in enumerate(remaining) if r > 0]
+        if not live:
+            return
+        i = rng.choices(live, weights=[remaining[j] for j in live])[0]
+        try:
+            record = next(streams[i])
+        except StopIteration:
+            remaining[i] = 0
+            continue
+        remaining[i] = max(remaining[i] - 1, 1e-9)   # 期望值偏小时仍保持存活，直到真正耗尽
+        yield sources[i], record
+
+
+def buffered_shuffle(items, buffer_size: int, seed: int):
+    """固定大小缓冲区的流式打乱：缓冲区满后每进一条就随机吐出一条。"""
+    rng = random.Random(seed)
+    buffer = []
+    for item in items:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+            continue
+        j = rng.randrange(buffer_size)
+        yield buffer[j]
+        buffer[j] = item
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+# ———— 分片输出 ————
+
+class ShardWriter:
+    def __init__(self, out_dir: str, shard_records: int, compress: str = SHARD_COMPRESS):
+        self.out_dir = out_dir
+        self.shard_records = shard_records
+        self.compress = compress
+        self.shards = []
+        self._f = None
+        os.makedirs(out_dir, exist_ok=True)
+
+    def _open(self):
+        name = with_compression(f"part-{len(self.shards):05d}.jsonl", self.compress)
+        self._f = open_stream(os.path.join(self.out_dir, name), "wb")
+        self._hash = hashlib.sha1()
+        self.shards.append({"file": name, "records": 0, "bytes": 0})
+
+    def _close(self):
+        if self._f:
+            self._f.close()
+            self.shards[-1]["sha1"] = self._hash.hexdigest()
+            if self.compress:
+                self.shards[-1]["file_bytes"] = os.path.getsize(os.path.join(self.out_dir, self.shards[-1]["file"]))
+            self._f = None
+
+    def write(self, record: dict):
+        if self._f is None or self.shards[-1]["records"] >= self.shard_records:
+            self._close()
+            self._open()
+        data = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        self._f.write(data)
+        self._hash.update(data)
+        self.shards[-1]["records"] += 1
+        self.shards[-1]["bytes"] += len(data)
+
+    def close(self):
+        self._close()
+
+
+def mix(sources: list, out_dir: str, schema: str = TARGET_SCHEMA, seed: int = SEED,
+        buffer_size: int = SHUFFLE_BUFFER, shard_records: int = SHARD_RECORDS,
+        compress: str = SHARD_COMPRESS) -> dict:
+    """混合、规范化、打乱并分片写出；返回 manifest（同时写入 out_dir/manifest.json）。"""
+    def normalized():
+        for source, record in interleave(sources, seed):
+            turns = to_turns(record) if isinstance(record, dict) else None
+            try:
+                if turns is None:
+                    raise ValueError("无法识别的记录格式")
+                out = from_turns(turns, schema)
+            except ValueError:
+                source.skipped += 1
+                continue
+            source.emitted += 1
+            yield out
+
+    writer = ShardWriter(out_dir, shard_records, compress)
+    for record in buffered_shuffle(normalized(), buffer_size, seed):
+        writer.write(record)
+    writer.close()
+
+    manifest = {
+        "schema": schema,
+        "seed": seed,
+        "shuffle_buffer": buffer_size,
+        "total_records": sum(s["records"] for s in writer.shards),
+        "sources": [{"path": s.path, "weight": s.weight, "records": s.count,
+                     "emitted": s.emitted, "skipped": s.skipped} for s in sources],
+        "shards": writer.shards,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def parse_source(spec: str) -> Source:
+    """"路径" 或 "路径:权重"。"""
+    path, _, weight = spec.rpartition(":")
+    if path and weight.replace(".", "", 1).isdigit():
+        return Source(path, float(weight))
+    return Source(spec, 1.0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="按权重混合多类数据，统一格式后流式打乱并分片输出")
+    parser.add_argument("--source", action="append", required=True,
+                        help="数据来源，格式为 路径[:权重]，可重复；路径可为文件、目录或 type3 紧凑存储")
+    parser.add_argument("--out-dir", required=True)
+    parser.add_argument("--schema", choices=["sharegpt", "alpaca"], default=TARGET_SCHEMA)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--buffer", type=int, default=SHUFFLE_BUFFER, help="打乱缓冲区条数")
+    parser.add_argument("--shard-records", type=int, default=SHARD_RECORDS, help="每个分片的记录数")
+    parser.add_argument("--compress", choices=["", "zst", "gz"], default=SHARD_COMPRESS, help="分片压缩格式，缺省不压缩")
+    args = parser.parse_args(argv)
+
+    sources = [parse_source(s) for s in args.source]
+    for s in sources:
+        print(f"📚 {s.path}：{s.count} 条，权重 {s.weight}")
+    manifest = mix(sources, args.out_dir, args.schema, args.seed, args.buffer, args.shard_records, args.compress)
+    for s in manifest["sources"]:
+        print(f"  {s['path']}：输出 {s['emitted']} 条，跳过 {s['skipped']} 条")
+    print(f"✅ 共 {manifest['total_records']} 条，{len(manifest['shards'])} 个分片，保存到 {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
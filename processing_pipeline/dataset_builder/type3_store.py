@@ -0,0 +1,240 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+from functools import lru_cache
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from stream_io import open_stream
+
+
+# 第三类数据（剧本续写）的紧凑存储。
+#
+# 展开后的每条样本都在 input 中内嵌完整的【完整故事背景】和不断增长的【先前剧本内容】，
+# 文件大小随故事长度平方增长。紧凑存储把重复文本只存一份，样本只保存引用：
+#
+#   <store>/texts.jsonl    {"id": 0, "text": "..."}       指令、故事背景与各场景剧本流，去重后各存一次
+#   <store>/samples.jsonl  {"instruction": 0, "background": 1, "script": 2, "script_len": 356,
+#                           "current": "当前小说段落", "output": "..."}
+#
+# 同一场景中后一条样本的先前剧本内容通常是前一条的延长，因此一个场景的剧本只存最长的一份（剧本流），
+# 每条样本记录其在剧本流中的前缀长度。读取或导出时再按模板拼出 Alpaca / ShareGPT 记录。
+# 存储目录本身不压缩（texts.jsonl 按偏移随机读取）；pack 的输入与 export 的输出可为 .zst / .gz。
+
+INPUT_TEMPLATE = (
+    "【完整故事背景】:\n---\n{background}\n---\n\n"
+    "【先前剧本内容 (同一场景/窗口)】:\n---\n{script}\n---\n\n"
+    "【当前小说段落】:\n---\n{current}\n---"
+)
+EMPTY_SCRIPT = "无先前内容"
+TEXTS_FILE = "texts.jsonl"
+SAMPLES_FILE = "samples.jsonl"
+
+_INPUT_PATTERN = re.compile(
+    r"^【完整故事背景】:\n---\n(.*?)\n---\n\n"
+    r"【先前剧本内容 \(同一场景/窗口\)】:\n---\n(.*?)\n---\n\n"
+    r"【当前小说段落】:\n---\n(.*)\n---$",
+    re.S,
+)
+
+
+def parse_input(text: str):
+    """把展开的 input 拆成 (background, script, current)；不符合模板时返回 None。"""
+    m = _INPUT_PATTERN.match(text)
+    return m.groups() if m else None
+
+
+class Type3Writer:
+    """
+    逐条写入紧凑存储（上下文管理器）。add() 接收与展开格式相同的各字段，
+    背景与指令按内容去重，剧本前缀尽量并入当前场景的剧本流。
+    """
+
+    def __init__(self, store_dir: str):
+        os.makedirs(store_dir, exist_ok=True)
+        self._texts = open(os.path.join(store_dir, TEXTS_FILE), "w", encoding="utf-8")
+        self._samples = open(os.path.join(store_dir, SAMPLES_FILE), "w", encoding="utf-8")
+        self._ids = {}            # 文本哈希 → id（指令与背景）
+        self._next_id = 0
+        self._stream_id = None    # 当前剧本流的 id 及其目前最长的内容，换场景时才写出
+        self._stream = None
+        self.count = 0
+
+    def _new_id(self) -> int:
+        self._next_id += 1
+        return self._next_id - 1
+
+    def _write_text(self, text_id: int, text: str):
+        self._texts.write(json.dumps({"id": text_id, "text": text}, ensure_ascii=False) + "\n")
+
+    def _intern(self, text: str) -> int:
+        key = hashlib.sha1(text.encode("utf-8")).digest()
+        if key not in self._ids:
+            self._ids[key] = self._new_id()
+            self._write_text(self._ids[key], text)
+        return self._ids[key]
+
+    def _flush_stream(self):
+        if self._stream_id is not None:
+            self._write_text(self._stream_id, self._stream)
+        self._stream_id = self._stream = None
+
+    def _script_ref(self, script: str):
+        if script == EMPTY_SCRIPT:
+            return None, 0
+        if self._stream is not None and script.startswith(self._stream):
+            self._stream = script                 # 同一场景的剧本继续延长
+        elif self._stream is None or not self._stream.startswith(script):
+            self._flush_stream()                  # 新场景：开始新的剧本流
+            self._stream_id, self._stream = self._new_id(), script
+        return self._stream_id, len(script)
+
+    def add(self, instruction: str, background: str, script: str, current: str, output: str):
+        script_id, script_len = self._script_ref(script)
+        sample = {
+            "instruction": self._intern(instruction),
+            "background": self._intern(background),
+            "script": script_id,
+            "script_len": script_len,
+            "current": current,
+            "output": output,
+        }
+        self._samples.write(json.dumps(sample, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def add_raw(self, instruction: str, input_text: str, output: str):
+        """写入一条展开格式的样本；input 不符合模板时原样保存。"""
+        parts = parse_input(input_text)
+        if parts:
+            self.add(instruction, *parts, output)
+        else:
+            sample = {"instruction": self._intern(instruction), "input": input_text, "output": output}
+            self._samples.write(json.dumps(sample, ensure_ascii=False) + "\n")
+            self.count += 1
+
+    def close(self):
+        self._flush_stream()
+        self._texts.close()
+        self._samples.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Type3Store:
+    """
+    只读访问紧凑存储。打开时只扫描 texts.jsonl 记录每条文本的字节偏移，
+    文本在用到时才读取（带 LRU 缓存），样本逐行流式展开。
+    """
+
+    def __init__(self, store_dir: str, cache_size: int = 256):
+        self.store_dir = store_dir
+        self._offsets = {}
+        with open(os.path.join(store_dir, TEXTS_FILE), "rb") as f:
+            offset = 0
+            for line in f:
+                head = line[:32].decode("utf-8", "ignore")
+                self._offsets[int(re.match(r'\{"id": (\d+)', head).group(1))] = offset
+                offset += len(line)
+        self._fh = open(os.path.join(store_dir, TEXTS_FILE), "rb")
+        self.text = lru_cache(maxsize=cache_size)(self._read_text)
+
+    def _read_text(self, text_id: int) -> str:
+        self._fh.seek(self._offsets[text_id])
+        return json.loads(self._fh.readline())["text"]
+
+    def close(self):
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def expand(self, sample: dict) -> dict:
+        """把一条引用样本展开为 Alpaca 记录 {instruction, input, output}。"""
+        instruction = self.text(sample["instruction"])
+        if "input" in sample:
+            return {"instruction": instruction, "input": sample["input"], "output": sample["output"]}
+        script_id = sample["script"]
+        script = self.text(script_id)[:sample["script_len"]] if script_id is not None else EMPTY_SCRIPT
+        input_text = INPUT_TEMPLATE.format(
+            background=self.text(sample["background"]), script=script, current=sample["current"]
+        )
+        return {"instruction": instruction, "input": input_text, "output": sample["output"]}
+
+    def __iter__(self):
+        with open(os.path.join(self.store_dir, SAMPLES_FILE), encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield self.expand(json.loads(line))
+
+    def iter_records(self, fmt: str = "alpaca"):
+        """逐条产出 Alpaca 或 ShareGPT（与 get_type2data.py 相同的 conversations 结构）记录。"""
+        for record in self:
+            if fmt == "alpaca":
+                yield record
+            elif fmt == "sharegpt":
+                yield {"conversations": [
+                    {"from": "system", "value": record["instruction"]},
+                    {"from": "human", "value": record["input"]},
+                    {"from": "assistant", "value": record["output"]},
+                ]}
+            else:
+                raise ValueError(f"未知格式：{fmt}")
+
+    def export(self, output_path: str, fmt: str = "alpaca") -> int:
+        """流式导出为 JSONL（output_path 以 .zst / .gz 结尾时压缩），返回记录数。"""
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        count = 0
+        with open_stream(output_path, "w", encoding="utf-8") as f:
+            for record in self.iter_records(fmt):
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+        return count
+
+
+def pack_jsonl(input_path: str, store_dir: str) -> int:
+    """把展开格式的第三类数据 JSONL（可为 .zst / .gz）转为紧凑存储，返回样本数。"""
+    with open_stream(input_path, encoding="utf-8") as f, Type3Writer(store_dir) as writer:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                writer.add_raw(row["instruction"], row["input"], row["output"])
+    return writer.count
+
+
+def _dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="第三类数据的紧凑存储：打包与按需导出")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("pack", help="展开格式 JSONL → 紧凑存储目录")
+    p.add_argument("input")
+    p.add_argument("store")
+    e = sub.add_parser("export", help="紧凑存储目录 → Alpaca / ShareGPT JSONL")
+    e.add_argument("store")
+    e.add_argument("output")
+    e.add_argument("--format", choices=["alpaca", "sharegpt"], default="alpaca")
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        count = pack_jsonl(args.input, args.store)
+        before, after = os.path.getsize(args.input), _dir_size(args.store)
+        print(f"✅ 打包 {count} 条样本：{before / 1e6:.2f} MB → {after / 1e6:.2f} MB（{before / max(after, 1):.1f}x）")
+    else:
+        with Type3Store(args.store) as store:
+            count = store.export(args.output, args.format)
+        print(f"✅ 导出 {count} 条 {args.format} 记录到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import torch
+
+
+# 定义Seq2Seq模型结构（Embedding + 双层LSTM编码器/解码器 + 输出层）
+class Seq2SeqModel(torch.nn.Module):
+    def __init__(self, vocab_size, embed_dim=256, hidden_size=256, num_layers=2):
+        super(Seq2SeqModel, self).__init__()
+        # 词嵌入层
+        self.embedding = torch.nn.Embedding(vocab_size, embed_dim)
+        # 编码器：双层LSTM
+        self.encoder = torch.nn.LSTM(embed_dim, hidden_size, num_layers=num_layers, batch_first=True)
+        # 解码器：双层LSTM
+        self.decoder = torch.nn.LSTM(embed_dim, hidden_size, num_layers=num_layers, batch_first=True)
+        # 输出层：将LSTM输出映射到词表大小
+        self.fc = torch.nn.Linear(hidden_size, vocab_size)
+
+    def encode(self, input_ids):
+        # input_ids: (batch_size, seq_len)
+        embedded = self.embedding(input_ids)  # (batch_size, seq_len, embed_dim)
+        outputs, (hidden, cell) = self.encoder(embedded)
+        return hidden, cell
+
+    def decode_step(self, input_id, hidden, cell):
+        # 单步解码
+        # input_id: (batch_size, 1)
+        embedded = self.embedding(input_id)  # (batch_size, 1, embed_dim)
+        output, (hidden, cell) = self.decoder(embedded, (hidden, cell))
+        output = output.squeeze(1)  # (batch_size, hidden_size)
+        output = self.fc(output)  # (batch_size, vocab_size)
+        return output, hidden, cell
@@ -0,0 +1,199 @@
+import os
+import re
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+# 分层滚动摘要：为每行台词提供大小固定的背景，而不是原文中的前三句或整篇故事。
+#
+#   场景（scene）  = 一个滑窗（window_idx）内的全部台词，各自独立摘要，可并行；
+#   章节（chapter）= 连续 CHAPTER_WINDOWS 个场景，由场景摘要合并而成；
+#   前情（story）  = 截至某章之前的滚动摘要：story[c] = 压缩(story[c-1] + chapter[c-1])。
+#
+# 第 c 章第 w 个场景中某一行的背景为：
+#   前情提要 story[c] + 本章此前各场景摘要（由近到远，放不下的舍去） + 最近 k 句原文，
+# 总长度受 token 预算限制，不随故事长度增长。
+# 摘要按内容哈希缓存在 <store_dir>/summaries.json，重新抽取或追加章节后只补算变化的部分。
+
+SUMMARY_FILE     = "summaries.json"
+CHAPTER_WINDOWS  = 8      # 每章包含的滑窗数（小说原文不保留章节边界，按滑窗分组近似）
+RECENT_TURNS     = 3      # 背景中保留的最近原文句数
+CONTEXT_TOKENS   = 600    # 整段背景的 token 预算
+STORY_TOKENS     = 200    # 其中前情提要的上限
+SUMMARY_CHARS    = 120    # 要求模型输出的单条摘要字数
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数：中日韩字符按 1 个计，其余字符按 4 个一 token 计。"""
+    cjk = len(re.findall(r"[\u3000-\u9fff\uff00-\uffef]", text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """把文本截断到 token 预算以内（保留开头）。"""
+    if estimate_tokens(text) <= budget:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget - 1:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo] + "…"
+
+
+def _digest(*parts) -> str:
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(str(p).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:16]
+
+
+def summarize(client, text: str, instruction: str) -> str:
+    resp = client.chat.completions.create(
+        model="deepseek-chat",
+        messages=[
+            {"role": "system", "content": "你是一个小说剧情摘要助手，只输出摘要正文。"},
+            {"role": "user", "content": f"{instruction}（不超过{SUMMARY_CHARS}字）：\n{text}"},
+        ],
+        stream=False,
+        temperature=0.3,
+    )
+    return resp.choices[0].message.content.strip().replace("\n", " ")
+
+
+class ContextBuilder:
+    """
+    turns 为按 id 排好序的 [{role, text, window_idx}, …]；context(i) 返回第 i 行的背景。
+    未调用 build() 或摘要缺失时，对应部分留空，只保留最近 k 句原文。
+    """
+
+    def __init__(self, turns, cache_path: str = None, recent_turns: int = RECENT_TURNS,
+                 budget: int = CONTEXT_TOKENS, story_budget: int = STORY_TOKENS,
+                 chapter_windows: int = CHAPTER_WINDOWS):
+        self.texts = [str(t["text"]) for t in turns]
+        self.windows = [int(t["window_idx"]) for t in turns]
+        self.roles = [str(t["role"]) for t in turns]
+        self.cache_path = cache_path
+        self.recent_turns = recent_turns
+        self.budget = budget
+        self.story_budget = story_budget
+        self.chapter_windows = chapter_windows
+        self.cache = {"scenes": {}, "chapters": {}, "story": {}}
+        if cache_path and os.path.isfile(cache_path):
+            with open(cache_path, encoding="utf-8") as f:
+                self.cache.update(json.load(f))
+
+    def chapter_of(self, window_idx: int) -> int:
+        return (window_idx - 1) // self.chapter_windows
+
+    def _scene_text(self) -> dict:
+        scenes = {}
+        for role, text, w in zip(self.roles, self.texts, self.windows):
+            scenes.setdefault(w, []).append(f"{role}：{text}")
+        return {w: "\n".join(lines) for w, lines in scenes.items()}
+
+    @staticmethod
+    def _lookup(section: dict, key, digest: str):
+        entry = section.get(str(key))
+        return entry["summary"] if entry and entry.get("hash") == digest else None
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        tmp = self.cache_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.cache, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.cache_path)
+
+    def build(self, client, concurrency: int = 8):
+        """补算缺失或已过期的场景 / 章节 / 前情摘要；场景与章节摘要并行，前情按章顺序滚动。"""
+        scene_text = self._scene_text()
+        calls = 0
+
+        def fill(section, jobs):
+            # jobs: [(key, digest, text, instruction)]，只对缓存未命中的条目调用模型
+            nonlocal calls
+            todo = [j for j in jobs if self._lookup(self.cache[section], j[0], j[1]) is None]
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = executor.map(lambda j: summarize(client, j[2], j[3]), todo)
+                for (key, digest, _, _), summary in zip(todo, results):
+                    self.cache[section][str(key)] = {"hash": digest, "summary": summary}
+            calls += len(todo)
+            self._save()
+
+        fill("scenes", [(w, _digest(text), text, "请概括这一场景的情节、出场人物和情绪走向")
+                        for w, text in sorted(scene_text.items())])
+
+        chapters = {}
+        for w in sorted(scene_text):
+            chapters.setdefault(self.chapter_of(w), []).append(self.scene_summary(w))
+        chapter_jobs = []
+        for c, summaries in sorted(chapters.items()):
+            text = "\n".join(summaries)
+            chapter_jobs.append((c, _digest(text), text, "请把这一章各场景的摘要合并为一段章节梗概"))
+        fill("chapters", chapter_jobs)
+
+        # 前情：story[0] 为空，story[c] 依赖 story[c-1]，只能顺序计算
+        previous = ""
+        for c in sorted(chapters)[1:]:
+            chapter = self.chapter_summary(c - 1)
+            text = f"前情：{previous}\n新章节：{chapter}"
+            fill("story", [(c, _digest(text), text, "请把前情与新章节压缩为一段截至目前的故事梗概")])
+            previous = self.story_summary(c)
+        print(f"摘要已就绪：{len(scene_text)} 个场景，{len(chapters)} 章，本次调用模型 {calls} 次")
+
+    def scene_summary(self, window_idx: int) -> str:
+        entry = self.cache["scenes"].get(str(window_idx))
+        return entry["summary"] if entry else ""
+
+    def chapter_summary(self, chapter: int) -> str:
+        entry = self.cache["chapters"].get(str(chapter))
+        return entry["summary"] if entry else ""
+
+    def story_summary(self, chapter: int) -> str:
+        entry = self.cache["story"].get(str(chapter))
+        return entry["summary"] if entry else ""
+
+    def context(self, i: int, budget: int = None) -> str:
+        """第 i 行（在 turns 中的位置）的背景，总长度不超过 token 预算（缺省为构造时的 budget）。"""
+        w = self.windows[i]
+        c = self.chapter_of(w)
+        remaining = self.budget if budget is None else budget
+
+        # 最近 k 句原文优先保证，从最近的一句往前取
+        recent = []
+        for j in range(i - 1, max(-1, i - 1 - self.recent_turns), -1):
+            cost = estimate_tokens(self.texts[j]) + 1
+            if cost > remaining:
+                break
+            recent.insert(0, self.texts[j])
+            remaining -= cost
+
+        story = truncate_tokens(self.story_summary(c), min(self.story_budget, remaining))
+        remaining -= estimate_tokens(story)
+
+        # 本章此前的场景摘要，由近到远放入，放不下即停止
+        scenes = []
+        first = c * self.chapter_windows + 1
+        for prev in range(w - 1, first - 1, -1):
+            summary = self.scene_summary(prev)
+            if not summary:
+                continue
+            cost = estimate_tokens(summary) + 1
+            if cost > remaining:
+                break
+            scenes.insert(0, summary)
+            remaining -= cost
+
+        parts = []
+        if story:
+            parts.append(f"前情提要：{story}")
+        if scenes:
+            parts.append("本章此前：" + " ".join(scenes))
+        if recent:
+            parts.append("\n".join(recent))
+        return "\n".join(parts)
@@ -0,0 +1,391 @@
+import os
+import re
+import sys
+import csv
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dataset_builder"))
+
+
+# Critic 模块：对生成结果打质量分并筛选。先用本地启发式快速打分，只把拿不准的样本交给大模型评审。
+#
+# 样本来源：
+#   - 3_decoder_*.csv：text（原文）→ dialogue（剧本）→ speaking_style（解码器 JSON）；
+#   - SFT 语料（JSON / JSONL 文件或目录，Alpaca / ShareGPT）：human 侧为输入，assistant 侧为输出，
+#     第三类数据的输入只取【当前小说段落】。
+# 本地特征（只看输出，输入用于长度比）：
+#   json_ok     解码器输出 / JSON 格式输出能否解析，不能解析直接淘汰
+#   length      输出 / 输入的字数比，落在 LENGTH_RANGE 之外按偏离倍数扣分
+#   cjk         汉字占非空白字符的比例（与 predict.py 的 chinese_pattern 范围相同）
+#   repetition  重复出现的字符 4-gram 占比
+# 启发式分数 ≥ ACCEPT 直接通过，≤ REJECT 直接淘汰，介于两者之间的才调用模型打 1-10 分。
+# 评分写入 SQLite 库的 scores 表，按 (source, verdict, score) 建索引，筛选只是一条索引查询；
+# 样本内容不变时重复运行不会重新评分。
+
+CRITIC_DB     = "critic.db"
+ACCEPT        = 0.8     # 启发式分数不低于该值直接通过
+REJECT        = 0.3     # 启发式分数不高于该值直接淘汰
+LLM_PASS      = 0.6     # 模型评分（归一化到 0-1）不低于该值视为通过
+LENGTH_RANGE  = {"decoder": (0.6, 4.0), "sft": (0.3, 30.0)}   # 输出 / 输入字数比的正常范围
+CJK_MIN       = 0.5     # 汉字比例低于该值开始扣分
+REPEAT_MAX    = 0.2     # 重复 4-gram 比例高于该值开始扣分
+NGRAM         = 4
+CONCURRENCY   = 8       # 模型评审的在途请求数
+LLM_ATTEMPTS  = 3       # 每条样本最多请求次数
+LLM_BATCH     = 500     # 每批交给引擎的样本数，批次之间提交一次
+MAX_CHARS     = 1500    # 送评时输入 / 输出各自截断的字数
+
+chinese_pattern = re.compile(r'[\u4e00-\u9fff]')
+
+JUDGE_PROMPT = """你是一个严格的数据质量评审。下面是一条由模型生成的训练样本，请判断输出是否忠实于输入、
+语言是否通顺自然、是否存在重复堆砌或格式错误，给出 1-10 的整数分（10 为最好）。
+只输出 JSON：{{"score": 分数, "reason": "一句话理由"}}
+
+【输入】
+{input}
+
+【输出】
+{output}"""
+
+
+# ———— 本地启发式 ————
+
+def cjk_ratio(text: str) -> float:
+    chars = re.sub(r"\s", "", text)
+    return len(chinese_pattern.findall(chars)) / len(chars) if chars else 0.0
+
+
+def repetition(text: str, n: int = NGRAM) -> float:
+    """重复的字符 n-gram 占全部 n-gram 的比例，0 为无重复。"""
+    chars = re.sub(r"\s", "", text)
+    total = len(chars) - n + 1
+    if total <= 1:
+        return 0.0
+    return 1 - len({chars[i:i + n] for i in range(total)}) / total
+
+
+def _json_ok(kind: str, output: str, extra: str):
+    """解码器样本校验 speaking_style 列；SFT 样本只有输出形如 JSON 对象时才校验，否则不适用（None）。"""
+    from decoder_output import parse_decoder_output
+
+    if kind == "decoder":
+        try:
+            parse_decoder_output(extra)
+            return True
+        except ValueError:
+            return False
+    stripped = output.strip()
+    if not stripped.startswith("{"):
+        return None
+    try:
+        json.loads(stripped, strict=False)
+        return True
+    except json.JSONDecodeError:
+        return False
+
+
+def heuristics(kind: str, input_text: str, output: str, extra: str = "") -> dict:
+    """计算本地特征与启发式分数（0-1）。"""
+    json_ok = _json_ok(kind, output, extra)
+    ratio = len(output) / max(len(input_text), 1)
+    cjk = cjk_ratio(output)
+    rep = repetition(output)
+
+    if json_ok is False or not output.strip():
+        score = 0.0
+    else:
+        lo, hi = LENGTH_RANGE[kind]
+        length_factor = 1.0 if lo <= ratio <= hi else (ratio / lo if ratio < lo else hi / ratio)
+        cjk_factor = min(1.0, cjk / CJK_MIN)
+        rep_factor = 1.0 if rep <= REPEAT_MAX else max(0.0, 1 - (rep - REPEAT_MAX) / (1 - REPEAT_MAX))
+        score = length_factor * cjk_factor * rep_factor
+    return {"json_ok": json_ok, "length_ratio": ratio, "cjk_ratio": cjk, "repetition": rep,
+            "heuristic": round(score, 4)}
+
+
+# ———— 样本读取 ————
+
+def _digest(*parts) -> str:
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(str(p).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:16]
+
+
+def iter_decoder_csv(path: str):
+    """3_decoder_*.csv → (item, input, output, extra)，item 为台词 id。"""
+    csv.field_size_limit(sys.maxsize)
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            yield str(row["id"]), row.get("text") or "", row.get("dialogue") or "", row.get("speaking_style") or ""
+
+
+def iter_sft(path: str):
+    """SFT 语料 → (item, input, output, "")，item 为文件内编号；多轮对话只评最后一轮。"""
+    from json_index import JsonIndex
+    from mix_corpus import to_turns
+    from type3_store import parse_input
+
+    with JsonIndex(path) as index:
+        for i in range(len(index)):
+            record = index[i]
+            turns = (to_turns(record) if isinstance(record, dict) else None) or []
+            dialog = [t for t in turns if t["from"] != "system"]
+            human = next((t["value"] for t in reversed(dialog) if t["from"] == "human"), "")
+            output = dialog[-1]["value"] if dialog and dialog[-1]["from"] != "human" else ""
+            # Alpaca 记录的 human 侧为 "instruction\ninput"，模板从 input 开始
+            start = human.find("【完整故事背景】:\n---")
+            parts = parse_input(human[start:]) if start >= 0 else None
+            yield str(i), parts[2] if parts else human, output, ""
+
+
+def source_kind(path: str) -> str:
+    return "decoder" if path.endswith(".csv") else "sft"
+
+
+def iter_samples(path: str):
+    return iter_decoder_csv(path) if source_kind(path) == "decoder" else iter_sft(path)
+
+
+def expand_sources(paths) -> list:
+    """目录展开为其中的 CSV 与 JSON / JSONL 文件。"""
+    from dedup_corpus import expand_paths
+
+    out = []
+    for path in paths:
+        if os.path.isdir(path):
+            out += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".csv"))
+        out += expand_paths([path])
+    return [os.path.normpath(p) for p in out]
+
+
+# ———— 评分库 ————
+
+class ScoreDB:
+    """scores 表：每个 (source, item) 一行；verdict 为 pass / reject / pending（待模型评审）。"""
+
+    def __init__(self, path: str = CRITIC_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS scores (
+                source TEXT NOT NULL,
+                item TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                json_ok INTEGER,
+                length_ratio REAL,
+                cjk_ratio REAL,
+                repetition REAL,
+                heuristic REAL NOT NULL,
+                llm_score REAL,
+                score REAL NOT NULL,
+                verdict TEXT NOT NULL,
+                reason TEXT,
+                scored_at REAL NOT NULL,
+                PRIMARY KEY (source, item)
+            );
+            CREATE INDEX IF NOT EXISTS idx_scores_filter ON scores(source, verdict, score);
+            CREATE INDEX IF NOT EXISTS idx_scores_score ON scores(source, score);
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def digests(self, source: str) -> dict:
+        return dict(self.conn.execute("SELECT item, digest FROM scores WHERE source = ? AND verdict != 'pending'",
+                                      (source,)))
+
+    def upsert(self, source: str, rows):
+        """rows: [(item, digest, features, verdict, reason)]，score 先取启发式分数。"""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL, ?, ?, ?, ?)",
+            [(source, item, digest, f["json_ok"], f["length_ratio"], f["cjk_ratio"], f["repetition"],
+              f["heuristic"], f["heuristic"], verdict, reason, now)
+             for item, digest, f, verdict, reason in rows])
+        self.conn.commit()
+
+    def set_llm(self, source: str, item: str, llm_score: float, reason: str):
+        self.conn.execute(
+            "UPDATE scores SET llm_score = ?, score = ?, verdict = ?, reason = ?, scored_at = ? "
+            "WHERE source = ? AND item = ?",
+            (llm_score, llm_score, "pass" if llm_score >= LLM_PASS else "reject", reason, time.time(),
+             source, item))
+
+    def passed(self, source: str, min_score: float = None) -> set:
+        """通过的样本编号；给定 min_score 时改为按分数筛选（不论 verdict）。"""
+        if min_score is None:
+            rows = self.conn.execute("SELECT item FROM scores WHERE source = ? AND verdict = 'pass'", (source,))
+        else:
+            rows = self.conn.execute("SELECT item FROM scores WHERE source = ? AND score >= ?", (source, min_score))
+        return {r[0] for r in rows}
+
+    def summary(self) -> list:
+        return self.conn.execute(
+            "SELECT source, verdict, COUNT(*), AVG(score), SUM(llm_score IS NOT NULL) "
+            "FROM scores GROUP BY source, verdict ORDER BY source, verdict").fetchall()
+
+
+# ———— 模型评审 ————
+
+def init_client():
+    from llm_client import get_async_client
+    from config import API_KEY
+    return get_async_client(API_KEY)
+
+
+def parse_judgement(content: str):
+    """从模型回复中取出 (score 0-1, reason)；取不到时返回 None，引擎会补发。"""
+    m = re.search(r"\{.*\}", content, flags=re.S)
+    try:
+        data = json.loads(m.group(0), strict=False) if m else None
+        score = float(data["score"])
+    except (ValueError, TypeError, KeyError):
+        return None
+    if not 1 <= score <= 10:
+        return None
+    return score / 10, str(data.get("reason", ""))
+
+
+async def judge_samples(db: ScoreDB, source: str, samples: dict, concurrency: int = CONCURRENCY) -> int:
+    """samples: {item: (input, output)}，逐批交给 generate_until 并发评审；返回评审成功的条数。"""
+    from llm_engine import generate_until
+
+    client = init_client()
+
+    async def produce(item):
+        input_text, output = samples[item]
+        resp = await client.chat.completions.create(
+            model="deepseek-chat",
+            messages=[{"role": "user", "content": JUDGE_PROMPT.format(input=input_text[:MAX_CHARS],
+                                                                      output=output[:MAX_CHARS])}],
+            temperature=0.0,
+            max_tokens=100,
+        )
+        return parse_judgement(resp.choices[0].message.content)
+
+    def on_result(item, judgement):
+        db.set_llm(source, item, *judgement)
+
+    judged = 0
+    items = list(samples)
+    for start in range(0, len(items), LLM_BATCH):
+        batch = items[start:start + LLM_BATCH]
+        stats = await generate_until({k: 1 for k in batch}, produce, on_result, concurrency=concurrency,
+                                     max_attempts={k: LLM_ATTEMPTS for k in batch})
+        db.conn.commit()
+        judged += sum(s["accepted"] for s in stats.values())
+        print(f"模型评审 {min(start + LLM_BATCH, len(items))}/{len(items)}")
+    await client.close()
+    return judged
+
+
+# ———— 流程 ————
+
+def score_source(db: ScoreDB, path: str, use_llm: bool = True, concurrency: int = CONCURRENCY,
+                 rescore: bool = False) -> dict:
+    """
+    对一个来源打分：内容未变且已有结论的样本跳过，其余（含上次留下的 pending）先算启发式，
+    borderline 样本交给模型评审；use_llm 为 False 时保持 pending，下次运行再评。
+    """
+    import asyncio
+
+    kind = source_kind(path)
+    known = {} if rescore else db.digests(path)
+    counts = {"skipped": 0, "pass": 0, "reject": 0, "pending": 0}
+    rows, borderline = [], {}
+    for item, input_text, output, extra in iter_samples(path):
+        digest = _digest(input_text, output, extra)
+        if known.get(item) == digest:
+            counts["skipped"] += 1
+            continue
+        features = heuristics(kind, input_text, output, extra)
+        if features["heuristic"] >= ACCEPT:
+            verdict = "pass"
+        elif features["heuristic"] <= REJECT:
+            verdict = "reject"
+        else:
+            verdict = "pending"
+            borderline[item] = (input_text, output)
+        counts[verdict] += 1
+        rows.append((item, digest, features, verdict, "heuristic"))
+    db.upsert(path, rows)
+
+    if use_llm and borderline:
+        judged = asyncio.run(judge_samples(db, path, borderline, concurrency))
+        counts["pending"] -= judged
+        counts["llm_judged"] = judged
+    return counts
+
+
+def filter_source(db: ScoreDB, path: str, output_path: str, min_score: float = None) -> int:
+    """按评分库筛出通过的样本：CSV 写同结构的 CSV，JSON / JSONL 写 JSONL；返回保留条数。"""
+    keep = db.passed(path, min_score)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    kept = 0
+    if source_kind(path) == "decoder":
+        csv.field_size_limit(sys.maxsize)
+        with open(path, encoding="utf-8-sig", newline="") as f, \
+                open(output_path, "w", encoding="utf-8-sig", newline="") as out:
+            reader = csv.DictReader(f)
+            writer = csv.DictWriter(out, fieldnames=reader.fieldnames)
+            writer.writeheader()
+            for row in reader:
+                if str(row["id"]) in keep:
+                    writer.writerow(row)
+                    kept += 1
+    else:
+        from json_index import JsonIndex
+
+        with JsonIndex(path) as index, open(output_path, "w", encoding="utf-8") as out:
+            for i in range(len(index)):
+                if str(i) in keep:
+                    out.write(json.dumps(index[i], ensure_ascii=False) + "\n")
+                    kept += 1
+    return kept
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成结果的质量评分与筛选：本地启发式预筛 + 模型评审")
+    parser.add_argument("--db", default=CRITIC_DB, help="评分库路径")
+    sub = parser.add_subparsers(dest="command", required=True)
+    s = sub.add_parser("score", help="为 3_decoder_*.csv 或 SFT 语料打分")
+    s.add_argument("paths", nargs="+", help="CSV / JSON / JSONL 文件或目录")
+    s.add_argument("--no-llm", action="store_true", help="只做本地启发式，borderline 样本保持 pending")
+    s.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    s.add_argument("--rescore", action="store_true", help="忽略已有评分，全部重新打分")
+    f = sub.add_parser("filter", help="按评分筛出通过的样本")
+    f.add_argument("path")
+    f.add_argument("output")
+    f.add_argument("--min-score", type=float, help="按分数阈值筛选，缺省为 verdict = pass")
+    sub.add_parser("report", help="按来源与结论汇总评分")
+    args = parser.parse_args(argv)
+
+    with ScoreDB(args.db) as db:
+        if args.command == "score":
+            for path in expand_sources(args.paths):
+                counts = score_source(db, path, not args.no_llm, args.concurrency, args.rescore)
+                print(f"📝 {path}：{counts}")
+        elif args.command == "filter":
+            kept = filter_source(db, os.path.normpath(args.path), args.output, args.min_score)
+            print(f"✅ 保留 {kept} 条，保存到 {args.output}")
+        else:
+            for source, verdict, n, avg, judged in db.summary():
+                print(f"{source}\t{verdict}\t{n} 条\t平均分 {avg:.3f}\t模型评审 {judged} 条")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import re
+import json
+
+
+# for_decoder / convert_to_decoder.py 输出的解析与序列化。
+# 模型输出形如 ```json {...} ```，写入存储前换行已转义为字面的 \n。
+
+
+def check_dialogue(value):
+    """dialogue 结果校验：空结果或旧版写入的 "(生成失败…)" 占位视为失败。"""
+    from turn_store import LEGACY_FAILURE_PREFIX
+
+    if not value or not value.strip():
+        raise ValueError("空结果")
+    if value.startswith(LEGACY_FAILURE_PREFIX):
+        raise ValueError(value)
+
+
+def parse_decoder_output(value) -> dict:
+    """
+    解析 for_decoder 的输出（```json 包裹、换行已转义为 \\n），返回 dict；
+    无法解析或缺少 dialogues 时抛 ValueError，该行会被记为失败并可用 --retry-failed 重跑。
+    """
+    check_dialogue(value)
+    raw = value.replace("\\n", "\n")
+    m = re.search(r"```json\s*(\{.*\})\s*```", raw, flags=re.S) or re.search(r"(\{.*\})", raw, flags=re.S)
+    if not m:
+        raise ValueError("输出中没有 JSON 对象")
+    body = re.sub(r",\s*([}\]])", r"\1", m.group(1))   # 容忍示例格式中的尾随逗号
+    try:
+        data = json.loads(body, strict=False)   # 对白中可能含有还原出的换行
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON 解析失败：{e}") from None
+    if not isinstance(data, dict) or not isinstance(data.get("dialogues"), list):
+        raise ValueError("JSON 缺少 dialogues 列表")
+    return data
+
+
+def dump_decoder_output(data: dict) -> str:
+    """把解析后的结果重新序列化为与模型输出相同的存储格式（```json 包裹、单行）。"""
+    return "```json\\n" + json.dumps(data, ensure_ascii=False) + "\\n```"
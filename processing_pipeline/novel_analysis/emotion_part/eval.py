@@ -1,9 +1,11 @@
 import os
-import pandas as pd
-import torch
-import numpy as np
-from transformers import BertTokenizer, BertForSequenceClassification
-import joblib
+import sys
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "utils"))
+
+# torch / transformers / joblib / pandas 只在 main() 中真正开始评估时导入，
+# 模型也只在那时加载，`--help` 无需等待权重加载。
 
 # ====== 配置 ======
 MODEL_DIR    = "Model_Weight"
@@ -12,48 +14,99 @@ INPUT_CSV    = "../mid_output/1_提取后结果.csv"
 OUTPUT_CSV   = "../mid_output/2_提取后结果_情绪.csv"
 BATCH_SIZE   = 16
 THRESHOLD    = 0.5   # 置信度阈值，低于此值标为 NaN
-DEVICE       = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-# ====== 加载模型与编码器 ======
-tokenizer     = BertTokenizer.from_pretrained(MODEL_DIR)
-model         = BertForSequenceClassification.from_pretrained(MODEL_DIR)
-model.to(DEVICE).eval()
-label_encoder = joblib.load(ENCODER_PATH)
-classes       = label_encoder.classes_
-
-# ====== 读取待评估数据 ======
-df    = pd.read_csv(INPUT_CSV, encoding="utf-8-sig")
-texts = df["text"].fillna("").tolist()
-
-# ====== 批量预测情绪标签 ======
-emo_labels = []
-with torch.no_grad():
-    for i in range(0, len(texts), BATCH_SIZE):
-        batch_texts = texts[i: i + BATCH_SIZE]
-        enc = tokenizer(
-            batch_texts,
-            padding=True,
-            truncation=True,
-            max_length=64,
-            return_tensors="pt"
-        )
-        input_ids     = enc["input_ids"].to(DEVICE)
-        attention_mask = enc["attention_mask"].to(DEVICE)
-
-        outputs = model(input_ids, attention_mask=attention_mask)
-        probs   = torch.softmax(outputs.logits, dim=-1).cpu().numpy()
-        preds   = np.argmax(probs, axis=1)
-        max_probs = np.max(probs, axis=1)
-
-        for pred, mp in zip(preds, max_probs):
-            if mp >= THRESHOLD:
-                emo_labels.append(classes[pred])
-            else:
-                emo_labels.append(np.nan)
-
-# ====== 写入结果并保存 ======
-df["emo_label"] = emo_labels
-os.makedirs(os.path.dirname(OUTPUT_CSV), exist_ok=True)
-df.to_csv(OUTPUT_CSV, index=False, encoding="utf-8-sig")
-
-print(f"✅ 完成情绪预测，结果已保存到 {OUTPUT_CSV}")
\ No newline at end of file
+
+
+def load_model(model_dir=MODEL_DIR, encoder_path=ENCODER_PATH):
+    """加载分词器、分类模型与标签编码器，返回 (tokenizer, model, classes, device)。"""
+    import torch
+    import joblib
+    from transformers import BertTokenizer, BertForSequenceClassification
+
+    device        = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    tokenizer     = BertTokenizer.from_pretrained(model_dir)
+    model         = BertForSequenceClassification.from_pretrained(model_dir)
+    model.to(device).eval()
+    label_encoder = joblib.load(encoder_path)
+    return tokenizer, model, label_encoder.classes_, device
+
+
+def predict_labels(texts, tokenizer, model, classes, device, batch_size=BATCH_SIZE, threshold=THRESHOLD):
+    """批量预测情绪标签，置信度低于 threshold 的记为 NaN。"""
+    import torch
+    import numpy as np
+
+    emo_labels = []
+    with torch.no_grad():
+        for i in range(0, len(texts), batch_size):
+            batch_texts = texts[i: i + batch_size]
+            enc = tokenizer(
+                batch_texts,
+                padding=True,
+                truncation=True,
+                max_length=64,
+                return_tensors="pt"
+            )
+            input_ids     = enc["input_ids"].to(device)
+            attention_mask = enc["attention_mask"].to(device)
+
+            outputs = model(input_ids, attention_mask=attention_mask)
+            probs   = torch.softmax(outputs.logits, dim=-1).cpu().numpy()
+            preds   = np.argmax(probs, axis=1)
+            max_probs = np.max(probs, axis=1)
+
+            for pred, mp in zip(preds, max_probs):
+                if mp >= threshold:
+                    emo_labels.append(classes[pred])
+                else:
+                    emo_labels.append(np.nan)
+    return emo_labels
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="为抽取结果批量预测情绪标签（emo_label 列）")
+    parser.add_argument("--input", default=INPUT_CSV, help="阶段一输出的 CSV")
+    parser.add_argument("--output", default=OUTPUT_CSV, help="追加 emo_label 列后的输出 CSV")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="置信度阈值")
+    parser.add_argument("--store", default=None,
+                        help="列式存储目录（如 ../mid_output/<folder>）；指定后读取 text 并写入 emo_label 列，忽略 --input/--output")
+    args = parser.parse_args(argv)
+
+    # ====== 加载模型与编码器 ======
+    tokenizer, model, classes, device = load_model()
+
+    if args.store:
+        from turn_columns import TurnColumns
+
+        # 只映射读取 id/text 两列，结果作为单独的 emo_label 列追加
+        store = TurnColumns(args.store)
+        base  = store.read_base().select(["id", "text"])
+        texts = [t or "" for t in base["text"].to_pylist()]
+        emo_labels = predict_labels(texts, tokenizer, model, classes, device, args.batch_size, args.threshold)
+        store.append("emo_label", base["id"].to_pylist(), emo_labels)
+        store.compact("emo_label")
+        print(f"✅ 完成情绪预测，结果已写入 {args.store} 的 emo_label 列")
+        return
+
+    import pandas as pd
+    from stream_io import open_stream, resolve
+
+    # ====== 读取待评估数据（输入、输出均可为 .zst / .gz，只有压缩版本时自动使用） ======
+    with open_stream(resolve(args.input), "r", encoding="utf-8-sig", newline="") as f:
+        df = pd.read_csv(f)
+    texts = df["text"].fillna("").tolist()
+
+    # ====== 批量预测情绪标签 ======
+    emo_labels = predict_labels(texts, tokenizer, model, classes, device, args.batch_size, args.threshold)
+
+    # ====== 写入结果并保存 ======
+    df["emo_label"] = emo_labels
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open_stream(args.output, "w", encoding="utf-8-sig", newline="") as f:
+        df.to_csv(f, index=False)
+
+    print(f"✅ 完成情绪预测，结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
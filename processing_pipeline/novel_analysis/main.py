@@ -1,26 +1,75 @@
 import os
 import json
 import re
-import pandas as pd
-from openai import OpenAI
+import sys
+import time
+import argparse
 from multiprocessing import Process, Queue, current_process
-from tqdm import tqdm  # 新增进度条
-from config import API_KEY
-import csv
 
-# ———— 配置 ————
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from decoder_output import check_dialogue, parse_decoder_output, dump_decoder_output
+from stream_io import open_stream, strip_compression, with_compression
+
+# openai / tqdm / pyarrow / sqlite 状态库以及 config 均在对应阶段真正运行时才导入，
+# 这样 `python main.py --help` 或只跑部分阶段时不必支付它们的导入开销。
 
+# ———— 配置 ————
+BASE_URL       = "https://api.deepseek.com/v1"
+INPUT_DIR      = "../A_get_novel/textbook/textbook/"
+OUTPUT_DIR     = "mid_output/"   # 每部小说一个列式存储目录：mid_output/<folder>/
+OUTPUT_script  = "output/"
+OUTPUT_decoder = "output_decoder/"
+FILE_NUMBERS   = 10     # 读取的章节数
+NUM_WORKERS    = 5      # 同时的处理数
+WINDOW_SIZE    = 40     # 每个滑窗的行数
+OVERLAP_RATE   = 2/3    # overlap 模式下每个窗口与上一个窗口重叠2/3
+EXTRACT_MODE   = "disjoint"  # disjoint：不重叠滑窗 + 只读前文 + 边界拼接；overlap：旧版重叠滑窗 + 全局去重
+CONTEXT_LINES  = 5      # disjoint 模式下每个窗口附带的只读前文行数
+STAGES         = ["extract", "roles", "summaries", "script", "decoder"]  # 可选阶段，按顺序执行
+EXPORT_CSV     = True   # 各阶段结束后额外导出 CSV，供仍读取 CSV 的下游脚本使用
+COMPRESS       = ""     # 导出 CSV 的压缩格式："" 不压缩，"zst" / "gz" 流式压缩（下游脚本经 stream_io 可直接读取）
+STAGE_WORKERS  = 8      # 生成阶段（script / decoder）的并发线程数
+TURN_DB        = "turns.db"  # 每部小说存储目录下的 SQLite 状态库
+MAX_ATTEMPTS   = None   # --retry-failed 时只重试尝试次数少于该值的行，None 为不限
+ROUTING_RULES  = None   # 按行路由规则的 JSON 文件，None 使用 router.py 中的默认规则
+RULE_CONFIDENCE = 0.8   # 规则抽取置信度不低于该值的滑窗不再调用模型；设为大于 1 时全部交给模型
+CALL_DEADLINE  = 300    # 单次模型调用（含对冲请求）的截止秒数，超时记为失败；None 为不限
+HEDGE_QUANTILE = 0.95   # 调用超过近期延迟的该分位数仍未返回时，再发一个相同的请求，取先返回的
+HEDGE_BUDGET   = 0.05   # 对冲请求数占调用数的上限，设为 0 关闭对冲
+BATCH_MODE     = False  # script / decoder 阶段改为离线批任务：编译请求、提交、轮询后按行 id 合并结果
+BATCH_BASE_URL = "http://127.0.0.1:8765/v1"  # OpenAI 兼容的批任务接口（DeepSeek 无批任务接口时用本地 batch_server.py 转发）
+POLL_SECONDS   = 60     # 批任务轮询间隔
+COST_MODEL     = os.path.join(OUTPUT_DIR, "cost_model.json")  # 各阶段耗时模型（提示 token → 秒），跨运行累计
+PRIORITY_FOLDERS = []   # 优先处理的小说文件夹，按列表顺序排在其余文件夹之前
+NORMALIZE      = True   # 抽取前清洗原文（空行、全角空格、爬虫残留等），结果按文件哈希缓存
+NORMALIZED_DIR = os.path.join(OUTPUT_DIR, ".normalized")
+JOB_QUEUE      = None   # 多机模式：共享文件系统上的任务队列库（如 /mnt/shared/jobs.db），OUTPUT_DIR 也须在共享文件系统上
+LEASE_SECONDS  = 300    # 多机模式下文件夹、滑窗与台词行的租约，持有者宕机后超过该时间即被其他 worker 接管
+LOCAL_WORKERS  = 1      # 多机模式下本机启动的 worker 进程数（单机上开多个即可模拟多台机器）
+FOLDER_QUEUE   = "folders"
 # —————————————————
 
 def init_client():
-    return OpenAI(api_key=API_KEY, base_url="https://api.deepseek.com")
+    # 同一进程内的各阶段、各线程共用一个带连接池的客户端
+    from llm_client import get_client
+    from config import API_KEY
+    return get_client(API_KEY)
 
-def extract_turns_from_text(text: str, client) -> list[dict]:
+def extract_turns_from_text(text: str, client, context: str = "") -> list[dict]:
     """
     调用 DeepSeek，从一段小说文本中抽取 [{local_id, role, text}, …]
     local_id 为该滑窗内部自增编号，从 1 开始。
     为提高鲁棒性，要求模型用 ```json ...``` 包裹输出，并严格输出合法 JSON。
+    context 为只读前文，只用于理解说话人与指代，不参与抽取。
     """
+    if context:
+        context_block = (
+            "【前文】（只读，仅供理解说话人和指代，不要从中抽取任何内容）：\n"
+            f"{context}\n"
+            "【待抽取内容】（只抽取这一部分）：\n"
+        )
+    else:
+        context_block = ""
     prompt = (
         "你是一个剧本抽取器。\n"
         "请从下面这段小说中提取所有与“角色”相关的文本片段，\n"
@@ -34,7 +83,7 @@ def extract_turns_from_text(text: str, client) -> list[dict]:
         "]\n"
         "``` \n"
         "不要输出任何其他内容。\n\n"
-        f"小说内容：\n{text}"
+        f"小说内容：\n{context_block}{text}"
     )
     resp = client.chat.completions.create(
         model="deepseek-chat",
@@ -50,23 +99,101 @@ def extract_turns_from_text(text: str, client) -> list[dict]:
     json_str = m.group(1) if m else raw.strip()
     return json.loads(json_str)
 
-def worker(input_queue: Queue, result_queue: Queue):
+def worker(input_queue: Queue, result_queue: Queue, deadline=CALL_DEADLINE,
+           hedge_quantile=HEDGE_QUANTILE, hedge_budget=HEDGE_BUDGET):
+    from llm_client import format_reuse_stats
+    from llm_engine import Hedger
+
     client = init_client()
+    # 截止时间保证卡住的调用不会拖住本 worker 队列中的其余滑窗
+    hedger = Hedger(deadline, hedge_quantile, hedge_budget)
     while True:
         item = input_queue.get()
         if item is None:
+            print(f"[{current_process().name}] {format_reuse_stats()}")
             break
-        window_idx, window_text = item
+        window_idx, window_text, context = item
         print(f"[{current_process().name}] 处理滑窗 #{window_idx}")
 
         try:
-            turns = extract_turns_from_text(window_text, client)
+            turns = hedger.call(extract_turns_from_text, window_text, client, context)
             for t in turns:
                 t["window_idx"] = window_idx
-            result_queue.put(turns)
         except Exception as e:
             print(f"[{current_process().name}] 错误 in window {window_idx}: {e}")
-            result_queue.put([])
+            turns = []
+        # 单线程调用，records[-1] 即本滑窗的调用记录，交给主进程汇总延迟分位数
+        result_queue.put((window_idx, turns, hedger.records[-1]))
+
+def queue_worker(queue_path, queue_name, parts_dir, name, lease_seconds=LEASE_SECONDS, wait=True,
+                 deadline=CALL_DEADLINE, hedge_quantile=HEDGE_QUANTILE, hedge_budget=HEDGE_BUDGET):
+    """
+    多机模式的抽取 worker：从共享队列领取滑窗，结果追加到自己的分片 <parts_dir>/<name>.jsonl。
+    wait 为 True 时（本文件夹的领取者）等到队列中的滑窗全部完成才退出，期间接管租约过期的滑窗；
+    为 False 时（协助其他文件夹）没有可领取的滑窗即退出。
+    """
+    from llm_engine import Hedger
+    from job_queue import JobQueue, Heartbeat, append_part, heartbeat_interval, POLL_SECONDS
+
+    client = init_client()
+    hedger = Hedger(deadline, hedge_quantile, hedge_budget)
+    queue = JobQueue(queue_path)
+    with Heartbeat(lambda: queue.heartbeat(name, lease_seconds), heartbeat_interval(lease_seconds)):
+        while True:
+            jobs = queue.claim(queue_name, name, lease_seconds)
+            if not jobs:
+                if not wait or queue.drained(queue_name):
+                    break
+                time.sleep(POLL_SECONDS)
+                continue
+            window_idx = int(jobs[0]["key"])
+            window_text, context = jobs[0]["payload"]
+            print(f"[{name}] 处理滑窗 #{window_idx}")
+            try:
+                turns = hedger.call(extract_turns_from_text, window_text, client, context)
+                for t in turns:
+                    t["window_idx"] = window_idx
+            except Exception as e:
+                print(f"[{name}] 错误 in window {window_idx}: {e}")
+                turns = []
+            append_part(parts_dir, name, [{"key": jobs[0]["key"], "turns": turns, "record": hedger.records[-1]}])
+            if not queue.complete(queue_name, jobs[0]["key"], name):
+                print(f"[{name}] 滑窗 #{window_idx} 的租约已被接管，本次结果不采用")
+
+def run_window_workers(cluster, queue_name, parts_dir, num_workers, wait=True, deadline=CALL_DEADLINE,
+                       hedge_quantile=HEDGE_QUANTILE, hedge_budget=HEDGE_BUDGET):
+    """在本机启动 num_workers 个 queue_worker 进程领取同一个滑窗队列，全部退出后返回。"""
+    workers = [
+        Process(target=queue_worker,
+                args=(cluster.path, queue_name, parts_dir, f"{cluster.worker}.w{i+1}", cluster.lease_seconds,
+                      wait, deadline, hedge_quantile, hedge_budget),
+                name=f"Worker-{i+1}")
+        for i in range(num_workers)
+    ]
+    for p in workers: p.start()
+    for p in workers: p.join()
+
+def extract_shared(cluster, store_dir, tasks, costs, num_workers, deadline=CALL_DEADLINE,
+                   hedge_quantile=HEDGE_QUANTILE, hedge_budget=HEDGE_BUDGET):
+    """
+    多机模式的滑窗分发：滑窗登记到共享队列 windows/<folder>/<滑窗内容摘要>（预测耗时长的先被领取），
+    本机与其他机器的 worker 一同领取；全部完成后按队列记录的完成者合并各 worker 的分片，
+    返回 [(window_idx, turns, 调用记录)]，按滑窗顺序排列。
+    内容摘要使同一文件夹重新领取后沿用已完成的滑窗，参数或原文变化后则是新的队列。
+    """
+    import hashlib
+    from job_queue import merge_parts, DONE
+
+    digest = hashlib.sha1(json.dumps(tasks, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+    queue_name = f"windows/{os.path.basename(os.path.normpath(store_dir))}/{digest}"
+    parts_dir = os.path.join(store_dir, "parts", "extract", digest)
+    cluster.queue.add(queue_name, [(idx, [text, context]) for idx, text, context in tasks],
+                      priority=lambda idx: costs[idx])
+    print(f"滑窗队列 {queue_name}：{cluster.queue.counts(queue_name)}")
+    run_window_workers(cluster, queue_name, parts_dir, num_workers, True, deadline, hedge_quantile, hedge_budget)
+    owners = {j["key"]: j["worker"] for j in cluster.queue.jobs(queue_name, DONE)}
+    merged = merge_parts(parts_dir, owners)
+    return sorted((int(key), r["turns"], r["record"]) for key, r in merged.items())
 
 def rewrite_global(all_turns: list[dict]) -> list[dict]:
     # 1. 按 window_idx & local id 排序
@@ -83,296 +210,774 @@ def rewrite_global(all_turns: list[dict]) -> list[dict]:
         t["id"] = idx
     return unique
 
-def main_multiprocess_rr():
-    # 1. 读取并排序前 NUM_WORKERS 个文件
+def main_multiprocess_rr(input_dir, store_dir, file_numbers=FILE_NUMBERS, num_workers=NUM_WORKERS,
+                         window_size=WINDOW_SIZE, overlap_rate=OVERLAP_RATE, export_path=None,
+                         rule_confidence=RULE_CONFIDENCE, mode=EXTRACT_MODE, context_lines=CONTEXT_LINES,
+                         deadline=CALL_DEADLINE, hedge_quantile=HEDGE_QUANTILE, hedge_budget=HEDGE_BUDGET,
+                         normalize=NORMALIZE, cluster=None):
+    from tqdm import tqdm
+    from turn_columns import TurnColumns
+    from turn_store import TurnStore
+    from rule_extractor import RuleExtractor
+    from role_registry import load_registry, ROLES_FILE
+    from window_stitcher import build_windows, prompt_tokens, stitch, renumber, coverage
+    from llm_engine import latency_report, format_latency
+    from scheduler import CostModel, order, makespan_report, format_makespan, save_report
+    from context_builder import estimate_tokens
+    from text_normalize import normalize_file, merge_stats
+
+    # 1. 读取并排序前 file_numbers 个文件
     def num_key(fname):
         m = re.match(r"^(\d+)", fname)
         return int(m.group(1)) if m else float("inf")
 
     files = sorted(
-        [f for f in os.listdir(INPUT_file) if f.lower().endswith(".txt")],
+        [f for f in os.listdir(input_dir) if strip_compression(f).lower().endswith(".txt")],
         key=num_key
-    )[:FILE_NUMBERS]
+    )[:file_numbers]
 
-    # 2. 合并所有行到内存
-    all_lines = []
+    # 2. 合并所有行到内存（章节可为 .txt.zst / .txt.gz）；清洗结果按文件哈希缓存，同一章节只清洗一次
+    all_lines, normalize_stats = [], {}
     for fname in files:
-        with open(os.path.join(INPUT_file, fname), encoding="utf-8") as fr:
-            all_lines.extend(fr.readlines())
+        path = os.path.join(input_dir, fname)
+        if normalize:
+            lines, stats = normalize_file(path, NORMALIZED_DIR)
+            merge_stats(normalize_stats, stats)
+            all_lines.extend(lines)
+        else:
+            with open_stream(path, encoding="utf-8") as fr:
+                all_lines.extend(fr.readlines())
     # print(all_lines)
-    # 3. 构造滑窗：每次前进 WINDOW_SIZE*(1-OVERLAP_RATE) 行
-    stride = int(WINDOW_SIZE * (1 - OVERLAP_RATE))
-    if stride < 1: stride = 1
-    tasks = []
-    for start in range(0, len(all_lines), stride):
-        window_lines = all_lines[start: start + WINDOW_SIZE]
-        if not window_lines:
-            break
-        window_text = "".join(window_lines)
-        window_idx  = start // stride + 1
-        tasks.append((window_idx, window_text))
-
-    # 4. 启动子进程 & 分发任务
-    input_queues = [Queue() for _ in range(NUM_WORKERS)]
-    result_queue = Queue()
-    workers = [
-        Process(target=worker, args=(input_queues[i], result_queue), name=f"Worker-{i+1}")
-        for i in range(NUM_WORKERS)
-    ]
-    for p in workers: p.start()
+    # 3. 构造滑窗：disjoint 模式互不重叠并附带只读前文；overlap 模式每次前进 window_size*(1-overlap_rate) 行
+    windows = build_windows(all_lines, window_size, overlap_rate, mode, context_lines)
+
+    # 4. 规则快速路径：在主进程按顺序本地抽取（已知角色随之累积），置信度不足的滑窗才交给模型
+    extractor = RuleExtractor(load_registry(os.path.join(store_dir, ROLES_FILE)))
+    results, tasks = {}, []
+    for window_idx, window_text, context in windows:
+        turns, confidence = extractor.extract(window_text)
+        if confidence >= rule_confidence:
+            for t in turns:
+                t["window_idx"] = window_idx
+            results[window_idx] = turns
+        else:
+            tasks.append((window_idx, window_text, context))
+    print(f"规则抽取完成 {len(windows) - len(tasks)}/{len(windows)} 个滑窗，{len(tasks)} 个交给模型")
+    num_workers = min(num_workers, len(tasks))
+
+    # 5. 按预测耗时从长到短放入共享队列：空闲的 worker 取下一个，长滑窗不会集中落在最后，
+    #    某个 worker 变慢也不会拖住分给它的一整串滑窗
+    model = CostModel(COST_MODEL, cluster.worker if cluster else None)
+    tokens = {idx: estimate_tokens(text) + estimate_tokens(context) for idx, text, context in tasks}
+    costs = {idx: model.predict("extract", n) for idx, n in tokens.items()}
+    input_order = [costs[t[0]] for t in tasks]
+    tasks = order(tasks, cost=lambda t: costs[t[0]])
+
+    dispatch_started = time.time()
+    if cluster is not None:
+        # 多机模式：滑窗由各机器从共享队列领取，结果在全部完成后合并
+        collected = extract_shared(cluster, store_dir, tasks, costs, num_workers, deadline, hedge_quantile,
+                                   hedge_budget) if tasks else []
+    else:
+        input_queue = Queue()
+        result_queue = Queue()
+        workers = [
+            Process(target=worker, args=(input_queue, result_queue, deadline, hedge_quantile, hedge_budget),
+                    name=f"Worker-{i+1}")
+            for i in range(num_workers)
+        ]
+        for p in workers: p.start()
+
+        # 分发进度条
+        for task in tqdm(tasks, desc="Dispatching windows"):
+            input_queue.put(task)
+        for _ in workers:
+            input_queue.put(None)
+        collected = (result_queue.get() for _ in tqdm(range(len(tasks)), desc="Collecting window results"))
+
+    # 6. 收集结果进度条；成功的调用计入耗时模型
+    records = []
+    for window_idx, turns, record in collected:
+        results[window_idx] = turns
+        records.append(record)
+        if not record["error"] and not record["timeout"]:
+            model.observe("extract", tokens[window_idx], record["seconds"])
+    actual = time.time() - dispatch_started
+    if cluster is None:
+        for p in workers:
+            p.join()
+    model.save()
+    schedule = makespan_report("extract", [costs[t[0]] for t in tasks], num_workers, actual, model, input_order)
+
+    # 7. overlap 模式全局去重＋重新编号；disjoint 模式只在窗口边界拼接，不做全局去重（正文中重复的短句会保留）
+    if mode == "overlap":
+        final_turns = rewrite_global([t for w, _, _ in windows for t in results.get(w, [])])
+    else:
+        final_turns = renumber(stitch(windows, results))
+    report = {
+        "mode": mode,
+        "normalize": normalize_stats or None,
+        "windows": len(windows),
+        "llm_windows": len(tasks),
+        "prompt_tokens": prompt_tokens(tasks),
+        "prompt_tokens_all_windows": prompt_tokens(windows),
+        "coverage": coverage(all_lines, final_turns),
+        "latency": latency_report(records),
+        "schedule": schedule,
+    }
+    if mode != "overlap":
+        report["prompt_tokens_if_overlap"] = prompt_tokens(build_windows(all_lines, window_size, overlap_rate, "overlap"))
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, "extract_report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"抽取报告：{report}")
+    print(format_latency(report["latency"]))
+    print(format_makespan(schedule))
+    save_report(store_dir, schedule)
+
+    # 8. 写入列式存储的基础列（id, role, text, window_idx），CSV 仅作导出
+    store = TurnColumns(store_dir)
+    store.write_base(final_turns)
+    # 重新抽取后，状态库中的台词与各阶段状态一并重置
+    TurnStore(os.path.join(store_dir, TURN_DB), wal=cluster is None).reset_turns(final_turns)
+    if export_path:
+        store.export_csv(export_path, columns=[])
+    print(f"\n✅ 完成，结果已保存到 {store_dir}")
+
+# 各阶段结果的校验函数：抛 ValueError 即视为失败
+STAGE_CHECKS = {"dialogue": check_dialogue, "speaking_style": parse_decoder_output}
+
+def _split_checked(stage, items):
+    done, failed = [], []
+    for turn_id, value in items:
+        try:
+            STAGE_CHECKS[stage](value)
+            done.append((turn_id, value))
+        except ValueError as e:
+            failed.append((turn_id, str(e)))
+    return done, failed
 
-    import itertools
-    rr = itertools.cycle(range(NUM_WORKERS))
-    # 分发进度条
-    for task in tqdm(tasks, desc="Dispatching windows"):
-        input_queues[next(rr)].put(task)
-    for q in input_queues:
-        q.put(None)
-
-    # 5. 收集结果进度条
-    all_turns = []
-    for _ in tqdm(range(len(tasks)), desc="Collecting window results"):
-        all_turns.extend(result_queue.get())
-    for p in workers:
-        p.join()
-
-    # 6. Rewriter：全局去重＋重新编号
-    final_turns = rewrite_global(all_turns)
-
-    # 7. 保存 CSV
-    df = pd.DataFrame(final_turns)[["id", "role", "text", "window_idx"]]
-    df.to_csv(OUTPUT_CSV, index=False, encoding="utf-8-sig")
-    print(f"\n✅ 完成，结果已保存到 {OUTPUT_CSV}")
-
-def convert_bg(input_path, output_path):
-    # 获取已处理的 ID 列表（如果输出文件存在）
-    client = OpenAI(api_key=API_KEY, base_url="https://api.deepseek.com")
-    processed_ids = set()
-    if os.path.isfile(output_path):
-        with open(output_path, mode='r', encoding='utf-8-sig') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                processed_ids.add(str(row["id"]))
+def open_stores(store_dir, wal=True):
+    """
+    打开一部小说的列式存储与状态库。状态库为空时从基础列导入台词，
+    并把列式存储中已有的阶段结果（旧版流程写入的）按校验结果导入为 done / failed。
+    多机共用的状态库以 wal=False 打开。
+    """
+    from turn_columns import TurnColumns
+    from turn_store import TurnStore
+
+    columns = TurnColumns(store_dir)
+    db = TurnStore(os.path.join(store_dir, TURN_DB), wal=wal)
+    if db.turn_count() == 0:
+        db.reset_turns(columns.read_base().to_pylist())
+        existing = set(columns.columns())
+        for stage in STAGE_CHECKS:
+            if stage in existing:
+                table = columns.read(stage)
+                items = [(i, v) for i, v in zip(table["id"].to_pylist(), table["value"].to_pylist())
+                         if v is not None]
+                done, failed = _split_checked(stage, items)
+                db.import_results(stage, done, failed)
+                print(f"从列式存储导入 {stage}：{len(done)} 行成功，{len(failed)} 行失败")
+    return columns, db
+
+def scan_failures(db, stage) -> int:
+    """重新校验某阶段已 done 的结果，把空结果、占位结果或无法解析的结果改记为失败；返回改记行数。"""
+    _, failed = _split_checked(stage, db.results(stage))
+    db.fail(stage, failed)
+    return len(failed)
+
+def prepare_retry(db, stage, max_attempts=MAX_ATTEMPTS):
+    """补跑模式：先扫描出混在成功结果中的失败行，再把失败行重新置为 pending。"""
+    found = scan_failures(db, stage)
+    reset = db.retry_failed(stage, max_attempts=max_attempts)
+    print(f"阶段 {stage}：扫描出 {found} 条无效结果，重置 {reset} 条失败行待重跑")
+
+def materialize(columns, db, stage, export_path=None, export_columns=None):
+    """
+    把状态库中的阶段结果写回列式存储中的同名列，并按需导出 CSV。
+    该列已存在时与状态库逐行比较，只追加值不同的行（新值覆盖旧值，失败行写为空），不重写整列；
+    以列中的实际内容为准，之前中断在写回之前的运行、批任务续跑时本地完成的行也会补上。
+    """
+    if stage in columns.columns():
+        table = columns.read(stage)
+        current = dict(zip(table["id"].to_pylist(), table["value"].to_pylist()))
+        changed = [(i, v) for i, v in db.changes(stage, 0) if current.get(i) != v]
+        columns.append(stage, [r[0] for r in changed], [r[1] for r in changed])
+        print(f"阶段 {stage}：补写 {len(changed)} 行到列式存储")
     else:
-        # 写入表头
-        with open(output_path, mode='w', newline='', encoding='utf-8-sig') as f:
-            writer = csv.writer(f)
-            writer.writerow(['id', 'role', 'text', 'window_idx', 'dialogue'])
-
-
-    # 读取数据
-    data = pd.read_csv(input_path)
-    print(data)
-    # 新建空列表用于写结果
-    results = []
-
-    # 遍历每一行，逐步处理
-    for idx, row in data.iterrows():
-        row_id = str(row["id"])
-        if row_id in processed_ids:
-            print(f"⏭️ 跳过已处理的 ID: {row_id}")
-            continue
+        results = db.results(stage)
+        columns.replace(stage, [r[0] for r in results], [r[1] for r in results])
+    if export_path:
+        columns.export_csv(export_path, export_columns or [stage])
+    print(f"阶段 {stage} 状态：{db.status_counts(stage)}")
 
-        role = str(row["role"])
-        text = str(row["text"])
+def build_roles(store_dir, concurrency=STAGE_WORKERS, refresh=False):
+    """抽取之后为每个角色生成一次人设并缓存到 <store_dir>/roles.json，供后续阶段的提示词引用。"""
+    from turn_columns import TurnColumns
+    from role_registry import build_registry, ROLES_FILE
 
-        # 获取前三句背景
-        context_texts = data.iloc[max(0, idx - 3):idx]["text"].astype(str).tolist()
-        background = "\n".join(context_texts)
+    client = init_client()
+    turns = TurnColumns(store_dir).read_base().select(["role", "text"]).to_pylist()
+    return build_registry(turns, client, os.path.join(store_dir, ROLES_FILE), concurrency, refresh)
 
-        # 构造prompt
-        if role == "旁白":
-            prompt = f"""你是剧本的旁白，请结合以下背景信息，以旁白的语气和神态描述当前内容：
-                        背景信息：{background} \n;\n 
-                        -----------------------------------------------------
-                        当前内容（待转化文本）：{text}"""
-        else:
-            prompt = f"""你是角色“{role}”，请结合以下背景信息，以符合角色语气的方式表达：
-                        背景信息：{background} ;
-                        ------------------------------------------------------------------------
-                        当前内容为（待转化文本）：{text}"""
+def build_summaries(store_dir, concurrency=STAGE_WORKERS):
+    """补算场景 / 章节 / 前情摘要并缓存到 <store_dir>/summaries.json，供后续阶段拼接背景。"""
+    from turn_columns import TurnColumns
+    from context_builder import ContextBuilder, SUMMARY_FILE
 
-        # 调用 DeepSeek API
-        try:
-            response = client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": "你是一个剧本创作助手，擅长将结构化的角色描述转化为自然对话文本。"},
-                    {"role": "user", "content": prompt}
-                ],
-                stream=False,
-                temperature=1.1,      # 人为空值随机性
-                top_p=0.90,
-
-            )
-            dialogue = response.choices[0].message.content.strip().replace('\n', '\\n')
-
-            print("当前角色为:", role, end='.')
-            print("对话内容为:", dialogue)
-            print("描述性文本为:", '(' + text + ')')
-            print('*-'*30)
-        except Exception as e:
-            dialogue = f"(生成失败：{str(e)})"
+    client = init_client()
+    turns = TurnColumns(store_dir).read_base().select(["role", "text", "window_idx"]).to_pylist()
+    ContextBuilder(turns, os.path.join(store_dir, SUMMARY_FILE)).build(client, concurrency)
 
-        # 写入到文件
-        with open(output_path, mode='a', newline='', encoding='utf-8-sig') as f:
-            writer = csv.writer(f)
-            writer.writerow(list(row) + [dialogue])
+def open_batch_runner(store_dir, stage, base_url=BATCH_BASE_URL, poll_seconds=POLL_SECONDS):
+    """批任务的工作目录为 <store_dir>/batches/<stage>/，中断后重跑会继续上次提交的批任务。"""
+    from batch_client import BatchRunner, get_batch_client
+    from config import API_KEY
 
-    print(f"✅ 对话生成完成，保存到：{output_path}")
+    return BatchRunner(get_batch_client(API_KEY, base_url), os.path.join(store_dir, "batches", stage),
+                       poll_seconds, metadata={"stage": stage, "store": os.path.basename(os.path.normpath(store_dir))})
+
+def run_shared(db, stage, process, concurrency, cluster):
+    """
+    多机模式下本阶段领取者的执行：与其他机器一同领取状态库中的行（领取的行定期续租），
+    本机领不到新行后继续等到没有 running 行为止，期间接管租约过期的行，返回时本阶段的结果已全部写入状态库。
+    """
+    from llm_engine import run_claimed
+    from job_queue import POLL_SECONDS
 
-def for_decoder(input_path, output_path):
+    stats = {"done": 0, "failed": 0}
+    while True:
+        s = run_claimed(db, stage, process, concurrency, lease_seconds=cluster.lease_seconds,
+                        heartbeat=cluster.heartbeat)
+        stats = {k: stats[k] + s[k] for k in stats}
+        running = db.status_counts(stage).get("running", 0)
+        if not running:
+            return stats
+        print(f"阶段 {stage}：等待其他 worker 完成 {running} 行")
+        time.sleep(POLL_SECONDS)
+
+def run_scheduled(db, stage, process, concurrency, model, tokens_of, store_dir, cluster=None):
     """
-    读取 input_path 中的 CSV 文件，转换为适合 DeepSeek 解码器的格式，并保存到 output_path。
+    按预测耗时从长到短领取本阶段的 pending 行（写入状态库的 priority），再交给 run_claimed
+    （多机模式交给 run_shared）；tokens_of(turn_id) 为预测用的提示长度，不调用模型的行返回 None。
+    结束后报告预测与实际 makespan。
     """
-    client = OpenAI(api_key=API_KEY, base_url="https://api.deepseek.com")
-    # 获取已处理的 ID 列表（如果输出文件存在）
-    processed_ids = set()
-    if os.path.isfile(output_path):
-        with open(output_path, mode='r', encoding='utf-8-sig') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                processed_ids.add(str(row["id"]))
+    from llm_engine import run_claimed
+    from scheduler import order, makespan_report, format_makespan, save_report
+
+    ids = db.pending(stage)
+    costs = {}
+    for turn_id in ids:
+        tokens = tokens_of(turn_id)
+        costs[turn_id] = 0.0 if tokens is None else model.predict(stage, tokens)
+    db.set_priority(stage, costs.items())
+
+    started = time.time()
+    if cluster is None:
+        stats = run_claimed(db, stage, process, concurrency)
     else:
-        # 写入表头
-        with open(output_path, mode='w', newline='', encoding='utf-8-sig') as f:
-            writer = csv.writer(f)
-            writer.writerow(['id', 'role', 'text', 'window_idx','dialogue', 'speaking_style'])
-
-    # 读取数据
-    data = pd.read_csv(input_path)
-    print(data)
-    # 新建空列表用于写结果
-    results = []
-
-    # 遍历每一行，逐步处理
-    for idx, row in data.iterrows():
-        row_id = str(row["id"])
-        if row_id in processed_ids:
-            print(f"⏭️ 跳过已处理的 ID: {row_id}")
-            continue
+        stats = run_shared(db, stage, process, concurrency, cluster)
+    model.save()
+    report = makespan_report(stage, [costs[i] for i in order(ids, cost=costs.get)], concurrency,
+                             time.time() - started, model, [costs[i] for i in ids])
+    save_report(store_dir, report)
+    print(format_makespan(report))
+    return stats
+
+def load_contexts(store_dir, base):
+    """按基础列构造背景生成器；summaries 阶段未运行时只使用最近几句原文。"""
+    from context_builder import ContextBuilder, SUMMARY_FILE
+
+    return ContextBuilder(base.select(["role", "text", "window_idx"]).to_pylist(),
+                          os.path.join(store_dir, SUMMARY_FILE))
+
+def convert_bg(store_dir, export_path=None, concurrency=STAGE_WORKERS, retry_failed=False,
+               max_attempts=MAX_ATTEMPTS, routing_rules=ROUTING_RULES,
+               deadline=CALL_DEADLINE, hedge_quantile=HEDGE_QUANTILE, hedge_budget=HEDGE_BUDGET,
+               batch=BATCH_MODE, batch_base_url=BATCH_BASE_URL, poll_seconds=POLL_SECONDS,
+               cluster=None, helper=False):
+    """
+    读取列存储中的台词，生成对话并写入 dialogue 列。
+    多机模式下给定 cluster；helper 为 True 时只协助领取其他 worker 正在处理的文件夹中的行，
+    不登记、不重试，也不写回列式存储（由该文件夹的领取者完成）。
+    """
+    from llm_engine import Hedger, format_latency, run_claimed
+    from role_registry import load_registry, persona, ROLES_FILE
+    from router import Router, local_dialogue
+    from prompt_templates import render
+    from llm_client import format_reuse_stats
+    from context_builder import estimate_tokens
+    from scheduler import CostModel
+
+    client = None if batch else init_client()
+    columns, db = open_stores(store_dir, wal=cluster is None)
+
+    # 背景 = 前情摘要 + 本章此前的场景摘要 + 最近几句原文，长度受 token 预算限制；
+    # 各行在基础列中的位置用于定位其场景与最近原文
+    base = columns.read_base()
+    contexts = load_contexts(store_dir, base)
+    position = {turn_id: i for i, turn_id in enumerate(base["id"].to_pylist())}
+
+    # 角色人设（roles 阶段生成）；未登记的角色仍由模型根据背景自行把握语气
+    registry = load_registry(os.path.join(store_dir, ROLES_FILE))
+    # 语气词等极短的行走本地模板或压缩后的轻量调用，完整调用只留给其余的行；
+    # 协助者不写路由日志，阶段汇总只统计领取者处理的行
+    router = Router.from_file(None if helper else store_dir, routing_rules)
+    system = "你是一个剧本创作助手，擅长将结构化的角色描述转化为自然对话文本。"
+    # 各线程共用：对冲阈值按本阶段的近期延迟计算
+    hedger = Hedger(deadline, hedge_quantile, hedge_budget)
+
+    def call(**kwargs):
+        return hedger.call(client.chat.completions.create, **kwargs)
+
+    # 调度用的提示长度：原文 + 背景预算（与实际提示同比例，预测与观测使用同一口径）
+    model = CostModel(COST_MODEL, cluster.worker if cluster else None)
+    roles, texts = base["role"].to_pylist(), base["text"].to_pylist()
+
+    def tokens_of(turn_id):
+        idx = position[turn_id]
+        route = router.route("dialogue", str(roles[idx]), str(texts[idx]))
+        if route.name == "local":
+            return None
+        return estimate_tokens(str(texts[idx])) + (route.context_tokens or contexts.budget)
+
+    # 续跑：状态库中已 done 的行不会再被领取；失败行只有显式 --retry-failed 时才重跑
+    if retry_failed and not helper:
+        prepare_retry(db, "dialogue", max_attempts)
+    if not helper:
+        db.ensure_stage("dialogue")
+    print(f"共 {base.num_rows} 行，状态：{db.status_counts('dialogue')}")
+
+    # 逐行处理：由多个线程并发领取；批任务模式下 run_batched 把 create 换成记录请求 / 重放响应
+    def process(row, create=call):
+        idx = position[row["id"]]
 
         role = str(row["role"])
-        text = str(row["dialogue"])
-
-        # 获取前三句背景
-        context_texts = data.iloc[max(0, idx - 3):idx]["text"].astype(str).tolist()
-        background = "\n".join(context_texts)
-
-        format = """
-        {
-        "scene_description": {},
-        "dialogues": [
-            {
-            "sentence": "原文角色对白，",
-            "speaking_style": "",
-            },
-            {
-            "sentence": "原文角色对白2",
-            "speaking_style": "",
-            }
-        ]
-        }
-        
-        """
+        text = str(row["text"])
+        route = router.route("dialogue", role, text)
+        call_started = time.time()
+
+        # 构造prompt（模板已编译为紧凑形式，见 prompt_templates.py）
+        def make_prompt(background):
+            if role == "旁白":
+                return render("dialogue_narrator", background=background, text=text)
+            role_persona = persona(registry, role)
+            setting = f"角色设定：{role_persona};\n" if role_persona else ""
+            return render("dialogue_role", role=role, setting=setting, background=background, text=text)
+
+        # 获取分层摘要背景；light 路由使用更小的预算
+        full_tokens = estimate_tokens(system + make_prompt(contexts.context(idx)))
+        if route.name == "local":
+            dialogue = local_dialogue(role, text)
+            router.record("dialogue", row["id"], route, 0, full_tokens, time.time() - call_started)
+            return dialogue
+        prompt = make_prompt(contexts.context(idx, route.context_tokens))
+
+        # 调用 DeepSeek API（异常与超时交给 run_claimed 记为失败）
+        response = create(
+            model="deepseek-chat",
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt}
+            ],
+            stream=False,
+            temperature=1.1,      # 人为空值随机性
+            top_p=0.90,
+            **route.call_kwargs(),
+        )
+        dialogue = response.choices[0].message.content.strip().replace('\n', '\\n')
+        usage = getattr(response, "usage", None)
+        router.record("dialogue", row["id"], route, estimate_tokens(system + prompt), full_tokens,
+                      time.time() - call_started, getattr(usage, "completion_tokens", None))
+        if create is call:
+            model.observe("dialogue", tokens_of(row["id"]), time.time() - call_started)
+
+        print("当前角色为:", role, end='.')
+        print("对话内容为:", dialogue)
+        print("描述性文本为:", '(' + text + ')')
+        print('*-'*30)
+
+        check_dialogue(dialogue)
+        return dialogue
+
+    # 调用失败的行在状态库中记为 failed（附错误信息），不再写入 "(生成失败…)" 占位
+    if batch:
+        from batch_client import run_batched
+
+        stats = run_batched(db, "dialogue", process, open_batch_runner(store_dir, "dialogue", batch_base_url,
+                                                                         poll_seconds))
+    elif helper:
+        stats = run_claimed(db, "dialogue", process, concurrency, lease_seconds=cluster.lease_seconds,
+                            heartbeat=cluster.heartbeat)
+        model.save()
+    else:
+        stats = run_scheduled(db, "dialogue", process, concurrency, model, tokens_of, store_dir, cluster)
+    router.close("dialogue")
+    print(f"本次成功 {stats['done']} 行，失败 {stats['failed']} 行")
+    if not batch:
+        print(format_reuse_stats())
+        print(format_latency(hedger.report()))
+    if helper:
+        return
+    materialize(columns, db, "dialogue", export_path)
+    print(f"✅ 对话生成完成，保存到：{store_dir}")
+
+def for_decoder(store_dir, export_path=None, concurrency=STAGE_WORKERS, retry_failed=False,
+                max_attempts=MAX_ATTEMPTS, routing_rules=ROUTING_RULES,
+                deadline=CALL_DEADLINE, hedge_quantile=HEDGE_QUANTILE, hedge_budget=HEDGE_BUDGET,
+                batch=BATCH_MODE, batch_base_url=BATCH_BASE_URL, poll_seconds=POLL_SECONDS,
+                cluster=None, helper=False):
+    """
+    读取列存储中的 dialogue 列，转换为适合 DeepSeek 解码器的格式，并写入 speaking_style 列。
+    batch 为 True 时全部请求编入离线批任务，完成后按行 id 合并。
+    cluster / helper 同 convert_bg。
+    """
+    from llm_engine import Hedger, format_latency, run_claimed
+    from role_registry import load_registry, persona, speaking_style_rule, apply_persona, ROLES_FILE
+    from router import Router
+    from prompt_templates import render
+    from context_builder import estimate_tokens
+    from llm_client import format_reuse_stats
+    from scheduler import CostModel
+
+    client = None if batch else init_client()
+    columns, db = open_stores(store_dir, wal=cluster is None)
+
+    # 背景 = 前情摘要 + 本章此前的场景摘要 + 最近几句原文，长度受 token 预算限制；
+    # 各行在基础列中的位置用于定位其场景与最近原文
+    base = columns.read_base()
+    contexts = load_contexts(store_dir, base)
+    position = {turn_id: i for i, turn_id in enumerate(base["id"].to_pylist())}
+    source_texts = base["text"].to_pylist()
+    # 角色人设已知时，speaking_style 只需模型写出本句情绪，人设部分在本地拼接
+    registry = load_registry(os.path.join(store_dir, ROLES_FILE))
+    # 只有 dialogue 阶段成功的行才进入本阶段
+    dialogues = dict(db.results("dialogue"))
+    # 按原文分类路由：短行使用压缩背景并限制输出长度（解码器阶段不走本地模板）
+    router = Router.from_file(None if helper else store_dir, routing_rules)
+    system = "你是一个场景描述创作助手，擅长将结构化的角色描述转化为json格式的场景描述。"
+    hedger = Hedger(deadline, hedge_quantile, hedge_budget)
+
+    def call(**kwargs):
+        return hedger.call(client.chat.completions.create, **kwargs)
+
+    # 解码器提示的长度主要取决于 dialogue 结果与背景预算
+    model = CostModel(COST_MODEL, cluster.worker if cluster else None)
+    roles = base["role"].to_pylist()
+
+    def tokens_of(turn_id):
+        idx = position[turn_id]
+        route = router.route("speaking_style", str(roles[idx]), str(source_texts[idx]))
+        return estimate_tokens(str(dialogues.get(turn_id, ""))) + (route.context_tokens or contexts.budget)
+
+    if retry_failed and not helper:
+        prepare_retry(db, "speaking_style", max_attempts)
+    if not helper:
+        db.ensure_stage("speaking_style", depends_on="dialogue")
+    print(f"共 {len(dialogues)} 行可处理，状态：{db.status_counts('speaking_style')}")
+
+    # 逐行处理：由多个线程并发领取；批任务模式下 run_batched 把 create 换成记录请求 / 重放响应
+    def process(row, create=call):
+        idx = position[row["id"]]
+
+        role = str(row["role"])
+        text = str(dialogues[row["id"]])
+        route = router.route("speaking_style", role, str(source_texts[idx]))
+        call_started = time.time()
 
-        # 构造prompt
+        # 获取分层摘要背景；light 路由使用更小的预算（两种路由的提示只差在背景上）
+        background = contexts.context(idx, route.context_tokens)
+        saved_tokens = estimate_tokens(contexts.context(idx)) - estimate_tokens(background)
+
+        role_persona = persona(registry, role, "en")
+
+        # 构造prompt（模板已编译为紧凑形式，JSON 格式示例由 render 填入）
         if role == "旁白":
-            prompt = f"""你是一个场景描述器，现在需要将一段旁白生成相应的描述，要求如下：\n
-                        1 在scene_description中，用一句话按照结构（“画风为xxx，整体为xxx风格” + “主体描述用完整句子描述包括（时间，地点，人物，并侧重描写画面细节，但不要使用比喻）” + “氛围”）描述一个符合内容的静态画面，人物动作表情尽量详细，描述画面内容即可；\n
-                        2. 将内容分成多句对白，放入dialogues中，\n
-                        3. 每句对白都需要包含speaking_style字段，用英文描述旁白的说话风格和语气，用一句话格式为（旁白（无性别、自然、音色）+此时场景下说这句话的情绪）；\n
-                        请只输出合法 JSON 列表，并用 ```json ...``` 包裹，格式如下：\n
-                        {format}\n
-                        下面给出具体内容和背景信息，情节和背景信息为分析并处理待转化文本\n
-                        背景信息：{background} \n;\n 
-                        -----------------------------------------------------
-                        当前内容（待转化文本）：{text}"""
+            style_rule = speaking_style_rule(role_persona)
+            prompt = render("decoder_narrator", style_rule=style_rule, background=background, text=text)
         else:
-            prompt = f"""你是一个场景描述器，现在需要带入角色{role}将一段对话总结相应的描述，要求如下：\n
-                        1 在scene_description中，用一句话按照结构（“画风为xxx，整体为xxx风格” + “主体描述用完整句子描述包括（时间，地点，人物，并侧重描写画面细节，但不要使用比喻）” + “氛围”）描述一个符合内容的静态画面，人物动作表情尽量详细，描述画面内容即可；\n
-                        2. 将内容分成多句对白，放入dialogues中\n
-                        3. 每句对白都需要包含speaking_style字段，用英文描述角色的说话风格和语气，格式为（角色{role}人设（性别、年龄、音色、性格）+此时场景下说这句话的情绪）；\n
-                        请只输出合法 JSON 列表，并用 ```json ...``` 包裹，格式如下：\n
-                        {format}\n
-                        下面给出具体内容和背景信息，情节和背景信息为分析并处理待转化文本\n
-                        背景信息：{background} \n;\n 
-                        -----------------------------------------------------
-                        当前内容（待转化文本）：{text}"""
-
-        # 调用 DeepSeek API
+            if role_persona:
+                style_rule = speaking_style_rule(role_persona)
+            else:
+                style_rule = render("style_rule_fallback", role=role)
+            prompt = render("decoder_role", role=role, style_rule=style_rule, background=background, text=text)
+
+        # 调用 DeepSeek API（异常与超时交给 run_claimed 记为失败）
+        response = create(
+            model="deepseek-chat",
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt}
+            ],
+            stream=False,
+            temperature=1.1,      # 人为空值随机性
+            top_p=0.90,
+            **route.call_kwargs(),
+        )
+        dialogue = response.choices[0].message.content.strip().replace('\n', '\\n')
+        usage = getattr(response, "usage", None)
+        prompt_tokens = estimate_tokens(system + prompt)
+        router.record("speaking_style", row["id"], route, prompt_tokens, prompt_tokens + saved_tokens,
+                      time.time() - call_started, getattr(usage, "completion_tokens", None))
+        if create is call:
+            model.observe("speaking_style", tokens_of(row["id"]), time.time() - call_started)
+
+        print("当前角色为:", role, end='.')
+        print("对话内容为:", dialogue)
+        print("描述性文本为:", '(' + text + ')')
+        print('*-'*30)
+
+        # 无法解析的输出直接记为失败，而不是作为成功结果交给下游
+        data = parse_decoder_output(dialogue)
+        if role_persona:
+            dialogue = dump_decoder_output(apply_persona(data, role_persona))
+        return dialogue
+
+    if batch:
+        from batch_client import run_batched
+
+        stats = run_batched(db, "speaking_style", process,
+                            open_batch_runner(store_dir, "speaking_style", batch_base_url, poll_seconds))
+    elif helper:
+        stats = run_claimed(db, "speaking_style", process, concurrency, lease_seconds=cluster.lease_seconds,
+                            heartbeat=cluster.heartbeat)
+        model.save()
+    else:
+        stats = run_scheduled(db, "speaking_style", process, concurrency, model, tokens_of, store_dir, cluster)
+    router.close("speaking_style")
+    print(f"本次成功 {stats['done']} 行，失败 {stats['failed']} 行")
+    if not batch:
+        print(format_reuse_stats())
+        print(format_latency(hedger.report()))
+    if helper:
+        return
+    materialize(columns, db, "speaking_style", export_path, ["dialogue", "speaking_style"])
+    print(f"✅ 对话生成完成，保存到：{store_dir}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="小说 → 结构化台词 → 剧本 → 解码器格式 的主流程")
+    parser.add_argument("--input-dir", default=INPUT_DIR, help="小说根目录，每个子文件夹为一部小说")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES,
+                        help="要执行的阶段；只续跑后续阶段时可省略 extract")
+    parser.add_argument("--file-numbers", type=int, default=FILE_NUMBERS, help="每部小说读取的章节数")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS, help="抽取阶段的并发进程数")
+    parser.add_argument("--window-size", type=int, default=WINDOW_SIZE, help="每个滑窗的行数")
+    parser.add_argument("--overlap-rate", type=float, default=OVERLAP_RATE, help="overlap 模式下相邻滑窗的重叠比例")
+    parser.add_argument("--extract-mode", choices=["disjoint", "overlap"], default=EXTRACT_MODE,
+                        help="disjoint：不重叠滑窗 + 只读前文 + 边界拼接；overlap：旧版重叠滑窗")
+    parser.add_argument("--context-lines", type=int, default=CONTEXT_LINES, help="disjoint 模式的只读前文行数")
+    parser.add_argument("--rule-confidence", type=float, default=RULE_CONFIDENCE,
+                        help="规则抽取置信度不低于该值的滑窗不调用模型，设为大于 1 时全部交给模型")
+    parser.add_argument("--stage-workers", type=int, default=STAGE_WORKERS, help="生成阶段的并发线程数")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="补跑模式：扫描各阶段的失败、占位与无法解析的结果，只重跑这些行")
+    parser.add_argument("--refresh-roles", action="store_true", help="忽略已缓存的角色人设，全部重新生成")
+    parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS,
+                        help="补跑时跳过已尝试该次数及以上的行")
+    parser.add_argument("--routing-rules", default=ROUTING_RULES,
+                        help="生成阶段按行路由规则的 JSON 文件（见 router.py），缺省使用默认规则")
+    parser.add_argument("--deadline", type=float, default=CALL_DEADLINE,
+                        help="单次模型调用的截止秒数，超时记为失败")
+    parser.add_argument("--hedge-quantile", type=float, default=HEDGE_QUANTILE,
+                        help="调用超过近期延迟的该分位数仍未返回时发出对冲请求")
+    parser.add_argument("--hedge-budget", type=float, default=HEDGE_BUDGET,
+                        help="对冲请求占调用数的上限，0 为关闭对冲")
+    parser.add_argument("--batch", action="store_true", default=BATCH_MODE,
+                        help="script / decoder 阶段改为离线批任务，中断后重跑会继续轮询已提交的批任务")
+    parser.add_argument("--batch-base-url", default=BATCH_BASE_URL, help="OpenAI 兼容的批任务接口地址")
+    parser.add_argument("--poll-seconds", type=float, default=POLL_SECONDS, help="批任务轮询间隔（秒）")
+    parser.add_argument("--no-normalize", dest="normalize", action="store_false", default=NORMALIZE,
+                        help="不清洗原文，按原样送入抽取")
+    parser.add_argument("--priority-folders", nargs="+", default=PRIORITY_FOLDERS,
+                        help="优先处理的小说文件夹，按给定顺序排在其余文件夹之前")
+    parser.add_argument("--no-export-csv", dest="export_csv", action="store_false", default=EXPORT_CSV,
+                        help="不导出各阶段 CSV，只保留列式存储")
+    parser.add_argument("--compress", choices=["", "zst", "gz"], default=COMPRESS,
+                        help="导出 CSV 的压缩格式，缺省不压缩")
+    parser.add_argument("--queue", default=JOB_QUEUE,
+                        help="多机模式：共享文件系统上的任务队列库，各机器运行同样的命令，领取文件夹、滑窗与台词行")
+    parser.add_argument("--worker-id", default=None, help="多机模式下的 worker 名，缺省为 主机名-进程号")
+    parser.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS,
+                        help="多机模式下任务的租约秒数，持有者宕机后超过该时间由其他 worker 接管")
+    parser.add_argument("--local-workers", type=int, default=LOCAL_WORKERS,
+                        help="多机模式下本机启动的 worker 进程数，单机上可用于测试多机流程")
+    return parser.parse_args(argv)
+
+def ordered_folders(args) -> list:
+    """INPUT_DIR 中的文件夹：--priority-folders 中的按给定顺序排在前面，其余按名称。"""
+    from scheduler import order
+
+    folders = sorted(f for f in os.listdir(args.input_dir) if os.path.isdir(os.path.join(args.input_dir, f)))
+    rank = {f: i for i, f in enumerate(args.priority_folders)}
+    return order(folders, cost=lambda f: 0, priority=lambda f: rank.get(f, len(rank)))
+
+def run_folder(args, folder, cluster=None, done=()):
+    """
+    对一部小说依次执行 args.stages 中的阶段；返回 None 表示完成，否则为导致后续阶段跳过的错误信息。
+    多机模式下每个阶段开始前把进度写入文件夹任务：其他 worker 据此协助当前阶段，
+    任务被重新领取时跳过 done 中已完成的阶段。
+    """
+    input_file = os.path.join(args.input_dir, folder)
+    store_dir = os.path.join(OUTPUT_DIR, folder)
+    output_csv = with_compression(os.path.join(OUTPUT_DIR, f"1_提取后结果_{folder}.csv"), args.compress)
+    print(f"正在处理文件夹：{folder}")
+    done = list(done)
+
+    def begin(stage):
+        if stage not in args.stages or stage in done:
+            return False
+        if cluster is not None:
+            cluster.queue.set_progress(FOLDER_QUEUE, folder, cluster.worker, {"stage": stage, "done": done})
+        return True
+
+    if begin("extract"):
         try:
-            response = client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": f"你是一个场景描述创作助手，擅长将结构化的角色描述转化为json格式的场景描述。"},
-                    {"role": "user", "content": prompt}
-                ],
-                stream=False,
-                temperature=1.1,      # 人为空值随机性
-                top_p=0.90,
-
-            )
-            dialogue = response.choices[0].message.content.strip().replace('\n', '\\n')
-
-            print("当前角色为:", role, end='.')
-            print("对话内容为:", dialogue)
-            print("描述性文本为:", '(' + text + ')')
-            print('*-'*30)
+            main_multiprocess_rr(input_file, store_dir, args.file_numbers, args.workers,
+                                 args.window_size, args.overlap_rate,
+                                 export_path=output_csv if args.export_csv else None,
+                                 rule_confidence=args.rule_confidence, mode=args.extract_mode,
+                                 context_lines=args.context_lines, deadline=args.deadline,
+                                 hedge_quantile=args.hedge_quantile, hedge_budget=args.hedge_budget,
+                                 normalize=args.normalize, cluster=cluster)
         except Exception as e:
-            dialogue = f"(生成失败：{str(e)})"
-
-        # 写入到文件
-        with open(output_path, mode='a', newline='', encoding='utf-8-sig') as f:
-            writer = csv.writer(f)
-            writer.writerow(list(row) + [dialogue])
+            print(f"处理文件夹 {folder} 时出错：{str(e)}")
+            return f"extract: {e}"
+        done.append("extract")
+        print(f"文件夹 {folder} 处理完成，结果已保存到 {store_dir}")
 
+    if begin("roles"):
+        try:
+            build_roles(store_dir, args.stage_workers, args.refresh_roles)
+            done.append("roles")
+        except Exception as e:
+            # 人设只是提示词的补充，失败时后续阶段退回逐行推断
+            print(f"角色人设生成失败：{str(e)}")
 
-    print(f"✅ 对话生成完成，保存到：{output_path}")
+    if begin("summaries"):
+        try:
+            build_summaries(store_dir, args.stage_workers)
+            done.append("summaries")
+        except Exception as e:
+            # 摘要缺失时背景退回最近几句原文
+            print(f"摘要生成失败：{str(e)}")
 
-if __name__ == "__main__":
-    BASE_URL    = "https://api.deepseek.com/v1"
-    INPUT_DIR   = "../A_get_novel/textbook/textbook/"
-    OUTPUT_DIR  = "mid_output/"
-    OUTPUT_script = "output/"
-    OUTPUT_decoder = "output_decoder/"
-    FILE_NUMBERS = 10 # 读取的章节数
-    NUM_WORKERS = 5 # 同时的处理数
-    WINDOW_SIZE = 40   # 每个滑窗的行数
-    OVERLAP_RATE = 2/3  # 每个窗口与上一个窗口重叠2/3
-    #遍历INPUT_DIR中的文件夹
-    for folder in os.listdir(INPUT_DIR):
-        if os.path.isdir(os.path.join(INPUT_DIR, folder)):
-            INPUT_file = os.path.join(INPUT_DIR, folder)
-            OUTPUT_CSV = os.path.join(OUTPUT_DIR, f"1_提取后结果_{folder}.csv")
-            print(f"正在处理文件夹：{folder}")
+    output_path = with_compression(os.path.join(OUTPUT_script, f"2_script_{folder}.csv"), args.compress)
+    if begin("script"):
+        try:
+            convert_bg(store_dir, output_path if args.export_csv else None,
+                       args.stage_workers, args.retry_failed, args.max_attempts, args.routing_rules,
+                       args.deadline, args.hedge_quantile, args.hedge_budget,
+                       args.batch, args.batch_base_url, args.poll_seconds, cluster)
+        except Exception as e:
+            print(f"脚本转换失败：{str(e)}")
+            return f"script: {e}"
+        done.append("script")
+        print(f"脚本转换完成，保存到：{store_dir}")
+
+    output_path_deocoder = with_compression(os.path.join(OUTPUT_decoder, f"3_decoder_{folder}.csv"),
+                                            args.compress)
+    if begin("decoder"):
+        try:
+            for_decoder(store_dir, output_path_deocoder if args.export_csv else None,
+                        args.stage_workers, args.retry_failed, args.max_attempts, args.routing_rules,
+                        args.deadline, args.hedge_quantile, args.hedge_budget,
+                        args.batch, args.batch_base_url, args.poll_seconds, cluster)
+        except Exception as e:
+            print(f"解码器转换失败：{str(e)}")
+            return f"decoder: {e}"
+        done.append("decoder")
+        print(f"解码器转换完成，保存到：{store_dir}")
+    return None
 
-            try:
-                main_multiprocess_rr()
-            except Exception as e:
-                print(f"处理文件夹 {folder} 时出错：{str(e)}")
-                continue
-            # 重置INPUT_DIR和OUTPUT_CSV
-            print(f"文件夹 {folder} 处理完成，结果已保存到 {OUTPUT_CSV}")
+# 生成阶段在状态库中对应的阶段名
+ROW_STAGES = {"script": "dialogue", "decoder": "speaking_style"}
 
+def help_others(args, cluster) -> bool:
+    """
+    没有可领取的文件夹时，协助其他 worker 正在处理的文件夹：先领取抽取滑窗，再领取生成阶段的台词行。
+    返回是否做了工作。
+    """
+    from turn_store import TurnStore
+    from job_queue import RUNNING
+
+    for queue_name in cluster.queue.open_queues("windows/"):
+        _, folder, digest = queue_name.split("/")
+        print(f"协助抽取 {folder} 的滑窗")
+        run_window_workers(cluster, queue_name, os.path.join(OUTPUT_DIR, folder, "parts", "extract", digest),
+                           args.workers, False, args.deadline, args.hedge_quantile, args.hedge_budget)
+        return True
+
+    # 批任务模式下生成阶段由领取者整体提交，不逐行协助
+    if args.batch:
+        return False
+    for job in cluster.queue.jobs(FOLDER_QUEUE, RUNNING):
+        stage = (job["progress"] or {}).get("stage")
+        if stage not in ROW_STAGES:
+            continue
+        store_dir = os.path.join(OUTPUT_DIR, job["key"])
+        if not TurnStore(os.path.join(store_dir, TURN_DB), wal=False).status_counts(ROW_STAGES[stage]).get("pending"):
+            continue
+        print(f"协助 {job['key']} 的 {stage} 阶段")
+        generate = convert_bg if stage == "script" else for_decoder
+        generate(store_dir, None, args.stage_workers, routing_rules=args.routing_rules, deadline=args.deadline,
+                 hedge_quantile=args.hedge_quantile, hedge_budget=args.hedge_budget, cluster=cluster, helper=True)
+        return True
+    return False
+
+def run_worker(args, worker=None):
+    """
+    多机模式的一个 worker：把 INPUT_DIR 中的文件夹登记到共享队列（已登记的不变），然后循环领取文件夹执行各阶段；
+    领不到文件夹时协助其他 worker 的当前阶段，所有文件夹都完成或失败后退出。
+    文件夹任务在执行期间定期续租；worker 宕机后租约过期，其他 worker 接管并从未完成的阶段继续。
+    """
+    from job_queue import Cluster, Heartbeat, POLL_SECONDS
 
-            output_path = os.path.join(OUTPUT_script, f"2_script_{folder}.csv")
-            try:
-                convert_bg(OUTPUT_CSV, output_path)
-            except Exception as e:
-                print(f"脚本转换失败：{str(e)}")
-                continue
-            print(f"脚本转换完成，保存到：{output_path}")
+    cluster = Cluster(args.queue, worker or args.worker_id, args.lease_seconds)
+    folders = ordered_folders(args)
+    rank = {f: i for i, f in enumerate(folders)}
+    cluster.queue.add(FOLDER_QUEUE, [(f, None) for f in folders], priority=lambda f: -rank[f])
+    print(f"worker {cluster.worker} 加入 {args.queue}：{cluster.queue.counts(FOLDER_QUEUE)}")
 
+    while True:
+        jobs = cluster.queue.claim(FOLDER_QUEUE, cluster.worker, cluster.lease_seconds)
+        if jobs:
+            folder, progress = jobs[0]["key"], jobs[0]["progress"] or {}
+            with Heartbeat(lambda: cluster.queue.heartbeat(cluster.worker, cluster.lease_seconds), cluster.heartbeat):
+                error = run_folder(args, folder, cluster, progress.get("done", []))
+            if error is None:
+                finished = cluster.queue.complete(FOLDER_QUEUE, folder, cluster.worker)
+            else:
+                finished = cluster.queue.fail(FOLDER_QUEUE, folder, cluster.worker, error)
+            if not finished:
+                print(f"⚠️ 文件夹 {folder} 的租约已被其他 worker 接管")
+            continue
+        if help_others(args, cluster):
+            continue
+        if cluster.queue.drained(FOLDER_QUEUE):
+            break
+        time.sleep(POLL_SECONDS)
+    print(f"✅ worker {cluster.worker} 退出，文件夹状态：{cluster.queue.counts(FOLDER_QUEUE)}")
 
-            output_path_deocoder = os.path.join(OUTPUT_decoder, f"3_decoder_{folder}.csv")
-            try:
-                for_decoder(output_path, output_path_deocoder)
-            except Exception as e:
-                print(f"解码器转换失败：{str(e)}")
-                continue
-            print(f"解码器转换完成，保存到：{output_path_deocoder}")
+def main(argv=None):
+    args = parse_args(argv)
 
+    if args.queue:
+        # 多机模式：本机启动 --local-workers 个 worker 进程，与其他机器上的 worker 共用同一个队列
+        from job_queue import worker_name
 
+        if args.local_workers <= 1:
+            run_worker(args)
+            return
+        workers = [Process(target=run_worker, args=(args, f"{args.worker_id or worker_name()}.{i+1}"))
+                   for i in range(args.local_workers)]
+        for p in workers: p.start()
+        for p in workers: p.join()
+        return
 
+    #遍历INPUT_DIR中的文件夹：--priority-folders 中的按给定顺序先处理，其余按名称
+    for folder in ordered_folders(args):
+        run_folder(args, folder)
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import re
+import sys
+import argparse
+
+from context_builder import estimate_tokens
+
+
+# 生成阶段（dialogue / speaking_style）的提示词模板。
+#
+# 源码中的模板保留原来易读的缩进写法；导入时编译一次为紧凑形式：每行去掉首尾与连续空白，删除空行、
+# 只有分号的行，长分隔线缩为 ---，JSON 格式示例合并为一行。只编译模板本身，填入的背景与原文原样保留。
+# 缩进在每个请求中都要付出几十个空白 token，编译后请求内容的含义不变。
+# `python prompt_templates.py` 打印每个模板编译前后的估计 token 数。
+
+_SPACES = re.compile(r"[ \t]{2,}")
+_SEPARATOR = re.compile(r"-{4,}")
+_PUNCT_ONLY = re.compile(r"^[;；]+$")
+_FIELD = re.compile(r"\{(\w+)\}")
+
+
+def compile_prompt(template: str, join: str = "\n") -> str:
+    """把模板编译为紧凑形式，见模块说明。join 为行之间的连接符。"""
+    lines = []
+    for line in template.splitlines():
+        line = _SEPARATOR.sub("---", _SPACES.sub(" ", line.strip()))
+        if line and not _PUNCT_ONLY.match(line):
+            lines.append(line)
+    return join.join(lines)
+
+
+# ———— 模板源码 ————
+
+DIALOGUE_NARRATOR = """你是剧本的旁白，请结合以下背景信息，以旁白的语气和神态描述当前内容：
+                        背景信息：{background} \n;\n 
+                        -----------------------------------------------------
+                        当前内容（待转化文本）：{text}"""
+
+DIALOGUE_ROLE = """你是角色“{role}”，请结合以下背景信息，以符合角色语气的方式表达：
+                        {setting}背景信息：{background} ;
+                        ------------------------------------------------------------------------
+                        当前内容为（待转化文本）：{text}"""
+
+DECODER_FORMAT = """
+        {
+        "scene_description": {},
+        "dialogues": [
+            {
+            "sentence": "原文角色对白，",
+            "speaking_style": "",
+            },
+            {
+            "sentence": "原文角色对白2",
+            "speaking_style": "",
+            }
+        ]
+        }
+        
+        """
+
+DECODER_NARRATOR = """你是一个场景描述器，现在需要将一段旁白生成相应的描述，要求如下：\n
+                        1 在scene_description中，用一句话按照结构（“画风为xxx，整体为xxx风格” + “主体描述用完整句子描述包括（时间，地点，人物，并侧重描写画面细节，但不要使用比喻）” + “氛围”）描述一个符合内容的静态画面，人物动作表情尽量详细，描述画面内容即可；\n
+                        2. 将内容分成多句对白，放入dialogues中，\n
+                        3. {style_rule}；\n
+                        请只输出合法 JSON 列表，并用 ```json ...``` 包裹，格式如下：\n
+                        {format}\n
+                        下面给出具体内容和背景信息，情节和背景信息为分析并处理待转化文本\n
+                        背景信息：{background} \n;\n 
+                        -----------------------------------------------------
+                        当前内容（待转化文本）：{text}"""
+
+DECODER_ROLE = """你是一个场景描述器，现在需要带入角色{role}将一段对话总结相应的描述，要求如下：\n
+                        1 在scene_description中，用一句话按照结构（“画风为xxx，整体为xxx风格” + “主体描述用完整句子描述包括（时间，地点，人物，并侧重描写画面细节，但不要使用比喻）” + “氛围”）描述一个符合内容的静态画面，人物动作表情尽量详细，描述画面内容即可；\n
+                        2. 将内容分成多句对白，放入dialogues中\n
+                        3. {style_rule}；\n
+                        请只输出合法 JSON 列表，并用 ```json ...``` 包裹，格式如下：\n
+                        {format}\n
+                        下面给出具体内容和背景信息，情节和背景信息为分析并处理待转化文本\n
+                        背景信息：{background} \n;\n 
+                        -----------------------------------------------------
+                        当前内容（待转化文本）：{text}"""
+
+# 角色人设未知时 speaking_style 的要求
+STYLE_RULE_FALLBACK = "每句对白都需要包含speaking_style字段，用英文描述角色的说话风格和语气，格式为（角色{role}人设（性别、年龄、音色、性格）+此时场景下说这句话的情绪）"
+
+RAW_TEMPLATES = {
+    "dialogue_narrator": DIALOGUE_NARRATOR,
+    "dialogue_role": DIALOGUE_ROLE,
+    "decoder_format": DECODER_FORMAT,
+    "decoder_narrator": DECODER_NARRATOR,
+    "decoder_role": DECODER_ROLE,
+    "style_rule_fallback": STYLE_RULE_FALLBACK,
+}
+TEMPLATES = {name: compile_prompt(raw, "" if name == "decoder_format" else "\n")
+             for name, raw in RAW_TEMPLATES.items()}
+
+
+def render(name: str, **fields) -> str:
+    """按编译后的模板生成提示；解码器模板的 {format} 缺省填入编译后的 JSON 格式示例。"""
+    template = TEMPLATES[name]
+    if "{format}" in template:
+        fields.setdefault("format", TEMPLATES["decoder_format"])
+    return template.format(**fields)
+
+
+class _Blank(dict):
+    def __missing__(self, key):
+        return ""
+
+
+def report() -> list:
+    """各模板（字段留空）编译前后的估计 token 数，即每个请求节省的固定开销。"""
+    rows = []
+    for name, raw in RAW_TEMPLATES.items():
+        if name == "decoder_format":   # 格式示例只作为字段值填入，本身含有花括号
+            before, after = estimate_tokens(raw), estimate_tokens(TEMPLATES[name])
+        else:
+            before = estimate_tokens(raw.format_map(_Blank(format=RAW_TEMPLATES["decoder_format"])))
+            after = estimate_tokens(TEMPLATES[name].format_map(_Blank(format=TEMPLATES["decoder_format"])))
+        fields = [] if name == "decoder_format" else sorted(set(_FIELD.findall(raw)))
+        rows.append({"template": name, "fields": fields,
+                     "raw_tokens": before, "compiled_tokens": after, "saved_tokens": before - after})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="提示词模板编译前后的 token 数")
+    parser.add_argument("--show", choices=sorted(TEMPLATES), help="打印某个模板编译后的内容")
+    args = parser.parse_args(argv)
+
+    if args.show:
+        sys.stdout.write(TEMPLATES[args.show] + "\n")
+        return
+    for row in report():
+        saved = row["saved_tokens"] / row["raw_tokens"] if row["raw_tokens"] else 0.0
+        print(f"{row['template']:<20} {row['raw_tokens']:>5} → {row['compiled_tokens']:>5} token"
+              f"（每个请求节省 {row['saved_tokens']}，{saved:.0%}）")
+
+
+if __name__ == "__main__":
+    main()
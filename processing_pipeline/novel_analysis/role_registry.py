@@ -0,0 +1,133 @@
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+# 全局角色登记表：每部小说在抽取（rewrite_global）之后，为每个不同的 role 调用一次模型，
+# 根据该角色散布在全书中的台词样本总结人设，并缓存为 JSON：
+#
+#   {"角色名": {"gender": ..., "age": ..., "voice": ..., "personality": ...,
+#               "persona_zh": "中文一句话人设", "persona_en": "English one-line persona"}, …}
+#
+# 下游 convert_bg / for_decoder / convert_to_decoder.py 的提示词直接引用这条简短人设，
+# 不再让模型仅凭前三句背景逐行重新推断性别、年龄、音色与性格。
+
+NARRATOR         = "旁白"
+ROLES_FILE       = "roles.json"   # 位于每部小说的存储目录下
+SAMPLES_PER_ROLE = 8      # 每个角色送入模型的台词样本数（在全书中均匀抽取）
+SAMPLE_CHARS     = 80     # 每条样本最多保留的字数
+NARRATOR_PERSONA = {
+    "persona_zh": "旁白，无性别，自然平稳的叙述音色",
+    "persona_en": "narrator, genderless, natural and steady narrating voice",
+}
+
+
+def sample_lines(lines: list, k: int = SAMPLES_PER_ROLE, max_chars: int = SAMPLE_CHARS) -> list:
+    """从一个角色的全部台词中均匀抽取 k 条（保留先后顺序），过长的截断。"""
+    if len(lines) > k:
+        step = len(lines) / k
+        lines = [lines[int(i * step)] for i in range(k)]
+    return [line[:max_chars] for line in lines]
+
+
+def group_by_role(turns) -> dict:
+    """[{role, text}, …] → {role: [text, …]}，按出现顺序，跳过旁白与空角色。"""
+    groups = {}
+    for t in turns:
+        role = str(t.get("role") or "").strip()
+        text = str(t.get("text") or "").strip()
+        if not role or role == NARRATOR or not text:
+            continue
+        groups.setdefault(role, []).append(text)
+    return groups
+
+
+def describe_role(role: str, lines: list, client) -> dict:
+    """调用一次模型，根据台词样本总结一个角色的人设。"""
+    samples = "\n".join(f"- {line}" for line in sample_lines(lines))
+    prompt = (
+        f"下面是小说中角色“{role}”的 {len(lines)} 句台词中的部分样本：\n{samples}\n\n"
+        "请据此推断该角色的人设，只输出合法 JSON，并用 ```json ...``` 包裹，格式如下：\n"
+        "```json\n"
+        "{\"gender\": \"男/女/未知\", \"age\": \"年龄段\", \"voice\": \"音色\", \"personality\": \"性格\",\n"
+        " \"persona_zh\": \"不超过30字的中文一句话人设\",\n"
+        " \"persona_en\": \"one short English line: gender, age, timbre, personality\"}\n"
+        "```\n"
+        "不要输出任何其他内容。"
+    )
+    resp = client.chat.completions.create(
+        model="deepseek-chat",
+        messages=[
+            {"role": "system", "content": "你是一个小说角色分析助手。"},
+            {"role": "user", "content": prompt},
+        ],
+        stream=False,
+        temperature=0.3,
+    )
+    raw = resp.choices[0].message.content
+    m = re.search(r"```json\s*(\{[\s\S]*?\})\s*```", raw)
+    persona = json.loads(m.group(1) if m else raw.strip())
+    if not persona.get("persona_zh") or not persona.get("persona_en"):
+        raise ValueError(f"角色 {role} 的人设缺少 persona_zh / persona_en")
+    persona["lines"] = len(lines)
+    return persona
+
+
+def load_registry(path: str) -> dict:
+    if not os.path.isfile(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_registry(registry: dict, path: str):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(registry, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def build_registry(turns, client, path: str, concurrency: int = 8, refresh: bool = False) -> dict:
+    """
+    为 turns 中每个尚未登记的角色并发调用一次 describe_role，结果合并写入 path 并返回完整登记表。
+    已缓存的角色直接复用（refresh=True 时全部重建）；调用失败的角色不写入，下次运行会再补。
+    """
+    registry = {} if refresh else load_registry(path)
+    groups = group_by_role(turns)
+    todo = {role: lines for role, lines in groups.items() if role not in registry}
+    print(f"共 {len(groups)} 个角色，已缓存 {len(groups) - len(todo)} 个，需生成 {len(todo)} 个")
+    if not todo:
+        return registry
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(describe_role, role, lines, client): role for role, lines in todo.items()}
+        for future in as_completed(futures):
+            role = futures[future]
+            try:
+                registry[role] = future.result()
+                print(f"👤 {role}：{registry[role]['persona_zh']}")
+            except Exception as e:
+                print(f"❌ 角色 {role} 人设生成失败：{e}")
+    save_registry(registry, path)
+    return registry
+
+
+def persona(registry: dict, role: str, lang: str = "zh") -> str:
+    """取某角色的一句话人设；旁白使用固定人设，未登记的角色返回空字符串。"""
+    entry = NARRATOR_PERSONA if role == NARRATOR else registry.get(role)
+    return entry.get(f"persona_{lang}", "") if entry else ""
+
+
+def speaking_style_rule(persona_en: str) -> str:
+    """人设已知时 for_decoder 提示词中关于 speaking_style 的要求：只写本句情绪，人设由 apply_persona 补上。"""
+    return (f"每句对白都需要包含speaking_style字段，说话人人设已确定为（{persona_en}），不要重复人设，"
+            f"只用简短英文描述此时场景下说这句话的情绪与语气")
+
+
+def apply_persona(data: dict, persona_en: str) -> dict:
+    """把一句话人设拼到每句对白的 speaking_style 前，得到与逐行推断时相同的“人设 + 情绪”格式。"""
+    for d in data.get("dialogues", []):
+        if isinstance(d, dict):
+            d["speaking_style"] = f"{persona_en}, {d.get('speaking_style', '')}".rstrip(", ")
+    return data
@@ -0,0 +1,165 @@
+import os
+import re
+import json
+import time
+import threading
+
+
+# 生成阶段（dialogue / speaking_style）的按行路由：不是每一行都值得用完整提示词调用一次模型。
+#
+#   full   完整提示词 + 完整背景，不限制输出长度（默认）；
+#   light  背景压缩到 context_tokens 以内，并用 max_tokens 限制输出长度；
+#   local  不调用模型，用本地模板生成（只用于语气词之类的极短台词）。
+#
+# 规则按阶段配置，按顺序取第一条匹配的，可匹配内容类别（class）、角色（roles）与字数上限（max_chars）；
+# 可用 JSON 文件覆盖默认规则（--routing-rules）。每行的路由决策、提示 token 估计与耗时追加到
+# <store_dir>/routing.jsonl，阶段结束时汇总各路由的行数、省下的调用与提示 token，写入 routing_summary.json。
+
+ROUTING_LOG     = "routing.jsonl"
+ROUTING_SUMMARY = "routing_summary.json"
+INTERJECTIONS   = set("啊呀哦噢嗯唉哎哈呵嘿喂哇咦呃嗨哼呸嘘哟喔")
+SHORT_LINE_CHARS   = 12
+SHORT_NARRATION_CHARS = 20
+LOCAL_STAGES    = {"dialogue"}   # 只有这些阶段允许 local 路由（解码器输出需要模型写场景描述与 JSON）
+
+DEFAULT_RULES = {
+    "dialogue": [
+        {"class": "interjection", "route": "local"},
+        {"class": ["short_line", "short_narration"], "route": "light", "max_tokens": 150, "context_tokens": 150},
+    ],
+    "speaking_style": [
+        {"class": ["interjection", "short_line", "short_narration"], "route": "light",
+         "max_tokens": 400, "context_tokens": 150},
+    ],
+}
+
+_NON_TEXT = re.compile(r"[\W_]+")
+_INNER_DELIMITERS = re.compile(r"[，,。！？!?；;…].")
+
+
+def classify(role: str, text: str) -> str:
+    """内容类别：interjection / short_line / short_narration / normal。"""
+    letters = _NON_TEXT.sub("", text)
+    if role == "旁白":
+        if len(letters) <= SHORT_NARRATION_CHARS and not _INNER_DELIMITERS.search(text.strip()):
+            return "short_narration"
+        return "normal"
+    # 只有全部由语气词组成的台词才走本地模板；“滚。”“是你？”这类短台词有实际内容，交给 light 路由
+    if letters and set(letters) <= INTERJECTIONS:
+        return "interjection"
+    if len(letters) <= SHORT_LINE_CHARS:
+        return "short_line"
+    return "normal"
+
+
+def local_dialogue(role: str, text: str) -> str:
+    """语气词的本地模板：按结尾标点补一个语气提示，格式与模型输出的（语气）台词相同。"""
+    text = text.strip()
+    if text.endswith(("！", "!")):
+        tone = "惊呼"
+    elif text.endswith(("？", "?")):
+        tone = "疑惑地"
+    elif text.endswith(("…", "……", "...")):
+        tone = "迟疑地"
+    else:
+        tone = "轻声"
+    return f"（{tone}）{text}"
+
+
+class Route:
+    def __init__(self, name: str, klass: str, max_tokens: int = None, context_tokens: int = None):
+        self.name = name
+        self.klass = klass
+        self.max_tokens = max_tokens
+        self.context_tokens = context_tokens
+
+    def call_kwargs(self) -> dict:
+        """附加到 chat.completions.create 的参数。"""
+        return {"max_tokens": self.max_tokens} if self.max_tokens else {}
+
+
+class Router:
+    """线程安全：run_claimed 的各线程共用一个 Router。"""
+
+    def __init__(self, store_dir: str = None, rules: dict = None):
+        self.rules = rules if rules is not None else DEFAULT_RULES
+        self._lock = threading.Lock()
+        self._log = open(os.path.join(store_dir, ROUTING_LOG), "a", encoding="utf-8") if store_dir else None
+        self.store_dir = store_dir
+        self.stats = {}
+
+    @classmethod
+    def from_file(cls, store_dir: str, path: str = None):
+        if not path:
+            return cls(store_dir)
+        with open(path, encoding="utf-8") as f:
+            return cls(store_dir, json.load(f))
+
+    def route(self, stage: str, role: str, text: str) -> Route:
+        klass = classify(role, text)
+        letters = len(_NON_TEXT.sub("", text))
+        for rule in self.rules.get(stage, []):
+            classes = rule.get("class")
+            if classes is not None and klass not in ([classes] if isinstance(classes, str) else classes):
+                continue
+            if "roles" in rule and role not in rule["roles"]:
+                continue
+            if "max_chars" in rule and letters > rule["max_chars"]:
+                continue
+            if rule["route"] == "local" and stage not in LOCAL_STAGES:
+                continue
+            return Route(rule["route"], klass, rule.get("max_tokens"), rule.get("context_tokens"))
+        return Route("full", klass)
+
+    def record(self, stage: str, turn_id, route: Route, prompt_tokens: int, full_prompt_tokens: int,
+               seconds: float, completion_tokens: int = None):
+        """记录一行的路由结果；full_prompt_tokens 为按 full 路由时的提示 token 估计。"""
+        entry = {"stage": stage, "id": turn_id, "route": route.name, "class": route.klass,
+                 "prompt_tokens": prompt_tokens, "full_prompt_tokens": full_prompt_tokens,
+                 "completion_tokens": completion_tokens, "seconds": round(seconds, 3), "at": time.time()}
+        with self._lock:
+            s = self.stats.setdefault(stage, {}).setdefault(route.name, {
+                "rows": 0, "calls": 0, "prompt_tokens": 0, "saved_prompt_tokens": 0,
+                "completion_tokens": 0, "seconds": 0.0})
+            s["rows"] += 1
+            s["calls"] += route.name != "local"
+            s["prompt_tokens"] += prompt_tokens
+            s["saved_prompt_tokens"] += full_prompt_tokens - prompt_tokens
+            s["completion_tokens"] += completion_tokens or 0
+            s["seconds"] += seconds
+            if self._log:
+                self._log.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                self._log.flush()
+
+    def summary(self, stage: str) -> dict:
+        routes = self.stats.get(stage, {})
+        rows = sum(s["rows"] for s in routes.values())
+        out = {"rows": rows,
+               "calls_avoided": sum(s["rows"] - s["calls"] for s in routes.values()),
+               "saved_prompt_tokens": sum(s["saved_prompt_tokens"] for s in routes.values()),
+               "routes": {}}
+        for name, s in routes.items():
+            out["routes"][name] = dict(s, avg_seconds=round(s["seconds"] / s["rows"], 3) if s["rows"] else 0.0,
+                                       seconds=round(s["seconds"], 3))
+        return out
+
+    def close(self, stage: str = None):
+        """关闭日志；给定 stage 时把该阶段的汇总写入 routing_summary.json 并打印。"""
+        if stage is not None:
+            summary = self.summary(stage)
+            if self.store_dir:
+                path = os.path.join(self.store_dir, ROUTING_SUMMARY)
+                data = {}
+                if os.path.isfile(path):
+                    with open(path, encoding="utf-8") as f:
+                        data = json.load(f)
+                data[stage] = summary
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+            routes = "，".join(f"{name} {s['rows']} 行（平均 {s['avg_seconds']}s）"
+                              for name, s in summary["routes"].items())
+            print(f"路由 {stage}：{routes}；省下 {summary['calls_avoided']} 次调用、"
+                  f"约 {summary['saved_prompt_tokens']} 提示 token")
+        if self._log:
+            self._log.close()
+            self._log = None
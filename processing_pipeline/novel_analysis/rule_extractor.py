@@ -0,0 +1,219 @@
+import os
+import re
+import sys
+import json
+import argparse
+
+
+# 基于规则的台词抽取：引号清晰、说话人提示明确（某某说：“……”）的段落在本地完成抽取，
+# 每个滑窗给出一个置信度，只有低置信度的滑窗才交给模型。
+#
+# 1. 分段：逐行找出成对的引号（“” 「」 ""），引号外为旁白，引号内为对白（去掉引号）；
+#    夹在句中的短引号（如 大家便叫她“小红帽”）视为旁白的一部分；
+# 2. 说话人：先看引号前的提示（某某说：），再看引号后的提示（”某某说。），
+#    提示中出现已知角色名时直接采用，新名字记入已知角色供后续滑窗使用；
+#    提示中只有代词时取最近一个有名字的说话人，没有提示的按两人交替对话推断，这两种置信度较低；
+#    仍无法判断的对白置信度为 0；
+# 3. 置信度：滑窗内各句对白置信度的最小值，没有对白的纯叙述滑窗为 1，引号不成对时为 0。
+#    取最小值而非平均值：一句无法判断（未知）或按代词推断的对白就足以让整个滑窗交给模型，
+#    不会被其余对白的高置信度平均掉。
+
+NARRATOR = "旁白"
+KNOWN_CONFIDENCE    = 1.0    # 提示中出现已知角色名
+NEW_NAME_CONFIDENCE = 0.85   # 提示中出现新名字
+PRONOUN_CONFIDENCE  = 0.5    # 提示中只有代词
+ALTERNATE_CONFIDENCE = 0.6   # 无提示，按两人交替推断
+EMBEDDED_QUOTE_CHARS = 10    # 句中不超过该长度、前后都无说话提示的引号视为旁白的一部分
+
+_QUOTE = re.compile(r"“([^“”]*)”|「([^「」]*)」|\"([^\"]*)\"")
+_PAIRS = (("“", "”"), ("「", "」"))
+_VERBS = ("说道|问道|答道|喊道|叫道|嚷道|笑道|叹道|回答|嘀咕|心想|补充|解释|命令|请求|央求|大叫|大喊"
+          "|说|道|问|答|喊|叫|嚷|骂|吼|叹|笑|哭|想")
+_ADVERBS = ("地|对|向|跟|朝|冲|又|便|就|也|却|才|还|连忙|赶紧|急忙|忙|笑着|哭着|大声|小声|低声|轻声"
+            "|高兴|生气|突然|终于|接着|回头|转身|开口|一边|不禁|忍不住")
+_PRONOUNS = {"他", "她", "它", "他们", "她们", "它们", "我", "你", "我们", "你们"}
+# 引号前的提示：以说话动词（+ 冒号 / 逗号）结尾
+_PRE_CUE = re.compile(rf"(?:{_VERBS})[道着了]?\s*[：:，,]?\s*$")
+# 引号后的提示：第一个分句只有“主语 + 状语 + 说话动词”
+_POST_CUE = re.compile(rf"^\s*([\u4e00-\u9fff]{{1,12}}?(?:{_VERBS})[道着]?)\s*(?:[。，,！!？?.]|$)")
+_SUBJECT = re.compile(rf"^([\u4e00-\u9fff]{{1,5}}?)(?={_ADVERBS}|{_VERBS})")
+_CLAUSE_END = re.compile(r"[。！？!?；;…]")
+_DELIMITERS = "。！？!?；;，,…"
+_ADDRESSEE = "对向跟朝冲和给"   # 紧跟在这些字后面的名字是听话人而不是说话人
+
+
+def _split_last_clause(text: str):
+    """把文本拆成 (最后一个分句之前的部分, 最后一个分句, 两者之间的分隔符)。"""
+    cut = max(text.rfind(c) for c in _DELIMITERS)
+    if cut < 0:
+        return "", text, ""
+    return text[:cut], text[cut + 1:], text[cut]
+
+
+class RuleExtractor:
+    """
+    按顺序处理滑窗的本地抽取器。names 为已知角色名（如 roles.json 中的角色），
+    抽取过程中从说话提示里发现的新名字会加入其中。
+    """
+
+    def __init__(self, names=()):
+        self.names = {n for n in names if n and n != NARRATOR}
+        self.speakers = []     # 最近确定的对白说话人（跨滑窗保留），用于代词与交替推断
+
+    # ———— 说话人 ————
+
+    def _speaker(self, clause: str):
+        """从提示分句中找说话人，返回 (名字或代词, 置信度)；找不到时返回 (None, 0)。"""
+        found = [(m.start(), -len(n), n) for n in self.names for m in re.finditer(re.escape(n), clause)
+                 if m.start() == 0 or clause[m.start() - 1] not in _ADDRESSEE]
+        if found:
+            return min(found)[2], KNOWN_CONFIDENCE
+        clause = clause.lstrip("，, ")
+        if re.match(_ADVERBS, clause):
+            return None, 0.0
+        for pronoun in sorted(_PRONOUNS, key=len, reverse=True):
+            if clause.startswith(pronoun):
+                return pronoun, PRONOUN_CONFIDENCE
+        m = _SUBJECT.match(clause)
+        if not m or m.group(1) in _PRONOUNS:
+            return None, 0.0
+        return m.group(1), NEW_NAME_CONFIDENCE
+
+    def _pre_cue(self, narration: str):
+        """引号前的旁白若以说话提示结尾，返回 (去掉提示后的旁白, 提示分句)。"""
+        if not _PRE_CUE.search(narration):
+            return None
+        head, clause, sep = _split_last_clause(narration.rstrip(" ：:，,"))
+        rest = head + (sep if sep not in "，," else "")
+        # 提示分句没有主语（如 她转过身，对狼说：）时，向前借用一个分句找说话人，该分句仍保留在旁白中
+        if sep in "，," and head and self._speaker(clause)[0] is None:
+            clause = _split_last_clause(head)[1] + "，" + clause
+        return rest, clause
+
+    @staticmethod
+    def _post_cue(narration: str):
+        """引号后的旁白若以说话提示开头，返回 (提示分句, 去掉提示后的旁白)。"""
+        m = _POST_CUE.match(narration)
+        if not m:
+            return None
+        return m.group(1), narration[m.end():].lstrip("，, ")
+
+    # ———— 抽取 ————
+
+    def _split_line(self, line: str) -> list:
+        """一行 → [("n", 旁白) | ("q", 对白, 前文, 后文)]，句中短引号并入旁白。"""
+        pieces, pos = [], 0
+        for m in _QUOTE.finditer(line):
+            quote = next(g for g in m.groups() if g is not None)
+            before, after = line[pos:m.start()], line[m.end():]
+            embedded = (len(quote) <= EMBEDDED_QUOTE_CHARS and before.strip() and after.strip()
+                        and not _CLAUSE_END.search(quote)
+                        and not _PRE_CUE.search(before) and not _POST_CUE.match(after)
+                        and not _CLAUSE_END.search(before.strip()[-1:]))
+            if embedded:
+                continue
+            pieces.append(("n", before))
+            pieces.append(("q", quote))
+            pos = m.end()
+        pieces.append(("n", line[pos:]))
+        # 把 continue 跳过的句中引号合并回旁白
+        merged = []
+        for kind, text in pieces:
+            if kind == "n" and merged and merged[-1][0] == "n":
+                merged[-1] = ("n", merged[-1][1] + text)
+            else:
+                merged.append((kind, text))
+        return merged
+
+    def extract(self, text: str):
+        """返回 ([{id, role, text}, …], 置信度)，格式与模型抽取结果相同。"""
+        turns, confidences = [], []
+        speakers = self.speakers
+        balanced = True
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            for left, right in _PAIRS:
+                if line.count(left) != line.count(right):
+                    balanced = False
+            if line.count('"') % 2:
+                balanced = False
+
+            pieces = self._split_line(line)
+            for i, piece in enumerate(pieces):
+                if piece[0] == "n":
+                    continue
+                quote = piece[1].strip()
+                before, after = pieces[i - 1][1], pieces[i + 1][1]
+                speaker, confidence = None, 0.0
+                pre = self._pre_cue(before)
+                if pre is not None:
+                    pieces[i - 1] = ("n", pre[0])
+                    speaker, confidence = self._speaker(pre[1])
+                if speaker is None:
+                    post = self._post_cue(after)
+                    if post is not None:
+                        pieces[i + 1] = ("n", post[1])
+                        speaker, confidence = self._speaker(post[0])
+                if speaker in _PRONOUNS:
+                    named = [s for s in speakers if s not in _PRONOUNS]
+                    speaker = named[-1] if named else None
+                    confidence = PRONOUN_CONFIDENCE if speaker else 0.0
+                elif speaker is None and not before.strip() and not after.strip() \
+                        and len(speakers) >= 2 and speakers[-1] != speakers[-2]:
+                    speaker, confidence = speakers[-2], ALTERNATE_CONFIDENCE
+                if speaker is not None:
+                    if confidence == NEW_NAME_CONFIDENCE:
+                        self.names.add(speaker)
+                    speakers.append(speaker)
+                pieces[i] = ("q", quote, speaker)
+                confidences.append(confidence)
+
+            for piece in pieces:
+                value = piece[1].strip().strip("，,")
+                if not value:
+                    continue
+                role = NARRATOR if piece[0] == "n" else (piece[2] or "未知")
+                turns.append({"id": len(turns) + 1, "role": role, "text": value})
+
+        del speakers[:-10]
+        if not balanced:
+            return turns, 0.0
+        confidence = min(confidences, default=1.0)
+        return turns, round(confidence, 4)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="规则抽取试跑：统计有多少滑窗可以不调用模型")
+    parser.add_argument("paths", nargs="+", help="小说 .txt 文件或目录")
+    parser.add_argument("--window-size", type=int, default=40)
+    parser.add_argument("--threshold", type=float, default=0.8, help="置信度不低于该值的滑窗在本地完成")
+    parser.add_argument("--show", type=int, default=0, help="打印前 N 个滑窗的抽取结果")
+    args = parser.parse_args(argv)
+
+    lines = []
+    for path in args.paths:
+        files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".txt")) \
+            if os.path.isdir(path) else [path]
+        for name in files:
+            with open(name, encoding="utf-8") as f:
+                lines.extend(f.readlines())
+
+    extractor = RuleExtractor()
+    local = 0
+    windows = range(0, len(lines), args.window_size)
+    for n, start in enumerate(windows):
+        turns, confidence = extractor.extract("".join(lines[start:start + args.window_size]))
+        local += confidence >= args.threshold
+        if n < args.show:
+            print(f"—— 滑窗 {n + 1}，置信度 {confidence}")
+            for t in turns:
+                sys.stdout.write(json.dumps(t, ensure_ascii=False) + "\n")
+    total = len(windows)
+    print(f"✅ 共 {total} 个滑窗，本地完成 {local} 个（{local / max(total, 1):.0%}），"
+          f"已知角色：{'、'.join(sorted(extractor.names)) or '无'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,54 @@
 import pandas as pd
-from openai import OpenAI
 import os
+import sys
 import csv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "utils"))
+from turn_store import TurnStore, DONE, migrate_legacy_csv, write_results_csv
+from llm_client import get_client
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from role_registry import build_registry, persona, speaking_style_rule, apply_persona
+from decoder_output import parse_decoder_output, dump_decoder_output
+
 # 配置 DeepSeek API
 from config import API_KEY
-client = OpenAI(api_key=API_KEY, base_url="https://api.deepseek.com")
+client = get_client(API_KEY)
 
 # 路径配置
 input_path = "../output/对话剧本_结构化数据_不含情绪动作.csv"
 output_path = "../output_decoder/test_for_json.csv"
 os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
-# 获取已处理的 ID 列表（如果输出文件存在）
-processed_ids = set()
+# 续跑状态记录在输出文件旁的 SQLite 状态库中：只跳过成功行，失败行不写入输出文件，下次运行自动重试；
+# 运行结束时按输入顺序重写输出文件，补跑成功的行回到原位置
+header = ['id', 'role', 'text', 'window_idx', 'emo_label', 'dialogue']
+STAGE = "decoder"
+store = TurnStore(output_path + ".db")
 if os.path.isfile(output_path):
-    with open(output_path, mode='r', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            processed_ids.add(str(row["id"]))
+    # 兼容旧输出文件：已有行导入状态库，"(生成失败" 行记为失败并移出文件
+    migrate_legacy_csv(store, STAGE, output_path, "dialogue")
 else:
     # 写入表头
     with open(output_path, mode='w', newline='', encoding='utf-8-sig') as f:
         writer = csv.writer(f)
-        writer.writerow(['id', 'role', 'text', 'window_idx', 'emo_label', 'dialogue'])
+        writer.writerow(header)
 
 
 
 # 读取数据
 data = pd.read_csv(input_path)
 print(data)
+
+# 角色人设：每个角色只调用一次模型，缓存在输出文件旁，重复运行直接复用
+registry = build_registry(data[["role", "text"]].astype(str).to_dict("records"), client,
+                          output_path + ".roles.json")
 # 新建空列表用于写结果
 results = []
 
 # 遍历每一行，逐步处理
 for idx, row in data.iterrows():
-    row_id = str(row["id"])
-    if row_id in processed_ids:
+    row_id = int(row["id"])
+    if store.status(STAGE, row_id) == DONE:
         print(f"⏭️ 跳过已处理的 ID: {row_id}")
         continue
 
@@ -66,12 +78,15 @@ for idx, row in data.iterrows():
     
     """
 
+    role_persona = persona(registry, role, "en")
+
     # 构造prompt
     if role == "旁白":
+        style_rule = speaking_style_rule(role_persona)
         prompt = f"""你是一个场景描述器，现在需要将一段旁白生成相应的描述，要求如下：\n
                     1 在scene_description中，用一句话按照结构（“画风为xxx，整体为xxx风格” + “主体描述用完整句子描述包括（时间，地点，人物，并侧重描写画面细节，但不要使用比喻）” + “氛围”）描述一个符合内容的静态画面，人物动作表情尽量详细，描述画面内容即可；\n
                     2. 将内容分成多句对白，放入dialogues中，\n
-                    3. 每句对白都需要包含speaking_style字段，用英文描述旁白的说话风格和语气，用一句话格式为（旁白（无性别、自然、音色）+此时场景下说这句话的情绪）；\n
+                    3. {style_rule}；\n
                     请只输出合法 JSON 列表，并用 ```json ...``` 包裹，格式如下：\n
                     {format}\n
                     下面给出具体内容和背景信息，情节和背景信息为分析并处理待转化文本\n
@@ -79,10 +94,14 @@ for idx, row in data.iterrows():
                     -----------------------------------------------------
                     当前内容（待转化文本）：{text}"""
     else:
+        if role_persona:
+            style_rule = speaking_style_rule(role_persona)
+        else:
+            style_rule = f"每句对白都需要包含speaking_style字段，用英文描述角色的说话风格和语气，格式为（角色{role}人设（性别、年龄、音色、性格）+此时场景下说这句话的情绪）"
         prompt = f"""你是一个场景描述器，现在需要带入角色{role}将一段对话总结相应的描述，要求如下：\n
                     1 在scene_description中，用一句话按照结构（“画风为xxx，整体为xxx风格” + “主体描述用完整句子描述包括（时间，地点，人物，并侧重描写画面细节，但不要使用比喻）” + “氛围”）描述一个符合内容的静态画面，人物动作表情尽量详细，描述画面内容即可；\n
                     2. 将内容分成多句对白，放入dialogues中\n
-                    3. 每句对白都需要包含speaking_style字段，用英文描述角色的说话风格和语气，格式为（角色{role}人设（性别、年龄、音色、性格）+此时场景下说这句话的情绪）；\n
+                    3. {style_rule}；\n
                     请只输出合法 JSON 列表，并用 ```json ...``` 包裹，格式如下：\n
                     {format}\n
                     下面给出具体内容和背景信息，情节和背景信息为分析并处理待转化文本\n
@@ -104,18 +123,27 @@ for idx, row in data.iterrows():
 
         )
         dialogue = response.choices[0].message.content.strip().replace('\n', '\\n')
+        # 人设在本地拼接到每句 speaking_style 前；无法解析的输出记为失败，下次运行重试
+        if role_persona:
+            dialogue = dump_decoder_output(apply_persona(parse_decoder_output(dialogue), role_persona))
 
         print("当前角色为:", role, end='.')
         print("对话内容为:", dialogue)
         print("描述性文本为:", '(' + text + ')')
         print('*-'*30)
     except Exception as e:
-        dialogue = f"(生成失败：{str(e)})"
+        store.fail(STAGE, [(row_id, str(e))])
+        print(f"❌ ID {row_id} 生成失败：{e}")
+        continue
 
-    # 写入到文件
+    # 先记入状态库再追加到文件（便于查看进度）；中断时多出或缺少的行由结束时的重写修正
+    store.complete(STAGE, [(row_id, dialogue)])
     with open(output_path, mode='a', newline='', encoding='utf-8-sig') as f:
         writer = csv.writer(f)
         writer.writerow(list(row) + [dialogue])
 
+# 按输入顺序重写输出文件：补跑成功的行写回原位置，而不是留在文件末尾
+write_results_csv(store, STAGE, output_path, header, ((int(r["id"]), list(r)) for _, r in data.iterrows()))
+
 
-print(f"✅ 对话生成完成，保存到：{output_path}")
+print(f"✅ 对话生成完成，保存到：{output_path}，状态：{store.status_counts(STAGE)}")
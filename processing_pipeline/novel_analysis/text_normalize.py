@@ -0,0 +1,153 @@
+import os
+import re
+import sys
+import html
+import json
+import hashlib
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from stream_io import open_stream, strip_compression
+
+# 送入模型前的原文清洗：每个章节文件只清洗一次，结果按文件内容的哈希缓存。
+#
+#   - HTML 实体与标签、零宽字符、网址，以及“本章未完，请点击下一页继续阅读”之类的爬虫残留；
+#   - 全角空格、不间断空格等统一为半角空格，行首行尾空白去掉，中文字符之间的空格（排版残留）删除，
+#     英文单词之间的空格保留；全角字母数字转为半角，中文标点不变；
+#   - 空行与 ----- / ***** 之类的分隔行删除。
+# 清洗后的每一行都是有内容的一行，抽取阶段的滑窗行数因此只计算有内容的行。
+# 缓存文件为 <cache_dir>/<sha256>.txt，键中包含 NORMALIZER_VERSION，规则变化时递增即可让旧缓存失效。
+
+NORMALIZER_VERSION = 2   # 2：网址只匹配 ASCII，不再吞掉紧跟的正文
+
+_ZERO_WIDTH = re.compile("[\u200b-\u200f\u2060\ufeff]")
+_SPACES = re.compile("[ \t\u00a0\u2000-\u200a\u202f\u205f\u3000]+")
+_TAGS = re.compile(r"</?[a-zA-Z][^<>]{0,200}>")
+# 网址只匹配 ASCII 字符：\w 会匹配汉字，紧跟在网址后的正文会被一并删掉
+_URL = re.compile(r"(?:https?://|www\.)[A-Za-z0-9./?=&%#:~+_-]+", re.I)
+_RESIDUE = re.compile("|".join([
+    r"本章未完[，,]?(?:请点击下一页继续阅读|点击下一页继续)?[。！!]*",
+    r"天才一秒记住本站地址[:：]?\S*",
+    r"请(?:记住|收藏)本(?:站|书)(?:域名|网址)?[:：]?\S*",
+    r"(?:手机用户请|手机阅读请)(?:浏览|访问)\S*",
+    r"[（(]本章完[)）]",
+]))
+_CJK = "\u2018-\u201d\u2026\u3000-\u303f\u3400-\u9fff\uff00-\uffef"
+_CJK_SPACE = re.compile(f"(?<=[{_CJK}]) (?=[{_CJK}])")
+_SEPARATOR_LINE = re.compile(r"^[-=*_~#]{3,}$")
+# (输入行, 期望结果)：--check 时逐条核对，规则改动后用于确认没有删掉正文
+CHECKS = [
+    ("详见https://abc.com小红帽走进了森林，看见一只狼。", "详见小红帽走进了森林，看见一只狼。"),
+    ("请访问www.example.com/a?b=1继续阅读下文", "请访问继续阅读下文"),
+    ("小 红 帽&nbsp;说：\u3000“你好。”", "小红帽说：“你好。”"),
+    ("Little Red Riding Hood", "Little Red Riding Hood"),
+    ("本章未完，请点击下一页继续阅读", ""),
+    ("-----", ""),
+]
+_FULLWIDTH_ALNUM = {c: c - 0xFEE0 for c in [*range(0xFF10, 0xFF1A), *range(0xFF21, 0xFF3B), *range(0xFF41, 0xFF5B)]}
+
+
+def normalize_line(line: str) -> str:
+    """清洗一行，见模块说明；返回空字符串表示该行应删除。"""
+    line = html.unescape(line)
+    line = _ZERO_WIDTH.sub("", line)
+    line = _TAGS.sub("", line)
+    line = _URL.sub("", line)
+    line = _RESIDUE.sub("", line)
+    line = line.translate(_FULLWIDTH_ALNUM)
+    line = _SPACES.sub(" ", line).strip()
+    line = _CJK_SPACE.sub("", line)
+    if _SEPARATOR_LINE.match(line):
+        return ""
+    return line
+
+
+def normalize_text(text: str) -> list:
+    """返回清洗后的行列表，每行以换行符结尾（与 readlines() 的格式相同）。"""
+    return [line + "\n" for line in map(normalize_line, text.splitlines()) if line]
+
+
+def normalize_file(path: str, cache_dir: str) -> tuple:
+    """
+    读取并清洗一个 .txt 文件（可为 .txt.zst / .txt.gz），命中缓存时直接读取缓存。
+    缓存键为解压后内容的哈希，原文改为压缩存放后缓存仍然有效。
+    返回 (行列表, {"raw_bytes", "bytes", "raw_lines", "lines", "cached"})。
+    """
+    with open_stream(path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw + f"\0normalize-v{NORMALIZER_VERSION}".encode()).hexdigest()
+    cache_path = os.path.join(cache_dir, f"{digest}.txt")
+    raw_lines = raw.count(b"\n") + (1 if raw and not raw.endswith(b"\n") else 0)
+
+    if os.path.isfile(cache_path):
+        with open(cache_path, encoding="utf-8") as f:
+            lines = f.readlines()
+        cached = True
+    else:
+        lines = normalize_text(raw.decode("utf-8-sig"))
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        os.replace(tmp, cache_path)
+        cached = False
+    clean_bytes = sum(len(line.encode("utf-8")) for line in lines)
+    return lines, {"raw_bytes": len(raw), "bytes": clean_bytes, "raw_lines": raw_lines, "lines": len(lines),
+                   "cached": cached}
+
+
+def check() -> list:
+    """核对 CHECKS，返回不符合期望的 (输入, 期望, 实际) 列表。"""
+    return [(line, expected, normalize_line(line)) for line, expected in CHECKS if normalize_line(line) != expected]
+
+
+def merge_stats(total: dict, stats: dict) -> dict:
+    """累加多个文件的清洗统计。"""
+    for key in ("raw_bytes", "bytes", "raw_lines", "lines"):
+        total[key] = total.get(key, 0) + stats[key]
+    total["files"] = total.get("files", 0) + 1
+    total["cached"] = total.get("cached", 0) + stats["cached"]
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="清洗小说原文并缓存，统计清洗前后的大小")
+    parser.add_argument("paths", nargs="*", help=".txt（可压缩）文件或目录")
+    parser.add_argument("--cache-dir", default=os.path.join("mid_output", ".normalized"), help="清洗结果缓存目录")
+    parser.add_argument("--show", type=int, default=0, help="打印第一个文件清洗后的前 N 行")
+    parser.add_argument("--check", action="store_true", help="核对内置的清洗样例后退出")
+    args = parser.parse_args(argv)
+
+    if not args.check and not args.paths:
+        parser.error("需要给出 .txt 文件或目录，或使用 --check")
+    if args.check:
+        failures = check()
+        for line, expected, actual in failures:
+            print(f"❌ {line!r}：期望 {expected!r}，实际 {actual!r}")
+        print(f"{'✅' if not failures else '⚠️'} 清洗样例 {len(CHECKS) - len(failures)}/{len(CHECKS)} 通过")
+        if failures:
+            sys.exit(1)
+        return
+
+    total, shown = {}, False
+    for path in args.paths:
+        files = sorted(os.path.join(path, f) for f in os.listdir(path)
+                       if strip_compression(f).lower().endswith(".txt")) \
+            if os.path.isdir(path) else [path]
+        for name in files:
+            lines, stats = normalize_file(name, args.cache_dir)
+            merge_stats(total, stats)
+            if args.show and not shown:
+                sys.stdout.writelines(lines[:args.show])
+                shown = True
+    if not total:
+        print("⚠️ 没有找到 .txt 文件")
+        return
+    print(json.dumps(total, ensure_ascii=False))
+    print(f"✅ {total['files']} 个文件（缓存命中 {total['cached']}），"
+          f"{total['raw_bytes']} → {total['bytes']} 字节（{1 - total['bytes'] / max(total['raw_bytes'], 1):.1%} 减少），"
+          f"{total['raw_lines']} → {total['lines']} 行")
+
+
+if __name__ == "__main__":
+    main()
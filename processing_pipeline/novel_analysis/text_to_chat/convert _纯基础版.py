@@ -1,29 +1,34 @@
 import pandas as pd
-from openai import OpenAI
 import os
+import sys
 import csv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "utils"))
+from turn_store import TurnStore, DONE, migrate_legacy_csv, write_results_csv
+from llm_client import get_client
+
 # 配置 DeepSeek API
 from ..config import API_KEY
-client = OpenAI(api_key=API_KEY, base_url="https://api.deepseek.com")
+client = get_client(API_KEY)
 
 # 路径配置
 input_path = "../mid_output/3_提取后结果_情绪_含动作.csv"
 output_path = "../output/对话剧本_结构化数据_纯基础版.csv"
 os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
-# 获取已处理的 ID 列表（如果输出文件存在）
-processed_ids = set()
+# 续跑状态记录在输出文件旁的 SQLite 状态库中：只跳过成功行，失败行不写入输出文件，下次运行自动重试；
+# 运行结束时按输入顺序重写输出文件，补跑成功的行回到原位置
+header = ['id', 'role', 'text', 'window_idx', 'emo_label', 'behaviour', 'dialogue']
+STAGE = "dialogue"
+store = TurnStore(output_path + ".db")
 if os.path.isfile(output_path):
-    with open(output_path, mode='r', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            processed_ids.add(str(row["id"]))
+    # 兼容旧输出文件：已有行导入状态库，"(生成失败" 行记为失败并移出文件
+    migrate_legacy_csv(store, STAGE, output_path, "dialogue")
 else:
     # 写入表头
     with open(output_path, mode='w', newline='', encoding='utf-8-sig') as f:
         writer = csv.writer(f)
-        writer.writerow(['id', 'role', 'text', 'window_idx', 'emo_label', 'behaviour', 'dialogue'])
+        writer.writerow(header)
 
 
 # 读取数据
@@ -34,8 +39,8 @@ results = []
 
 # 遍历每一行，逐步处理
 for idx, row in data.iterrows():
-    row_id = str(row["id"])
-    if row_id in processed_ids:
+    row_id = int(row["id"])
+    if store.status(STAGE, row_id) == DONE:
         print(f"⏭️ 跳过已处理的 ID: {row_id}")
         continue
 
@@ -78,12 +83,18 @@ for idx, row in data.iterrows():
         print("描述性文本为:", '(' + text + ')')
         print('*-'*30)
     except Exception as e:
-        dialogue = f"(生成失败：{str(e)})"
+        store.fail(STAGE, [(row_id, str(e))])
+        print(f"❌ ID {row_id} 生成失败：{e}")
+        continue
 
-    # 写入到文件
+    # 先记入状态库再追加到文件（便于查看进度）；中断时多出或缺少的行由结束时的重写修正
+    store.complete(STAGE, [(row_id, dialogue)])
     with open(output_path, mode='a', newline='', encoding='utf-8-sig') as f:
         writer = csv.writer(f)
         writer.writerow(list(row) + [dialogue])
 
+# 按输入顺序重写输出文件：补跑成功的行写回原位置，而不是留在文件末尾
+write_results_csv(store, STAGE, output_path, header, ((int(r["id"]), list(r)) for _, r in data.iterrows()))
+
 
-print(f"✅ 对话生成完成，保存到：{output_path}")
+print(f"✅ 对话生成完成，保存到：{output_path}，状态：{store.status_counts(STAGE)}")
@@ -0,0 +1,112 @@
+import re
+
+
+# 抽取阶段的滑窗构造、边界拼接与覆盖率统计。
+#
+# 重叠滑窗（overlap）下每行原文要在约 1/(1-overlap_rate) 个窗口里各抽一遍，再由 rewrite_global 去重；
+# 不重叠滑窗（disjoint）把原文切成互不相交的窗口，每个窗口前附带 CONTEXT_LINES 行只读前文，
+# 只帮助模型理解说话人与指代，不参与抽取。窗口边界处只需要处理三种情况：
+#   - 模型仍抽取了只读前文中的句子 → 该句只出现在前文、不出现在本窗口原文时丢弃；
+#   - 同一句话被窗口边界切开 → 与上一窗口最后一句同角色、且上一句没有以句末标点结尾时合并；
+#   - 相邻窗口重复抽取同一句 → 同角色且文字相同，或是上一句的结尾且出现在只读前文中时保留前一个；
+#     只是文字被上一句包含（甲：“我们走吧。” 乙：“走吧。”）的不同角色台词照常保留。
+# 覆盖率：原文每行的字符 2-gram 有多少出现在抽取结果中，按字数加权，用来核对两种模式的抽取完整度。
+
+CONTEXT_LINES = 5       # 不重叠模式下每个窗口附带的只读前文行数
+COVERED_RATIO = 0.8     # 一行原文的 2-gram 至少有该比例出现在抽取结果中才算被覆盖
+
+_NON_TEXT = re.compile(r"[\W_]+")
+_SENTENCE_END = ("。", "！", "？", "!", "?", "…", "”", "」", "\"")
+
+
+def normalize(text: str) -> str:
+    """去掉空白与标点（含引号），只保留文字，用于比较抽取结果与原文。"""
+    return _NON_TEXT.sub("", text)
+
+
+def build_windows(lines: list, window_size: int, overlap_rate: float = 0.0, mode: str = "disjoint",
+                  context_lines: int = CONTEXT_LINES) -> list:
+    """
+    返回 [(window_idx, window_text, context_text)]。
+    overlap 模式每次前进 window_size*(1-overlap_rate) 行、不带前文；disjoint 模式步长等于窗口大小。
+    """
+    if mode == "overlap":
+        stride = max(1, int(window_size * (1 - overlap_rate)))
+        context_lines = 0
+    else:
+        stride = window_size
+    windows = []
+    for start in range(0, len(lines), stride):
+        window_lines = lines[start: start + window_size]
+        if not window_lines:
+            break
+        context = "".join(lines[max(0, start - context_lines): start]) if context_lines else ""
+        windows.append((start // stride + 1, "".join(window_lines), context))
+    return windows
+
+
+def prompt_tokens(windows) -> int:
+    """各窗口送入模型的原文（含只读前文）的估计 token 数之和，不含固定的指令部分。"""
+    from context_builder import estimate_tokens
+
+    return sum(estimate_tokens(text) + estimate_tokens(context) for _, text, context in windows)
+
+
+def stitch(windows, results: dict) -> list:
+    """
+    按窗口顺序拼接各窗口的抽取结果并处理边界，见模块说明。
+    results: {window_idx: [{id, role, text}, …]}；返回带 window_idx 的台词列表（未编号）。
+    """
+    out = []
+    for window_idx, window_text, context in windows:
+        own, before = normalize(window_text), normalize(context)
+        turns = sorted(results.get(window_idx, []), key=lambda t: t.get("id", 0))
+        for i, t in enumerate(turns):
+            text = str(t["text"]).strip()
+            key = normalize(text)
+            if not key:
+                continue
+            if before and key in before and key not in own:
+                continue                      # 只读前文中的句子
+            if i == 0 and out and out[-1]["window_idx"] != window_idx:
+                last = out[-1]
+                last_key = normalize(last["text"])
+                if last["role"] == t["role"] and \
+                        (key == last_key or (last_key.endswith(key) and before and key in before)):
+                    continue                  # 相邻窗口重复抽取
+                if last["role"] == t["role"] and not last["text"].endswith(_SENTENCE_END):
+                    last["text"] += text      # 被窗口边界切开的一句
+                    continue
+            out.append({"role": t["role"], "text": text, "window_idx": window_idx})
+    return out
+
+
+def renumber(turns: list) -> list:
+    for idx, t in enumerate(turns, start=1):
+        t["id"] = idx
+    return turns
+
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def coverage(lines: list, turns: list) -> dict:
+    """原文覆盖率：{"chars": 按字数加权的 2-gram 覆盖率, "lines": 被覆盖的行占比}。"""
+    extracted = set()
+    for t in turns:
+        extracted |= _bigrams(normalize(str(t["text"])))
+    total = covered_chars = 0
+    n_lines = covered_lines = 0
+    for line in lines:
+        grams = _bigrams(normalize(line))
+        if not grams:
+            continue
+        ratio = len(grams & extracted) / len(grams)
+        weight = len(grams) + 1
+        total += weight
+        covered_chars += ratio * weight
+        n_lines += 1
+        covered_lines += ratio >= COVERED_RATIO
+    return {"chars": round(covered_chars / total, 4) if total else 1.0,
+            "lines": round(covered_lines / n_lines, 4) if n_lines else 1.0}
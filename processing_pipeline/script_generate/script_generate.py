@@ -1,41 +1,175 @@
-import pandas as pd
-from docx import Document # python-docx
-from docx.shared import Pt
-from docx.oxml.ns import qn
-
-# 读取CSV数据
-input_path = "../B_novel_analysis/output/test_结构化数据_不含情绪动作.csv"
-df = pd.read_csv(input_path)
-
-# 创建Word文档
-doc = Document()
-doc.styles['Normal'].font.name = u'宋体'  # 设置中文字体
-doc.styles['Normal']._element.rPr.rFonts.set(qn('w:eastAsia'), u'宋体')
-
-# 遍历每一行，添加到文档中
-for _, row in df.iterrows():
-    role = str(row["role"]).strip()
-    dialogue = str(row["emo_label"]).strip()
-
-    dialogue = dialogue.replace(r'\n\n', '')
-    #print(f"处理角色：{role}，对白：{dialogue}")
-
-    # 跳过空dialogue
-    if not dialogue or dialogue.startswith("(生成失败"):
-        continue
-
-    if role in ["", "旁白"]:
-        para = doc.add_paragraph()
-        run = para.add_run(dialogue)
-        run.font.size = Pt(10)
-        run.bold = False
-    else:
-        para = doc.add_paragraph()
-        run = para.add_run(f"{role}：{dialogue}")
-        run.font.size = Pt(12)
-        run.bold = True
-
-# 保存文档
-output_path = "剧本输出_龙傲天版.docx"
-doc.save(output_path)
-print(f"✅ Word剧本已保存到：{output_path}")
+import os
+import csv
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# ———— 配置 ————
+INPUT_PATH      = "../B_novel_analysis/output/test_结构化数据_不含情绪动作.csv"
+OUTPUT_PATH     = "剧本输出_龙傲天版.docx"
+DIALOGUE_COLUMN = "emo_label"   # 该实验输出中对白写在 emo_label 列；main.py 的 2_script_*.csv 请用 dialogue
+FONT_NAME       = u'宋体'
+NARRATION_STYLE = "剧本旁白"     # 旁白：10 号、不加粗
+LINE_STYLE      = "剧本台词"     # 角色台词：12 号、加粗
+# —————————————————
+
+
+def iter_script_lines(rows, column=DIALOGUE_COLUMN):
+    """
+    逐行产出 (role, dialogue)，跳过空对白与生成失败的行。
+    rows 可以是任意可迭代的 dict（如 csv.DictReader），不会一次性读入内存。
+    """
+    for row in rows:
+        role = str(row.get("role") or "").strip()
+        dialogue = str(row.get(column) or "").strip()
+
+        dialogue = dialogue.replace(r'\n\n', '')
+
+        # 跳过空dialogue
+        if not dialogue or dialogue.startswith("(生成失败"):
+            continue
+        yield role, dialogue
+
+
+def _is_narration(role):
+    return role in ["", "旁白"]
+
+
+def new_document():
+    """创建 Word 文档并注册两种段落样式；字体只在样式上设置一次，段落直接引用样式。"""
+    from docx import Document # python-docx
+    from docx.shared import Pt
+    from docx.enum.style import WD_STYLE_TYPE
+    from docx.oxml.ns import qn
+
+    doc = Document()
+    doc.styles['Normal'].font.name = FONT_NAME  # 设置中文字体
+    doc.styles['Normal']._element.rPr.rFonts.set(qn('w:eastAsia'), FONT_NAME)
+
+    for name, size, bold in [(NARRATION_STYLE, 10, False), (LINE_STYLE, 12, True)]:
+        style = doc.styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+        style.base_style = doc.styles['Normal']
+        style.font.size = Pt(size)
+        style.font.bold = bold
+    return doc
+
+
+def render_docx(lines, output_path):
+    doc = new_document()
+    # 样式 id 只解析一次：add_paragraph(style=...) 每段都会重新扫描样式表，段落多时反而比逐段设字体更慢
+    narration_id = doc.styles[NARRATION_STYLE].style_id
+    line_id = doc.styles[LINE_STYLE].style_id
+    count = 0
+    for role, dialogue in lines:
+        if _is_narration(role):
+            p = doc.add_paragraph(dialogue)
+            p._p.get_or_add_pPr().style = narration_id
+        else:
+            p = doc.add_paragraph(f"{role}：{dialogue}")
+            p._p.get_or_add_pPr().style = line_id
+        count += 1
+    doc.save(output_path)
+    return count
+
+
+def render_text(lines, output_path, markdown=False):
+    count = 0
+    with open(output_path, "w", encoding="utf-8") as f:
+        for role, dialogue in lines:
+            if _is_narration(role):
+                f.write(f"{dialogue}\n\n" if markdown else f"{dialogue}\n")
+            else:
+                f.write(f"**{role}**：{dialogue}\n\n" if markdown else f"{role}：{dialogue}\n")
+            count += 1
+    return count
+
+
+def render(lines, output_path, fmt):
+    if fmt == "docx":
+        return render_docx(lines, output_path)
+    return render_text(lines, output_path, markdown=(fmt == "md"))
+
+
+def _render_shard(args):
+    lines, output_path, fmt = args
+    return output_path, render(lines, output_path, fmt)
+
+
+def _shard_path(output_path, shard_idx):
+    stem, ext = os.path.splitext(output_path)
+    return f"{stem}_{shard_idx:03d}{ext}"
+
+
+def iter_shards(rows, windows_per_shard, column=DIALOGUE_COLUMN):
+    """
+    按 window_idx 把剧本切成若干分片，每 windows_per_shard 个滑窗一片（近似按章节）。
+    输入须按 window_idx 有序，因此只需缓存当前分片的行；已结束的分片再次出现时报错，
+    而不是生成同名分片覆盖前一个文件。
+    """
+    shard_idx, shard_lines, finished = None, [], set()
+    for row in rows:
+        try:
+            idx = (int(float(row.get("window_idx") or 0)) - 1) // windows_per_shard + 1
+        except ValueError:
+            idx = shard_idx or 1
+        if shard_idx is not None and idx != shard_idx:
+            finished.add(shard_idx)
+            if shard_lines:
+                yield shard_idx, shard_lines
+                shard_lines = []
+        if idx in finished:
+            raise ValueError(f"第 {idx} 个分片在输入中再次出现（window_idx={row.get('window_idx')}，id={row.get('id')}），"
+                             f"分片渲染要求输入按 window_idx 排序")
+        shard_idx = idx
+        shard_lines.extend(iter_script_lines([row], column))
+    if shard_lines:
+        yield shard_idx, shard_lines
+
+
+def render_sharded(rows, output_path, fmt, windows_per_shard, workers, column=DIALOGUE_COLUMN):
+    """分片并行渲染，同时在途的分片数不超过 workers*2，返回 [(分片路径, 行数)]。"""
+    results = []
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for shard_idx, lines in iter_shards(rows, windows_per_shard, column):
+            pending.append(executor.submit(_render_shard, (lines, _shard_path(output_path, shard_idx), fmt)))
+            if len(pending) >= workers * 2:
+                results.append(pending.popleft().result())
+        while pending:
+            results.append(pending.popleft().result())
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="将结构化剧本 CSV 渲染为 Word / 纯文本 / Markdown 剧本")
+    parser.add_argument("--input", default=INPUT_PATH)
+    parser.add_argument("--output", default=OUTPUT_PATH, help="输出路径；分片时作为文件名前缀")
+    parser.add_argument("--column", default=DIALOGUE_COLUMN, help="对白所在列")
+    parser.add_argument("--format", choices=["docx", "txt", "md"], default=None,
+                        help="输出格式，缺省按 --output 的扩展名判断")
+    parser.add_argument("--shard-windows", type=int, default=0,
+                        help="每多少个 window_idx 切成一个文档（0 为不分片）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="分片渲染的并行进程数")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or os.path.splitext(args.output)[1].lstrip(".").lower() or "docx"
+    if fmt not in ("docx", "txt", "md"):
+        parser.error(f"无法识别的输出格式：{fmt}")
+
+    with open(args.input, "r", encoding="utf-8-sig", newline="") as f:
+        rows = csv.DictReader(f)
+        if args.shard_windows > 0:
+            try:
+                results = render_sharded(rows, args.output, fmt, args.shard_windows, args.workers, args.column)
+            except ValueError as e:
+                parser.error(str(e))
+            for path, count in results:
+                print(f"  {path}: {count} 段")
+            print(f"✅ 剧本已分 {len(results)} 个文件保存")
+        else:
+            count = render(iter_script_lines(rows, args.column), args.output, fmt)
+            print(f"✅ 剧本已保存到：{args.output}（{count} 段）")
+
+
+if __name__ == "__main__":
+    main()
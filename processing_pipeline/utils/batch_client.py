@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import socket
+
+
+# 离线批任务：把待处理的请求编译成 OpenAI 兼容批任务的 JSONL 文件，上传并提交到 /v1/batches，
+# 轮询到完成后按 custom_id 取回结果。批任务以延迟换吞吐与价格，适合多 GB 语料的离线生成阶段。
+#
+# 工作目录（如 mid_output/<folder>/batches/dialogue/）中的 manifest.json 记录每个输入文件、批任务 id 与状态，
+# 每提交一个批任务就写回一次：进程中断后重新运行会接着提交 / 轮询上次的批任务，而不是重复提交；
+# 结果合并完成后 manifest 改名归档。没有批任务接口的服务（如 DeepSeek）可以用 batch_server.py
+# 在本地代为逐条转发，batch_server.py 也用于测试整个流程。
+
+BATCH_BASE_URL      = "http://127.0.0.1:8765/v1"   # OpenAI 兼容的批任务接口，缺省为本地 batch_server.py
+ENDPOINT            = "/v1/chat/completions"
+COMPLETION_WINDOW   = "24h"
+POLL_SECONDS        = 60
+MAX_FILE_REQUESTS   = 50000                 # 单个输入文件的请求数上限
+MAX_FILE_BYTES      = 190 * 1024 * 1024     # 单个输入文件的大小上限（接口限制 200MB）
+CLAIM_LEASE_SECONDS = 600                   # 第一遍领取与编译请求期间的租约，与同步执行相同
+BATCH_LEASE_SECONDS = 2 * 24 * 3600         # manifest 写入后，批任务中的行在状态库中的租约，长于批任务的完成时限
+MANIFEST            = "manifest.json"
+ROWS_FILE           = "rows.jsonl"
+TERMINAL            = {"completed", "failed", "expired", "cancelled"}
+
+
+def get_batch_client(api_key: str, base_url: str = BATCH_BASE_URL):
+    """批任务只有少量上传、轮询与下载请求，使用普通客户端即可，不需要连接池。"""
+    from openai import OpenAI
+
+    return OpenAI(api_key=api_key, base_url=base_url, max_retries=5)
+
+
+class Deferred(Exception):
+    """第一遍执行时由记录用的 create 抛出，携带本应发出的请求体。"""
+
+    def __init__(self, body: dict):
+        super().__init__("请求已编入批任务")
+        self.body = body
+
+
+def record_request(**kwargs):
+    """代替 client.chat.completions.create：不发请求，只记录请求体（批任务不支持 stream）。"""
+    kwargs.pop("stream", None)
+    raise Deferred(kwargs)
+
+
+def replay_response(body: dict):
+    """把批任务输出中的响应体还原成 ChatCompletion，使处理函数第二遍执行时与同步调用的返回值一致。"""
+    from openai.types.chat import ChatCompletion
+
+    return lambda **kwargs: ChatCompletion.construct(**body)
+
+
+class BatchRunner:
+    def __init__(self, client, work_dir: str, poll_seconds: float = POLL_SECONDS, metadata: dict = None):
+        self.client = client
+        self.work_dir = work_dir
+        self.poll_seconds = poll_seconds
+        self.metadata = metadata
+        self.manifest_path = os.path.join(work_dir, MANIFEST)
+
+    # ———— manifest ————
+
+    def load(self):
+        """上次未合并完成的 manifest；没有时返回 None。"""
+        if not os.path.isfile(self.manifest_path):
+            return None
+        with open(self.manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save(self, manifest: dict):
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.manifest_path)
+
+    def archive(self):
+        """结果已合并：manifest 改名归档，下次运行重新编译待处理请求。"""
+        if os.path.isfile(self.manifest_path):
+            os.replace(self.manifest_path, os.path.join(self.work_dir, f"manifest.{int(time.time())}.json"))
+
+    # ———— 提交 ————
+
+    def submit(self, requests) -> dict:
+        """
+        requests: [(custom_id, 请求体)]。按请求数与文件大小切分为输入文件，逐个上传并创建批任务。
+        """
+        os.makedirs(self.work_dir, exist_ok=True)
+        stamp = int(time.time())
+        manifest = {"created_at": stamp, "requests": 0, "batches": []}
+        out, count, size = None, 0, 0
+
+        def open_next():
+            path = os.path.join(self.work_dir, f"input.{stamp}.{len(manifest['batches'])}.jsonl")
+            manifest["batches"].append({"file": path, "requests": 0, "input_file_id": None, "batch_id": None,
+                                        "status": None, "output_file_id": None, "error_file_id": None})
+            return open(path, "w", encoding="utf-8")
+
+        for custom_id, body in requests:
+            line = json.dumps({"custom_id": str(custom_id), "method": "POST", "url": ENDPOINT, "body": body},
+                              ensure_ascii=False) + "\n"
+            n = len(line.encode("utf-8"))
+            if out is None or count >= MAX_FILE_REQUESTS or size + n > MAX_FILE_BYTES:
+                if out is not None:
+                    out.close()
+                out, count, size = open_next(), 0, 0
+            out.write(line)
+            count += 1
+            size += n
+            manifest["batches"][-1]["requests"] += 1
+            manifest["requests"] += 1
+        if out is not None:
+            out.close()
+        self._save(manifest)
+        self._submit_pending(manifest)
+        return manifest
+
+    def _submit_pending(self, manifest: dict):
+        for entry in manifest["batches"]:
+            if entry["input_file_id"] is None:
+                with open(entry["file"], "rb") as f:
+                    entry["input_file_id"] = self.client.files.create(file=f, purpose="batch").id
+                self._save(manifest)
+            if entry["batch_id"] is None:
+                batch = self.client.batches.create(input_file_id=entry["input_file_id"], endpoint=ENDPOINT,
+                                                   completion_window=COMPLETION_WINDOW, metadata=self.metadata)
+                entry["batch_id"], entry["status"] = batch.id, batch.status
+                self._save(manifest)
+                print(f"📤 已提交批任务 {batch.id}（{entry['requests']} 个请求）")
+
+    # ———— 轮询与取回 ————
+
+    def wait(self, manifest: dict):
+        """轮询到所有批任务进入终态（completed / failed / expired / cancelled）。"""
+        self._submit_pending(manifest)
+        while True:
+            for entry in manifest["batches"]:
+                if entry["status"] in TERMINAL:
+                    continue
+                batch = self.client.batches.retrieve(entry["batch_id"])
+                entry["status"] = batch.status
+                entry["output_file_id"] = batch.output_file_id
+                entry["error_file_id"] = batch.error_file_id
+                counts = batch.request_counts
+                if counts is not None:
+                    entry["completed"], entry["failed"] = counts.completed, counts.failed
+            self._save(manifest)
+            done = sum(e.get("completed", 0) + e.get("failed", 0) for e in manifest["batches"])
+            states = ", ".join(f"{e['batch_id']}:{e['status']}" for e in manifest["batches"])
+            print(f"⏳ 批任务进度 {done}/{manifest['requests']}（{states}）")
+            if all(e["status"] in TERMINAL for e in manifest["batches"]):
+                return
+            time.sleep(self.poll_seconds)
+
+    def _download(self, file_id: str) -> list:
+        # 下载内容缓存在工作目录中，重跑合并时不必重新下载
+        path = os.path.join(self.work_dir, f"{file_id}.jsonl")
+        if not os.path.isfile(path):
+            data = self.client.files.content(file_id).read()
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def results(self, manifest: dict) -> dict:
+        """
+        {custom_id: (响应体, None) 或 (None, 错误信息)}。
+        未出现在输出 / 错误文件中的请求（批任务 failed / expired / cancelled）以批任务状态作为错误信息。
+        """
+        out = {}
+        for entry in manifest["batches"]:
+            for file_id in (entry["output_file_id"], entry["error_file_id"]):
+                if not file_id:
+                    continue
+                for line in self._download(file_id):
+                    response, error = line.get("response"), line.get("error")
+                    if response and response.get("status_code") == 200 and not error:
+                        out[line["custom_id"]] = (response["body"], None)
+                    else:
+                        body = (response or {}).get("body") or {}
+                        error = error or body.get("error") or {"message": f"HTTP {(response or {}).get('status_code')}"}
+                        out[line["custom_id"]] = (None, error.get("message") if isinstance(error, dict) else str(error))
+            if entry["status"] != "completed":
+                with open(entry["file"], encoding="utf-8") as f:
+                    for line in f:
+                        custom_id = json.loads(line)["custom_id"]
+                        out.setdefault(custom_id, (None, f"批任务 {entry['batch_id']} 状态为 {entry['status']}"))
+        return out
+
+
+def run_batched(store, stage: str, process, runner: BatchRunner, claim_size: int = 1000) -> dict:
+    """
+    以批任务执行流水线的一个阶段，与 run_claimed 使用同一个处理函数 process(row, create)：
+      第一遍领取全部 pending 行，用 record_request 作为 create 执行 process，收集请求体并提交批任务
+      （走本地模板等不调用模型的行在这一遍直接完成）；
+      批任务完成后，第二遍用 replay_response 把每行的响应交给 process，成功记为 done、异常记为 failed。
+    提交后中断的运行再次调用时，从工作目录中的 manifest 与 rows.jsonl 继续轮询与合并，不重新领取。
+    第一遍以普通租约领取，rows.jsonl 与 manifest 落盘后才把编入批任务的行延长到 BATCH_LEASE_SECONDS：
+    落盘前中断的行在普通租约过期后即可重新领取，不会在状态库里搁置两天。
+
+    Returns:
+        {"done": 本次成功行数, "failed": 本次失败行数, "requests": 批任务请求数}
+    """
+    counts = {"done": 0, "failed": 0, "requests": 0}
+    rows_path = os.path.join(runner.work_dir, ROWS_FILE)
+    manifest = runner.load()
+    if manifest is None:
+        worker = f"{socket.gethostname()}-{os.getpid()}-batch"
+        ok, bad, rows, requests = [], [], [], []
+        while True:
+            claimed = store.claim(stage, worker, claim_size, CLAIM_LEASE_SECONDS)
+            if not claimed:
+                break
+            store.renew(stage, worker)
+            for row in claimed:
+                try:
+                    ok.append((row["id"], process(row, record_request)))
+                except Deferred as d:
+                    rows.append(row)
+                    requests.append((row["id"], d.body))
+                except Exception as e:
+                    bad.append((row["id"], str(e)))
+        store.complete(stage, ok)
+        store.fail(stage, bad)
+        counts["done"] += len(ok)
+        counts["failed"] += len(bad)
+        if not requests:
+            return counts
+        os.makedirs(runner.work_dir, exist_ok=True)
+        with open(rows_path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        print(f"{stage}：{len(ok)} 行本地完成，{len(requests)} 行编入批任务")
+        manifest = runner.submit(requests)
+    else:
+        print(f"{stage}：继续上次提交的批任务（{manifest['requests']} 个请求）")
+
+    with open(rows_path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    # manifest 已保存（或是续跑），批任务中的行改用长租约；续跑时重新计时，覆盖上次在延长前中断的情况
+    store.hold(stage, [row["id"] for row in rows], BATCH_LEASE_SECONDS)
+    runner.wait(manifest)
+    results = runner.results(manifest)
+    ok, bad = [], []
+    for row in rows:
+        body, error = results.get(str(row["id"]), (None, "批任务输出中没有该行"))
+        try:
+            if error is not None:
+                raise RuntimeError(error)
+            ok.append((row["id"], process(row, replay_response(body))))
+        except Exception as e:
+            bad.append((row["id"], str(e)))
+    store.complete(stage, ok)
+    store.fail(stage, bad)
+    runner.archive()
+    counts["done"] += len(ok)
+    counts["failed"] += len(bad)
+    counts["requests"] = len(rows)
+    return counts
@@ -0,0 +1,222 @@
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesParser
+from email.policy import HTTP
+
+
+# 本地批任务服务：实现 OpenAI 批任务接口中 batch_client.py 用到的部分
+#   POST /v1/files                 上传 JSONL（multipart，purpose=batch）
+#   GET  /v1/files/{id}/content    下载输入 / 输出 / 错误文件
+#   POST /v1/batches               创建批任务
+#   GET  /v1/batches/{id}          查询状态
+#   POST /v1/batches/{id}/cancel   取消
+#
+# 两种执行方式：
+#   --upstream URL  把每行请求转发到 OpenAI 兼容的同步接口（如 DeepSeek），使没有批任务接口的服务也能走批任务流程；
+#   缺省            不调用模型，回复 --reply 给定的内容（缺省回显用户消息末尾），用于测试提交、轮询与合并。
+# 数据只保存在内存中，服务重启后已提交的批任务会丢失。
+#
+# 例：python batch_server.py --port 8765 --reply '{"text": "示例", "action": "（挥手）"}' --fail-rate 0.05
+
+PORT        = 8765
+CONCURRENCY = 8      # --upstream 模式下同时转发的请求数
+ECHO_CHARS  = 50
+
+_lock = threading.Lock()
+_files = {}          # id -> {"meta": 文件对象, "data": bytes}
+_batches = {}        # id -> 批任务对象
+_counter = 0
+
+
+def _new_id(prefix: str) -> str:
+    global _counter
+    with _lock:
+        _counter += 1
+        return f"{prefix}_{int(time.time())}_{_counter}"
+
+
+def _add_file(data: bytes, filename: str, purpose: str) -> dict:
+    meta = {"id": _new_id("file"), "object": "file", "bytes": len(data), "created_at": int(time.time()),
+            "filename": filename, "purpose": purpose, "status": "processed"}
+    with _lock:
+        _files[meta["id"]] = {"meta": meta, "data": data}
+    return meta
+
+
+class Responder:
+    def __init__(self, upstream=None, api_key="", reply=None, fail_rate=0.0):
+        self.reply = reply
+        self.fail_rate = fail_rate
+        self.client = None
+        if upstream:
+            from openai import OpenAI
+            self.client = OpenAI(api_key=api_key, base_url=upstream)
+
+    def __call__(self, body: dict) -> dict:
+        if random.random() < self.fail_rate:
+            raise RuntimeError("模拟的请求失败")
+        if self.client is not None:
+            return self.client.chat.completions.create(**body).model_dump()
+        content = self.reply
+        if content is None:
+            content = "回声：" + str(body["messages"][-1]["content"])[-ECHO_CHARS:]
+        return {
+            "id": _new_id("chatcmpl"), "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "stand-in"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(content), "total_tokens": len(content)},
+        }
+
+
+def _execute(batch: dict, responder: Responder, concurrency: int, delay: float):
+    """在后台线程中执行一个批任务，结果写成输出 / 错误文件。"""
+    batch.update(status="in_progress", in_progress_at=int(time.time()))
+    lines = [json.loads(l) for l in _files[batch["input_file_id"]]["data"].decode("utf-8").splitlines() if l.strip()]
+    batch["request_counts"]["total"] = len(lines)
+
+    def run(line):
+        if batch["status"] == "cancelling":
+            return line, None, {"code": "batch_cancelled", "message": "批任务已取消"}
+        try:
+            return line, responder(line["body"]), None
+        except Exception as e:
+            return line, None, {"code": "request_failed", "message": str(e)}
+
+    outputs, errors = [], []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for line, body, error in executor.map(run, lines):
+            entry = {"id": _new_id("batch_req"), "custom_id": line["custom_id"]}
+            if error is None:
+                outputs.append(dict(entry, response={"status_code": 200, "request_id": entry["id"], "body": body},
+                                    error=None))
+                batch["request_counts"]["completed"] += 1
+            else:
+                errors.append(dict(entry, response=None, error=error))
+                batch["request_counts"]["failed"] += 1
+    time.sleep(delay)
+
+    def dump(entries, kind):
+        data = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries).encode("utf-8")
+        return _add_file(data, f"{batch['id']}_{kind}.jsonl", "batch_output")["id"]
+
+    if outputs:
+        batch["output_file_id"] = dump(outputs, "output")
+    if errors:
+        batch["error_file_id"] = dump(errors, "error")
+    now = int(time.time())
+    if batch["status"] == "cancelling":
+        batch.update(status="cancelled", cancelled_at=now)
+    else:
+        batch.update(status="completed", completed_at=now)
+
+
+class Handler(BaseHTTPRequestHandler):
+    responder = None
+    concurrency = CONCURRENCY
+    delay = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, payload=None, raw: bytes = None):
+        data = raw if raw is not None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream" if raw is not None else "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_found(self):
+        self._send(404, {"error": {"message": f"未找到 {self.path}", "type": "invalid_request_error"}})
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _path(self) -> str:
+        return re.sub(r"^/v1", "", self.path.split("?")[0]).rstrip("/")
+
+    def do_GET(self):
+        path = self._path()
+        m = re.fullmatch(r"/files/([\w-]+)/content", path)
+        if m and m.group(1) in _files:
+            return self._send(200, raw=_files[m.group(1)]["data"])
+        m = re.fullmatch(r"/files/([\w-]+)", path)
+        if m and m.group(1) in _files:
+            return self._send(200, _files[m.group(1)]["meta"])
+        m = re.fullmatch(r"/batches/([\w-]+)", path)
+        if m and m.group(1) in _batches:
+            return self._send(200, _batches[m.group(1)])
+        self._not_found()
+
+    def do_POST(self):
+        path = self._path()
+        if path == "/files":
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + self._body())
+            fields, data, filename = {}, b"", "input.jsonl"
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                if name == "file":
+                    data, filename = part.get_payload(decode=True), part.get_filename() or filename
+                else:
+                    fields[name] = part.get_payload(decode=True).decode("utf-8")
+            return self._send(200, _add_file(data, filename, fields.get("purpose", "batch")))
+
+        if path == "/batches":
+            params = json.loads(self._body() or b"{}")
+            if params.get("input_file_id") not in _files:
+                return self._send(400, {"error": {"message": "input_file_id 不存在", "type": "invalid_request_error"}})
+            batch = {
+                "id": _new_id("batch"), "object": "batch", "endpoint": params.get("endpoint"),
+                "input_file_id": params["input_file_id"], "completion_window": params.get("completion_window", "24h"),
+                "status": "validating", "output_file_id": None, "error_file_id": None,
+                "created_at": int(time.time()), "metadata": params.get("metadata"),
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            }
+            _batches[batch["id"]] = batch
+            threading.Thread(target=_execute, args=(batch, self.responder, self.concurrency, self.delay),
+                             daemon=True).start()
+            return self._send(200, batch)
+
+        m = re.fullmatch(r"/batches/([\w-]+)/cancel", path)
+        if m and m.group(1) in _batches:
+            batch = _batches[m.group(1)]
+            if batch["status"] in ("validating", "in_progress"):
+                batch["status"] = "cancelling"
+            return self._send(200, batch)
+        self._not_found()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容批任务服务（转发或测试用）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--upstream", default=None, help="转发到的 OpenAI 兼容同步接口，如 https://api.deepseek.com/v1")
+    parser.add_argument("--api-key", default="", help="上游接口的 API Key")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="每个批任务同时转发的请求数")
+    parser.add_argument("--reply", default=None, help="不转发时的固定回复内容，缺省回显用户消息末尾")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="模拟单个请求失败的比例")
+    parser.add_argument("--delay", type=float, default=0.0, help="每个批任务完成前额外等待的秒数，用于测试轮询")
+    args = parser.parse_args(argv)
+
+    Handler.responder = Responder(args.upstream, args.api_key, args.reply, args.fail_rate)
+    Handler.concurrency = args.concurrency
+    Handler.delay = args.delay
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"✅ 批任务服务已启动：http://{args.host}:{args.port}/v1"
+          f"（{'转发到 ' + args.upstream if args.upstream else '本地回复'}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import os
+import csv
+import math
+import random
+import shutil
+import tempfile
+
+from stream_io import open_stream, compression_of
+
+COMPRESSED_RATIO = 4   # 估算分桶数时压缩输入按该倍数折算为原始大小
+
+
+class BufferedCsvWriter:
+    """
+    只打开一次文件的 CSV 追加写入器，每累计 flush_every 行才落盘一次。
+    文件不存在（或为空）时先写表头；配合 with 使用，退出时保证剩余行写出。
+    path 以 .zst / .gz 结尾时流式压缩，续写时追加新的压缩帧。
+    """
+
+    def __init__(self, path: str, fieldnames: list, encoding: str = "utf-8-sig", flush_every: int = 50):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open_stream(path, "a", encoding=encoding, newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=fieldnames, extrasaction="ignore")
+        self._flush_every = flush_every
+        self._unflushed = 0
+        self.rows_written = 0
+        if is_new:
+            self._writer.writeheader()
+
+    def writerow(self, row: dict):
+        self._writer.writerow(row)
+        self.rows_written += 1
+        self._unflushed += 1
+        if self._unflushed >= self._flush_every:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        self._unflushed = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def shuffle_csv(path: str, out_path: str = None, max_bucket_bytes: int = 64 * 1024 * 1024,
+                seed: int = None, encoding: str = "utf-8-sig", max_buckets: int = 256) -> int:
+    """
+    外部随机打乱 CSV 的数据行（表头保持在首行），内存占用只取决于单个分桶大小。
+    输入 / 输出可为 .zst / .gz，输出按 out_path 的扩展名压缩。
+
+    第一遍把每行随机分配到若干临时分桶文件；第二遍逐个分桶读入内存打乱后顺序写出。
+    各行独立均匀地落入分桶，再对每个分桶做均匀打乱，拼接结果即为整体的均匀随机排列。
+
+    Args:
+        path: 输入 CSV。
+        out_path: 输出路径，缺省时原地替换。
+        max_bucket_bytes: 单个分桶的目标大小，决定第二遍的内存上限。
+        seed: 随机种子，便于复现。
+        encoding: 输入/输出编码。
+        max_buckets: 同时打开的分桶文件数上限。
+
+    Returns:
+        打乱的数据行数。
+    """
+    out_path = out_path or path
+    rng = random.Random(seed)
+    size = os.path.getsize(path) * (COMPRESSED_RATIO if compression_of(path) else 1)
+    n_buckets = min(max_buckets, max(1, math.ceil(size / max_bucket_bytes)))
+    tmp_dir = tempfile.mkdtemp(prefix=".shuffle_", dir=os.path.dirname(os.path.abspath(out_path)))
+
+    try:
+        # 1. 随机分桶
+        bucket_paths = [os.path.join(tmp_dir, f"bucket_{i:04d}.csv") for i in range(n_buckets)]
+        bucket_files = [open(p, "w", encoding="utf-8", newline="") for p in bucket_paths]
+        try:
+            bucket_writers = [csv.writer(f) for f in bucket_files]
+            with open_stream(path, "r", encoding=encoding, newline="") as f:
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if header is None:
+                    return 0
+                total = 0
+                for row in reader:
+                    bucket_writers[rng.randrange(n_buckets)].writerow(row)
+                    total += 1
+        finally:
+            for f in bucket_files:
+                f.close()
+
+        # 2. 逐桶打乱并拼接
+        tmp_out = os.path.join(tmp_dir, "shuffled.csv" + compression_of(out_path))
+        with open_stream(tmp_out, "w", encoding=encoding, newline="") as out:
+            writer = csv.writer(out)
+            writer.writerow(header)
+            for p in bucket_paths:
+                with open(p, "r", encoding="utf-8", newline="") as f:
+                    rows = list(csv.reader(f))
+                rng.shuffle(rows)
+                writer.writerows(rows)
+        os.replace(tmp_out, out_path)
+        return total
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
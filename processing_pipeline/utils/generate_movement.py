@@ -1,29 +1,46 @@
 import os
 import csv
 import json
+import math
 import random
-from multiprocessing import Process, Queue, current_process
-from openai import OpenAI
+import asyncio
+import argparse
+from collections import Counter
+
+from llm_engine import generate_until
+from csv_stream import BufferedCsvWriter, shuffle_csv
+from stream_io import open_stream, resolve
+from near_dup import NearDupIndex, DiversityGate
+from llm_client import get_async_client, format_reuse_stats
+from batch_client import BatchRunner, get_batch_client, BATCH_BASE_URL, POLL_SECONDS
 
 # ———— 配置 ————
 API_KEY = '' 
 BASE_URL           = "https://api.deepseek.com/v1"
 OUTPUT_CSV         = "处理后数据/动作数据集.csv"
-NUM_WORKERS        = 10
+CONCURRENCY        = 10   # 同时在途的请求数
 DOMAINS            = ["科幻", "言情", "历史", "生活", "都市", "侦探", "武打", "仙侠", "日常", "玄幻", "轻小说"]
 random.shuffle(DOMAINS) # 打乱列表
-SAMPLES_PER_DOMAIN = 50  # 每个领域生成多少条示例
+SAMPLES_PER_DOMAIN = 50  # 每个领域需要的有效示例数
+MAX_ATTEMPTS_RATE  = 3   # 每个领域最多请求 目标数×3 次，防止持续失败时无限补发
 TEXT_LENGTHS       = ['10', '20', '50']  # 分别模拟短/中/长句
+MAX_TOKENS         = 160  # 50 字长句加 JSON 包装在 100 token 内容易被截断
+FIELDNAMES         = ["domain", "text", "action"]
+DEDUP_THRESHOLD    = 0.6  # 字符 2-gram 估计 Jaccard 不低于该值视为近重复
+MIN_UNIQUE_YIELD   = 0.2  # 最近 20 条有效返回中唯一样本低于 20% 时认为该领域已饱和
+BATCH_DIR          = "处理后数据/batches/movement"  # --batch 模式的批任务工作目录
+BATCH_OVERSAMPLE   = 1.5  # 批任务模式每轮按缺口的 1.5 倍编译请求，抵消无效与近重复的返回
+BATCH_ROUNDS       = 5    # 批任务模式最多提交的轮数（每轮只补上一轮之后的缺口）
 
 
 def init_client():
-    return OpenAI(api_key=API_KEY, base_url=BASE_URL)
+    # 带连接池与显式超时的客户端，本次运行的所有请求共用
+    return get_async_client(API_KEY, BASE_URL)
 
-def generate_text_action(domain: str, client) -> dict:
+def build_request(domain: str) -> dict:
     """
-    调用 DeepSeek，为指定领域生成一条 文本-动作 对应示例。
-    使用 JSON Output 确保返回合法 JSON，对空值返回 None，并将 JSON 字符串解析为 dict。
-    文本长度在 TEXT_LENGTHS 中随机选择。
+    为指定领域构造一条 文本-动作 示例的请求参数（同步调用与批任务共用）。
+    使用 JSON Output 确保返回合法 JSON，文本长度在 TEXT_LENGTHS 中随机选择。
     """
     length = random.choice(TEXT_LENGTHS)
     prompt = (
@@ -46,7 +63,7 @@ def generate_text_action(domain: str, client) -> dict:
         "}\n"
         "请严格按照上面格式返回，并且不要输出其他任何内容。"
     )
-    resp = client.chat.completions.create(
+    return dict(
         model="deepseek-chat",
         messages=[
             {"role": "system", "content": "你是严格的 JSON 输出助手。"},
@@ -55,9 +72,11 @@ def generate_text_action(domain: str, client) -> dict:
         response_format={'type': 'json_object'},  # 强制 JSON 输出
         temperature=1.5,                            # 增加随机性
         top_p=0.97,
-        max_tokens=100
+        max_tokens=MAX_TOKENS
     )
-    content = resp.choices[0].message.content
+
+def parse_pair(content):
+    """把模型返回的 JSON 字符串解析为 dict，空值或无法解析时返回 None。"""
     if not content:
         return None
     if isinstance(content, str):
@@ -69,79 +88,155 @@ def generate_text_action(domain: str, client) -> dict:
         return None
     return content
 
-def worker(input_q: Queue, output_q: Queue):
+async def generate_text_action(domain: str, client) -> dict:
+    """调用 DeepSeek，为指定领域生成一条 文本-动作 对应示例，无效返回 None。"""
+    resp = await client.chat.completions.create(**build_request(domain))
+    return parse_pair(resp.choices[0].message.content)
+
+def is_valid_pair(domain: str, pair: dict) -> bool:
+    """text 与 action 都必须是非空字符串，否则视为无效结果并自动补发。"""
+    return all(isinstance(pair.get(k), str) and pair[k].strip() for k in ("text", "action"))
+
+def pair_text(pair: dict) -> str:
+    """去重时比较的内容：文本与动作一起参与 n-gram。"""
+    return f"{pair['text']}|{pair['action']}"
+
+def load_existing(output_csv: str) -> list:
+    """读取输出文件中已有的样本，续跑时只补缺口，并用它们预热去重索引。"""
+    rows = []
+    if os.path.exists(output_csv):
+        with open_stream(output_csv, "r", encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+    return rows
+
+async def generate_dataset(output_csv: str, samples_per_domain: int, concurrency: int,
+                           dedup_threshold: float = DEDUP_THRESHOLD) -> tuple:
+    # 1. 计算各领域还需要的有效样本数
+    existing_rows = load_existing(output_csv)
+    existing = Counter(row["domain"] for row in existing_rows)
+    targets = {d: max(0, samples_per_domain - existing[d]) for d in DOMAINS}
+    max_attempts = {d: n * MAX_ATTEMPTS_RATE for d, n in targets.items()}
+    print(f"目标样本数（已扣除已有数据）：{targets}")
+
+    # 近重复的返回会被拒绝并由引擎补发；某领域持续只产出重复时停止为它请求
+    gate = DiversityGate(NearDupIndex(threshold=dedup_threshold), min_yield=MIN_UNIQUE_YIELD, text_fn=pair_text)
+    gate.seed(existing_rows)
+
+    def validate(domain, pair):
+        return is_valid_pair(domain, pair) and gate.check(domain, pair)
+
     client = init_client()
-    while True:
-        task = input_q.get()
-        if task is None:
-            break
-        domain, idx = task
-        pair = generate_text_action(domain, client)
-        if pair is None:
-            print(f"[{current_process().name}] 警告：{domain} 示例 #{idx} 返回空，跳过")
-            continue
-        pair["domain"] = domain
-        output_q.put(pair)
-        print(f"[{current_process().name}] 完成 {domain} 示例 #{idx}")
-
-def main():
-    # 1. 准备任务队列
-    tasks = [(d, i) for d in DOMAINS for i in range(1, SAMPLES_PER_DOMAIN + 1)]
-    input_q, output_q = Queue(), Queue()
-
-    # 2. 启动 Worker 进程
-    workers = []
-    for i in range(NUM_WORKERS):
-        p = Process(target=worker, args=(input_q, output_q), name=f"Worker-{i+1}")
-        p.start()
-        workers.append(p)
-
-    # 3. 写入 CSV 表头
-    os.makedirs(os.path.dirname(OUTPUT_CSV) or ".", exist_ok=True)
-    if not os.path.exists(OUTPUT_CSV):
-        os.makedirs(os.path.dirname(OUTPUT_CSV) or ".", exist_ok=True)
-        with open(OUTPUT_CSV, "w", encoding="utf-8-sig", newline="") as f:
-            writer = csv.DictWriter(f, fieldnames=["domain", "text", "action"])
-            writer.writeheader()
-    # 4. 分发任务
-    for t in tasks:
-        input_q.put(t)
-    for _ in workers:
-        input_q.put(None)
-
-    # 5. 实时收集并写入
-    # 5. 实时收集并附加写入
-    for _ in tasks:
-        result = output_q.get()
-        if result:
-            with open(OUTPUT_CSV, "a", encoding="utf-8-sig", newline="") as f:
-                writer = csv.DictWriter(f, fieldnames=["domain", "text", "action"])
-                writer.writerow({
-                    "domain": result["domain"],
-                    "text":   result["text"],
-                    "action": result["action"]
-                })
-            print(f"写入: domain={result['domain']} text={result['text']} action={result['action']}")
-
-    # 6. 等待所有 Worker 结束
-    for p in workers:
-        p.join()
-
-    print(f"✅ 文本-动作数据集已生成并保存到 {OUTPUT_CSV}")
 
-    print(f"✅ 文本-动作数据集已生成，开始打乱顺序...")
+    async def produce(domain):
+        return await generate_text_action(domain, client)
+
+    # 2. 结果流式写入，避免每条结果都重新打开文件
+    with BufferedCsvWriter(output_csv, FIELDNAMES) as writer:
+        def on_result(domain, pair):
+            writer.writerow({"domain": domain, "text": pair["text"], "action": pair["action"]})
+            print(f"写入: domain={domain} text={pair['text']} action={pair['action']}")
+
+        stats = await generate_until(targets, produce, on_result, concurrency=concurrency,
+                                     max_attempts=max_attempts, validate=validate,
+                                     should_continue=gate.should_continue)
 
-    # 7. 打乱 CSV 文件内容
-    with open(OUTPUT_CSV, "r", encoding="utf-8-sig", newline="") as f:
-        reader = list(csv.DictReader(f))
-        random.shuffle(reader)
+    await client.close()
+    return stats, gate.report()
+
+def generate_dataset_batch(output_csv: str, samples_per_domain: int, dedup_threshold: float = DEDUP_THRESHOLD,
+                           batch_base_url: str = BATCH_BASE_URL, poll_seconds: float = POLL_SECONDS,
+                           work_dir: str = BATCH_DIR) -> tuple:
+    """
+    批任务模式：每轮按各领域缺口的 BATCH_OVERSAMPLE 倍编译请求，整批提交并等待完成，
+    再按 custom_id 顺序做与并发模式相同的校验与去重，写满目标数为止；仍有缺口时提交下一轮。
+    custom_id 为 <领域>-<轮次>-<序号>，中断后重跑会先合并上次提交的批任务。
+    """
+    existing_rows = load_existing(output_csv)
+    existing = Counter(row["domain"] for row in existing_rows)
+    targets = {d: max(0, samples_per_domain - existing[d]) for d in DOMAINS}
+    stats = {d: {"target": n, "accepted": 0, "attempts": 0, "failed": 0} for d, n in targets.items()}
+    max_attempts = {d: n * MAX_ATTEMPTS_RATE for d, n in targets.items()}
+    print(f"目标样本数（已扣除已有数据）：{targets}")
+
+    gate = DiversityGate(NearDupIndex(threshold=dedup_threshold), min_yield=MIN_UNIQUE_YIELD, text_fn=pair_text)
+    gate.seed(existing_rows)
+    runner = BatchRunner(get_batch_client(API_KEY, batch_base_url), work_dir, poll_seconds,
+                         metadata={"stage": "movement"})
+
+    with BufferedCsvWriter(output_csv, FIELDNAMES) as writer:
+        for round_idx in range(BATCH_ROUNDS):
+            manifest = runner.load()
+            if manifest is None:
+                requests = []
+                for d, s in stats.items():
+                    gap = s["target"] - s["accepted"]
+                    if gap <= 0 or not gate.should_continue(d):
+                        continue
+                    n = min(math.ceil(gap * BATCH_OVERSAMPLE), max_attempts[d] - s["attempts"])
+                    requests += [(f"{d}-{round_idx}-{i}", build_request(d)) for i in range(n)]
+                if not requests:
+                    break
+                print(f"第 {round_idx + 1} 轮：编译 {len(requests)} 个请求")
+                manifest = runner.submit(requests)
+            else:
+                print(f"继续上次提交的批任务（{manifest['requests']} 个请求）")
+
+            runner.wait(manifest)
+            for custom_id, (body, error) in sorted(runner.results(manifest).items()):
+                domain = custom_id.rsplit("-", 2)[0]
+                if domain not in stats:
+                    continue
+                stats[domain]["attempts"] += 1
+                pair = parse_pair(body["choices"][0]["message"]["content"]) if body else None
+                if pair is None or not is_valid_pair(domain, pair) or not gate.check(domain, pair):
+                    stats[domain]["failed"] += 1
+                    continue
+                if stats[domain]["accepted"] >= stats[domain]["target"]:
+                    continue
+                stats[domain]["accepted"] += 1
+                writer.writerow({"domain": domain, "text": pair["text"], "action": pair["action"]})
+            runner.archive()
+
+    return stats, gate.report()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="并发生成 文本-动作 合成数据集")
+    parser.add_argument("--output", default=OUTPUT_CSV,
+                        help="输出 CSV 路径（存在时续写），以 .zst / .gz 结尾时压缩写出")
+    parser.add_argument("--samples-per-domain", type=int, default=SAMPLES_PER_DOMAIN, help="每个领域的有效样本目标数")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="同时在途的请求数")
+    parser.add_argument("--seed", type=int, default=None, help="最终打乱使用的随机种子")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD, help="近重复判定的相似度阈值")
+    parser.add_argument("--batch", action="store_true", help="改为离线批任务：按缺口编译请求，整批提交后合并")
+    parser.add_argument("--batch-base-url", default=BATCH_BASE_URL, help="OpenAI 兼容的批任务接口地址")
+    parser.add_argument("--poll-seconds", type=float, default=POLL_SECONDS, help="批任务轮询间隔（秒）")
+    args = parser.parse_args(argv)
+    # 输出只有压缩版本（如 动作数据集.csv.zst）时续写该文件
+    args.output = resolve(args.output)
+
+    if args.batch:
+        stats, diversity = generate_dataset_batch(args.output, args.samples_per_domain, args.dedup_threshold,
+                                                  args.batch_base_url, args.poll_seconds)
+    else:
+        stats, diversity = asyncio.run(generate_dataset(args.output, args.samples_per_domain, args.concurrency,
+                                                        args.dedup_threshold))
+    # 各领域唯一样本产出：unique_yield 越低说明该领域越饱和，后续应减少其目标数
+    for domain, s in stats.items():
+        d = diversity.get(domain, {"duplicate": 0, "unique_yield": 0.0, "saturated": False})
+        per_sample = s["attempts"] / s["accepted"] if s["accepted"] else float("inf")
+        print(f"  {domain}: 有效 {s['accepted']}/{s['target']}，请求 {s['attempts']} 次，"
+              f"近重复 {d['duplicate']} 条，唯一产出率 {d['unique_yield']:.0%}，"
+              f"每条唯一样本约需 {per_sample:.1f} 次请求{'（已饱和）' if d['saturated'] else ''}")
+    if not args.batch:
+        print(format_reuse_stats())
+    print(f"✅ 文本-动作数据集已生成并保存到 {args.output}")
+
+    print(f"✅ 文本-动作数据集已生成，开始打乱顺序...")
 
-    with open(OUTPUT_CSV, "w", encoding="utf-8-sig", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=["domain", "text", "action"])
-        writer.writeheader()
-        writer.writerows(reader)
+    # 3. 外部打乱：按分桶逐块处理，数据集大小不受内存限制
+    total = shuffle_csv(args.output, seed=args.seed)
 
-    print(f"✅ 打乱完成，最终数据已保存到 {OUTPUT_CSV}")
+    print(f"✅ 打乱完成，共 {total} 条，最终数据已保存到 {args.output}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,290 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+# 多机共享的任务队列：几台机器挂载同一个网络文件系统，各自运行同样的命令，
+# 从同一个 SQLite 库中领取任务（小说文件夹、抽取滑窗），不需要单独的协调进程。
+#
+# jobs 表每个任务一行，以 (queue, key) 标识：pending / running / done / failed，
+# 以及 payload（JSON）、领取者、租约到期时间、尝试次数与进度。
+# - 领取在 BEGIN IMMEDIATE 事务内完成，多台机器、多个进程不会领到同一个任务；
+# - 领取者按 HEARTBEAT_SECONDS 续租，进程或机器宕机后租约过期，任务被其他 worker 重新领取；
+# - 只有当前持有租约的 worker 能把任务记为 done / failed，租约已被接管的旧 worker 写入无效。
+#
+# 网络文件系统上的 SQLite 不能用 WAL（共享内存索引只在单机上有效），这里固定使用回滚日志，
+# 锁依赖文件系统的 fcntl 锁（NFSv4 / 开启 lockd 的 NFSv3）。
+#
+# 任务结果不写入队列：每个 worker 追加写自己的分片文件 <parts_dir>/<worker>.jsonl（append_part），
+# 合并时按队列中记录的完成者挑选每个任务的那一条（merge_parts），与完成的先后、分片的读取顺序无关。
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+LEASE_SECONDS     = 300   # 租约时长；持有者每 HEARTBEAT_SECONDS 续租一次
+HEARTBEAT_SECONDS = 60
+POLL_SECONDS      = 10    # 暂时没有可领取的任务、但仍有任务在运行时的等待间隔
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    queue       TEXT    NOT NULL,
+    key         TEXT    NOT NULL,
+    status      TEXT    NOT NULL,
+    payload     TEXT,
+    priority    REAL    NOT NULL DEFAULT 0,
+    worker      TEXT,
+    lease_until REAL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    progress    TEXT,
+    error       TEXT,
+    created_at  REAL    NOT NULL,
+    updated_at  REAL    NOT NULL,
+    PRIMARY KEY (queue, key)
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(queue, status, priority DESC, created_at);
+"""
+
+
+def heartbeat_interval(lease_seconds: float) -> float:
+    """续租间隔：不超过租约的 1/5，一两次续租失败也不会丢掉租约。"""
+    return min(HEARTBEAT_SECONDS, lease_seconds / 5)
+
+
+def worker_name() -> str:
+    """缺省的 worker 名：主机名-进程号，多台机器、同一台机器上的多个进程都不会重名。"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class JobQueue:
+    """见模块说明。每个线程使用各自的连接，实例本身可在线程间共享。"""
+
+    def __init__(self, path: str, timeout: float = 60.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._conn.executescript(_SCHEMA)
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # ———— 登记与领取 ————
+
+    def add(self, queue: str, items, priority=None) -> int:
+        """
+        登记任务：items 为 [(key, payload), …]，payload 需可 JSON 序列化。
+        已存在的任务保持原状态（多个 worker 同时登记同一批任务只会生效一次）；返回新增数。
+        priority(key) 越大越先被领取，相同时按登记顺序。
+        """
+        now = time.time()
+        rows = [(queue, str(key), PENDING, json.dumps(payload, ensure_ascii=False),
+                 priority(key) if priority else 0.0, now + i * 1e-6, now)
+                for i, (key, payload) in enumerate(items)]
+        with self._transaction() as conn:
+            return conn.executemany(
+                "INSERT OR IGNORE INTO jobs (queue, key, status, payload, priority, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows,
+            ).rowcount
+
+    def claim(self, queue: str, worker: str, lease_seconds: float = LEASE_SECONDS, limit: int = 1) -> list:
+        """
+        原子地领取最多 limit 个 pending 任务或租约已过期的 running 任务，置为 running 并累加尝试次数。
+        返回 [{"key", "payload", "attempts", "progress"}, …]。
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            keys = [r[0] for r in conn.execute(
+                "SELECT key FROM jobs WHERE queue = ? AND (status = ? OR (status = ? AND lease_until < ?)) "
+                "ORDER BY status = ? DESC, priority DESC, created_at LIMIT ?",
+                (queue, PENDING, RUNNING, now, PENDING, limit),
+            )]
+            if not keys:
+                return []
+            conn.executemany(
+                "UPDATE jobs SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE queue = ? AND key = ?",
+                ((RUNNING, worker, now + lease_seconds, now, queue, k) for k in keys),
+            )
+            rows = conn.execute(
+                f"SELECT key, payload, attempts, progress FROM jobs WHERE queue = ? "
+                f"AND key IN ({','.join('?' * len(keys))})", [queue, *keys],
+            ).fetchall()
+        order = {k: i for i, k in enumerate(keys)}
+        return sorted(({"key": r["key"], "payload": json.loads(r["payload"]), "attempts": r["attempts"],
+                        "progress": json.loads(r["progress"]) if r["progress"] else None} for r in rows),
+                      key=lambda j: order[j["key"]])
+
+    def heartbeat(self, worker: str, lease_seconds: float = LEASE_SECONDS) -> int:
+        """为 worker 持有的全部 running 任务续租，返回续租的任务数。"""
+        now = time.time()
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE worker = ? AND status = ?",
+                (now + lease_seconds, now, worker, RUNNING),
+            ).rowcount
+
+    def _finish(self, queue: str, key: str, worker: str, status: str, error: str = None) -> bool:
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ? "
+                "WHERE queue = ? AND key = ? AND status = ? AND worker = ?",
+                (status, error, time.time(), queue, str(key), RUNNING, worker),
+            ).rowcount == 1
+
+    def complete(self, queue: str, key: str, worker: str) -> bool:
+        """记为 done；返回 False 表示租约已过期并被其他 worker 接管，本次结果不应被采用。"""
+        return self._finish(queue, key, worker, DONE)
+
+    def fail(self, queue: str, key: str, worker: str, error: str) -> bool:
+        return self._finish(queue, key, worker, FAILED, error)
+
+    def set_progress(self, queue: str, key: str, worker: str, progress) -> bool:
+        """记录任务进度（可 JSON 序列化），任务被重新领取时随任务返回，用于跳过已完成的步骤。"""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE jobs SET progress = ?, updated_at = ? WHERE queue = ? AND key = ? AND worker = ?",
+                (json.dumps(progress, ensure_ascii=False), time.time(), queue, str(key), worker),
+            ).rowcount == 1
+
+    def retry_failed(self, queue: str) -> int:
+        """把失败任务重新置为 pending（保留进度），返回重置数。"""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE queue = ? AND status = ?",
+                (PENDING, time.time(), queue, FAILED),
+            ).rowcount
+
+    # ———— 查询 ————
+
+    def counts(self, queue: str) -> dict:
+        return {r[0]: r[1] for r in self._conn.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE queue = ? GROUP BY status", (queue,)
+        )}
+
+    def drained(self, queue: str) -> bool:
+        """没有 pending 与 running 的任务（全部 done / failed）。"""
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE queue = ? AND status IN (?, ?)", (queue, PENDING, RUNNING)
+        ).fetchone()[0] == 0
+
+    def jobs(self, queue: str, status: str = None) -> list:
+        """[{"key", "status", "worker", "attempts", "progress", "error"}, …]，按登记顺序。"""
+        sql = "SELECT key, status, worker, attempts, progress, error FROM jobs WHERE queue = ?"
+        params = [queue]
+        if status is not None:
+            sql += " AND status = ?"
+            params.append(status)
+        rows = self._conn.execute(sql + " ORDER BY created_at", params).fetchall()
+        return [dict(r, progress=json.loads(r["progress"]) if r["progress"] else None) for r in rows]
+
+    def open_queues(self, prefix: str = "") -> list:
+        """名称以 prefix 开头、还有可领取任务（pending 或租约已过期）的队列，按名称排序。"""
+        return [r[0] for r in self._conn.execute(
+            "SELECT DISTINCT queue FROM jobs WHERE queue LIKE ? ESCAPE '\\' "
+            "AND (status = ? OR (status = ? AND lease_until < ?)) ORDER BY queue",
+            (prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%",
+             PENDING, RUNNING, time.time()),
+        )]
+
+
+class Cluster:
+    """多机模式下本 worker 的上下文：共享队列、worker 名、租约与续租间隔。"""
+
+    def __init__(self, path: str, worker: str = None, lease_seconds: float = LEASE_SECONDS):
+        self.path = path
+        self.worker = worker or worker_name()
+        self.lease_seconds = lease_seconds
+        self.heartbeat = heartbeat_interval(lease_seconds)
+        self.queue = JobQueue(path)
+
+
+class Heartbeat:
+    """
+    后台线程每 interval 秒调用一次 renew()（如 lambda: queue.heartbeat(worker)），
+    用作 with 语句时进入即开始、退出即停止。续租失败只打印，不中断任务。
+    """
+
+    def __init__(self, renew, interval: float = HEARTBEAT_SECONDS):
+        self.renew = renew
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.renew()
+            except Exception as e:
+                print(f"⚠️ 续租失败：{e}")
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def append_part(parts_dir: str, worker: str, records):
+    """把结果追加到本 worker 的分片文件，写完即落盘（其他机器随后读取）。"""
+    os.makedirs(parts_dir, exist_ok=True)
+    with open(os.path.join(parts_dir, f"{worker}.jsonl"), "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def merge_parts(parts_dir: str, owners: dict) -> dict:
+    """
+    合并各 worker 的分片：owners 为 {key: 完成该任务的 worker}（取自 JobQueue.jobs 中 done 的任务），
+    只采用完成者写下的那条记录，被接管前的旧 worker 写下的重复记录被忽略。
+    分片中的记录须含 "key" 字段；返回 {key: 记录}，按 key 的登记顺序即 owners 的顺序排列。
+    """
+    found = {}
+    if os.path.isdir(parts_dir):
+        for name in sorted(os.listdir(parts_dir)):
+            if not name.endswith(".jsonl"):
+                continue
+            worker = name[:-len(".jsonl")]
+            with open(os.path.join(parts_dir, name), encoding="utf-8") as f:
+                for line in f:
+                    # 宕机时可能留下未写完的最后一行
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    key = str(record["key"])
+                    if owners.get(key) == worker:
+                        found[key] = record
+    return {key: found[key] for key in owners if key in found}
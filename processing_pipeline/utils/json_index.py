@@ -0,0 +1,286 @@
+import os
+import re
+import hashlib
+import sys
+import json
+import mmap
+import random
+import argparse
+
+
+# JSON 数组 / JSONL 数据集的旁路偏移索引。
+#
+# 为 <file> 建立 <file>.idx.json：每条记录的起止字节偏移，以及几个关键字段
+# （schema：sharegpt / alpaca / other，turns：对话轮数），读取时通过 mmap 直接切出单条记录解析，
+# 不必 json.load 整个文件。随机抽样与训练/验证划分只读索引，然后按需取记录。
+#
+# JSON 数组的扫描用一个正则在 mmap 上跳过整段字符串（C 层完成），Python 只处理结构字符，
+# 顶层数组的元素需为对象、数组或字符串（数据集文件均为对象数组）。
+# 源文件大小或修改时间变化时索引自动重建。
+# 设置 INDEX_DIR（或命令行 --index-dir）后索引集中写到该目录，不在只读的数据目录中生成文件；
+# 索引文件写不进去时只在内存中使用，下次打开重新扫描。
+# 压缩文件（.zst / .gz）无法按偏移随机读取，需先用 stream_io.py decompress 解压，或用 stream_io.iter_records 顺序读取。
+
+INDEX_SUFFIX = ".idx.json"
+INDEX_DIR = None        # 缺省写在数据文件旁边
+INDEX_VERSION = 1
+
+# 字符串（含转义）整体匹配，或单个结构字符
+_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}]', re.S)
+_OPEN, _CLOSE, _QUOTE = b"[{", b"]}", ord('"')
+
+
+def scan_array(buf) -> list:
+    """返回顶层 JSON 数组中每个元素的 (start, end) 字节偏移。"""
+    offsets = []
+    depth, start = 0, None
+    for m in _TOKEN.finditer(buf):
+        c = buf[m.start()]
+        if c == _QUOTE:
+            if depth == 1:
+                offsets.append((m.start(), m.end()))
+        elif c in _OPEN:
+            if depth == 1:
+                start = m.start()
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 1:
+                offsets.append((start, m.end()))
+            elif depth == 0:
+                break
+    return offsets
+
+
+def scan_lines(buf) -> list:
+    """返回 JSONL 中每个非空行（不含换行符）的 (start, end) 字节偏移。"""
+    offsets = []
+    pos, size = 0, len(buf)
+    while pos < size:
+        nl = buf.find(b"\n", pos)
+        end = size if nl == -1 else nl
+        line_end = end - 1 if end > pos and buf[end - 1] == 0x0D else end
+        if line_end > pos and buf[pos:line_end].strip():
+            offsets.append((pos, line_end))
+        pos = end + 1
+    return offsets
+
+
+def describe(record) -> dict:
+    """索引中保存的关键字段。"""
+    if isinstance(record, dict):
+        turns = record.get("conversations", record.get("conversation"))
+        if isinstance(turns, list):
+            return {"schema": "sharegpt", "turns": len(turns)}
+        if "instruction" in record and "output" in record:
+            return {"schema": "alpaca", "turns": 1 + len(record.get("history") or [])}
+    return {"schema": "other", "turns": 0}
+
+
+def index_path(path: str) -> str:
+    """path 的索引文件位置：缺省为 <file>.idx.json；设置 INDEX_DIR 时为 INDEX_DIR/<文件名>.<路径哈希>.idx.json。"""
+    if INDEX_DIR is None:
+        return path + INDEX_SUFFIX
+    digest = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(INDEX_DIR, f"{os.path.basename(path)}.{digest}{INDEX_SUFFIX}")
+
+
+def _is_jsonl(path: str, buf) -> bool:
+    if path.endswith(".jsonl"):
+        return True
+    head = buf[:64].lstrip(b"\xef\xbb\xbf \t\r\n")
+    return not head.startswith(b"[")
+
+
+class JsonIndex:
+    """单个文件的索引，见模块说明。索引在首次打开时建立并写入旁路文件。"""
+
+    def __init__(self, path: str, rebuild: bool = False):
+        from stream_io import compression_of
+
+        if compression_of(path):
+            raise ValueError(f"压缩文件不支持随机读取，请先解压：python stream_io.py decompress {path}")
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        stat = os.stat(path)
+        index = None if rebuild else self._load(stat)
+        if index is None:
+            index = self._build(stat)
+        self.format = index["format"]
+        self.offsets = index["offsets"]
+        self.fields = index["fields"]
+
+    def _load(self, stat):
+        try:
+            with open(index_path(self.path), encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (index.get("version"), index.get("size"), index.get("mtime")) != (INDEX_VERSION, stat.st_size, stat.st_mtime):
+            return None
+        return index
+
+    def _build(self, stat):
+        fmt = "jsonl" if _is_jsonl(self.path, self._mm) else "array"
+        offsets = scan_lines(self._mm) if fmt == "jsonl" else scan_array(self._mm)
+        fields = {"schema": [], "turns": []}
+        for start, end in offsets:
+            info = describe(json.loads(self._mm[start:end]))
+            fields["schema"].append(info["schema"])
+            fields["turns"].append(info["turns"])
+        index = {"version": INDEX_VERSION, "size": stat.st_size, "mtime": stat.st_mtime,
+                 "format": fmt, "offsets": offsets, "fields": fields}
+        target = index_path(self.path)
+        tmp = target + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(index, f, separators=(",", ":"))
+            os.replace(tmp, target)
+        except OSError as e:
+            print(f"⚠️ 索引无法写入 {target}（{e}），本次只在内存中使用；可用 --index-dir 指定可写目录")
+        # 与读取路径保持同样的类型（json 读回来的偏移是 list）
+        index["offsets"] = [list(o) for o in offsets]
+        return index
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def raw(self, i: int) -> bytes:
+        """第 i 条记录的原始字节。"""
+        start, end = self.offsets[i]
+        return self._mm[start:end]
+
+    def __getitem__(self, i: int):
+        return json.loads(self.raw(i))
+
+
+class CorpusIndex:
+    """把多个文件的索引拼成一个全局编号空间：全局第 i 条 → (文件, 文件内编号)。"""
+
+    def __init__(self, paths, rebuild: bool = False):
+        self.indexes = [JsonIndex(p, rebuild) for p in paths]
+        self._starts = []
+        total = 0
+        for index in self.indexes:
+            self._starts.append(total)
+            total += len(index)
+        self._total = total
+
+    def close(self):
+        for index in self.indexes:
+            index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._total
+
+    def locate(self, i: int):
+        if not 0 <= i < self._total:
+            raise IndexError(i)
+        lo, hi = 0, len(self._starts) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self._starts[mid] <= i:
+                lo = mid
+            else:
+                hi = mid - 1
+        return self.indexes[lo], i - self._starts[lo]
+
+    def raw(self, i: int) -> bytes:
+        index, j = self.locate(i)
+        return index.raw(j)
+
+    def __getitem__(self, i: int):
+        index, j = self.locate(i)
+        return index[j]
+
+    def field(self, name: str, i: int):
+        index, j = self.locate(i)
+        return index.fields[name][j]
+
+    def sample(self, k: int, seed: int = None, schema: str = None) -> list:
+        """无放回随机抽取 k 个全局编号（可限定 schema），只读索引。"""
+        rng = random.Random(seed)
+        if schema is None:
+            return rng.sample(range(self._total), min(k, self._total))
+        pool = [i for i in range(self._total) if self.field("schema", i) == schema]
+        return rng.sample(pool, min(k, len(pool)))
+
+    def split(self, val_ratio: float = 0.05, seed: int = 0) -> tuple:
+        """按固定种子把全局编号划分为 (train_ids, val_ids)，各自按编号排序以便顺序读取。"""
+        ids = list(range(self._total))
+        random.Random(seed).shuffle(ids)
+        n_val = int(round(self._total * val_ratio))
+        return sorted(ids[n_val:]), sorted(ids[:n_val])
+
+    def write_jsonl(self, ids, output_path: str) -> int:
+        """把指定记录原样（紧凑为单行）写成 JSONL。"""
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        count = 0
+        with open(output_path, "w", encoding="utf-8") as f:
+            for i in ids:
+                f.write(json.dumps(self[i], ensure_ascii=False) + "\n")
+                count += 1
+        return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="JSON 数组 / JSONL 数据集的偏移索引、随机抽样与划分")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="建立（或重建）索引并打印统计")
+    b.add_argument("paths", nargs="+")
+    b.add_argument("--rebuild", action="store_true")
+    s = sub.add_parser("sample", help="随机抽取 k 条记录输出到标准输出")
+    s.add_argument("paths", nargs="+")
+    s.add_argument("-k", type=int, default=3)
+    s.add_argument("--seed", type=int)
+    s.add_argument("--schema", choices=["sharegpt", "alpaca", "other"])
+    p = sub.add_parser("split", help="按比例划分训练 / 验证集并写成 JSONL")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--out-dir", required=True)
+    p.add_argument("--val-ratio", type=float, default=0.05)
+    p.add_argument("--seed", type=int, default=0)
+    for command in (b, s, p):
+        command.add_argument("--index-dir", help="索引文件集中存放的目录（缺省写在数据文件旁边）")
+    args = parser.parse_args(argv)
+
+    global INDEX_DIR
+    if args.index_dir:
+        INDEX_DIR = args.index_dir
+
+    with CorpusIndex(args.paths, rebuild=getattr(args, "rebuild", False)) as corpus:
+        if args.command == "build":
+            for index in corpus.indexes:
+                counts = {}
+                for schema in index.fields["schema"]:
+                    counts[schema] = counts.get(schema, 0) + 1
+                print(f"📇 {index.path}：{len(index)} 条（{index.format}），{counts}")
+        elif args.command == "sample":
+            for i in corpus.sample(args.k, args.seed, args.schema):
+                sys.stdout.write(json.dumps(corpus[i], ensure_ascii=False) + "\n")
+        else:
+            train, val = corpus.split(args.val_ratio, args.seed)
+            n_train = corpus.write_jsonl(train, os.path.join(args.out_dir, "train.jsonl"))
+            n_val = corpus.write_jsonl(val, os.path.join(args.out_dir, "val.jsonl"))
+            print(f"✅ 训练集 {n_train} 条，验证集 {n_val} 条，保存到 {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
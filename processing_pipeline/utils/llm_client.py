@@ -0,0 +1,147 @@
+import os
+import threading
+import importlib.util
+
+
+# 进程内共享的 OpenAI 兼容客户端。
+#
+# 每个进程只建立一个带连接池的 HTTP 传输层：限制连接数、保持 keep-alive、显式设置连接 / 读取超时，
+# 装有 h2 时启用 HTTP/2（一条连接上多路复用），同一进程内各阶段、各线程的调用都复用它，
+# 省去每次请求的 TCP 与 TLS 握手。fork 出的子进程按进程号重新建立，不与父进程共用套接字。
+# 传输层通过 httpcore 的 trace 回调统计新建连接与 TLS 握手次数，reuse_stats() 给出连接复用率。
+
+BASE_URL         = "https://api.deepseek.com"
+MAX_CONNECTIONS  = 64       # 连接池上限，应不小于各阶段的并发数
+MAX_KEEPALIVE    = 32       # 空闲时保留的连接数
+KEEPALIVE_EXPIRY = 120.0    # 空闲连接保留秒数
+CONNECT_TIMEOUT  = 10.0
+READ_TIMEOUT     = 180.0    # 单次读取的上限；整次调用的截止时间由调用方另行控制
+WRITE_TIMEOUT    = 30.0
+POOL_TIMEOUT     = 30.0     # 等待空闲连接的上限
+HTTP2            = True     # 需要 h2 包，未安装时使用 HTTP/1.1
+MAX_RETRIES      = 2        # openai 客户端自带的重试次数
+
+
+class _ReuseStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+
+    def add(self, requests=0, connections=0, tls_handshakes=0):
+        with self._lock:
+            self.requests += requests
+            self.connections += connections
+            self.tls_handshakes += tls_handshakes
+
+    def on_event(self, name: str):
+        if name == "connection.connect_tcp.complete":
+            self.add(connections=1)
+        elif name == "connection.start_tls.complete":
+            self.add(tls_handshakes=1)
+
+
+_stats = _ReuseStats()
+_stats_pid = os.getpid()
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _ensure_process():
+    """fork 后子进程继承了父进程的计数，按进程号重置。"""
+    global _stats, _stats_pid
+    if _stats_pid != os.getpid():
+        _stats, _stats_pid = _ReuseStats(), os.getpid()
+
+
+def http2_available() -> bool:
+    return HTTP2 and importlib.util.find_spec("h2") is not None
+
+
+def _limits():
+    import httpx
+
+    return httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE,
+                        keepalive_expiry=KEEPALIVE_EXPIRY)
+
+
+def _timeout():
+    import httpx
+
+    return httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT, write=WRITE_TIMEOUT, pool=POOL_TIMEOUT)
+
+
+def _transport():
+    import httpx
+
+    class CountingTransport(httpx.HTTPTransport):
+        def handle_request(self, request):
+            _stats.add(requests=1)
+            request.extensions["trace"] = lambda name, info: _stats.on_event(name)
+            return super().handle_request(request)
+
+    return CountingTransport(http2=http2_available(), limits=_limits())
+
+
+def _async_transport():
+    import httpx
+
+    async def trace(name, info):
+        _stats.on_event(name)
+
+    class CountingAsyncTransport(httpx.AsyncHTTPTransport):
+        async def handle_async_request(self, request):
+            _stats.add(requests=1)
+            request.extensions["trace"] = trace
+            return await super().handle_async_request(request)
+
+    return CountingAsyncTransport(http2=http2_available(), limits=_limits())
+
+
+def get_client(api_key: str, base_url: str = BASE_URL):
+    """返回本进程共享的同步 OpenAI 客户端（线程安全，可在多个线程中同时使用）。"""
+    import httpx
+    from openai import OpenAI
+
+    key = (os.getpid(), api_key, base_url)
+    _ensure_process()
+    with _clients_lock:
+        if key not in _clients:
+            http_client = httpx.Client(transport=_transport(), timeout=_timeout())
+            _clients[key] = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client,
+                                   timeout=_timeout(), max_retries=MAX_RETRIES)
+        return _clients[key]
+
+
+def get_async_client(api_key: str, base_url: str = BASE_URL):
+    """
+    返回一个使用同样连接池配置的 AsyncOpenAI 客户端。异步连接与事件循环绑定，
+    因此不跨事件循环缓存：每个事件循环建立一个，在其中共用，结束前 await client.close()。
+    """
+    import httpx
+    from openai import AsyncOpenAI
+
+    _ensure_process()
+    http_client = httpx.AsyncClient(transport=_async_transport(), timeout=_timeout())
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client,
+                       timeout=_timeout(), max_retries=MAX_RETRIES)
+
+
+def reuse_stats() -> dict:
+    """本进程的请求数、新建连接数、TLS 握手次数与连接复用率。"""
+    _ensure_process()
+    requests, connections = _stats.requests, _stats.connections
+    return {
+        "requests": requests,
+        "connections": connections,
+        "tls_handshakes": _stats.tls_handshakes,
+        "reuse_rate": round(1 - connections / requests, 4) if requests else 0.0,
+        "http2": http2_available(),
+    }
+
+
+def format_reuse_stats() -> str:
+    s = reuse_stats()
+    return (f"连接复用：{s['requests']} 次请求，新建 {s['connections']} 个连接、{s['tls_handshakes']} 次 TLS 握手，"
+            f"复用率 {s['reuse_rate']:.0%}（{'HTTP/2' if s['http2'] else 'HTTP/1.1'}）")
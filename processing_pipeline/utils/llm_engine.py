@@ -0,0 +1,295 @@
+import os
+import math
+import time
+import socket
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait as wait_futures
+
+
+# 并发生成引擎：
+# - generate_until：基于 asyncio，在单进程内维持固定数量的在途请求，按目标数补发；
+# - run_claimed：基于线程，从 TurnStore 领取待处理行并写回状态，用于流水线各阶段；
+# - Hedger：同步调用的截止时间与对冲请求，压低个别请求卡住造成的长尾。
+# 与多进程 Worker 相比，网络等待期间不占用进程，切换开销也更小。
+
+HEDGE_MIN_SAMPLES = 8     # 近期延迟样本不足该数时不发对冲请求
+HEDGE_WINDOW      = 500   # 计算对冲阈值时使用的近期延迟样本数
+
+
+async def generate_until(targets: dict, produce, on_result, concurrency: int = 10,
+                         max_attempts: dict = None, validate=None, should_continue=None,
+                         deadline: float = None) -> dict:
+    """
+    对每个 key 反复调用 produce(key)，直到累计得到 targets[key] 条有效结果。
+
+    失败（抛异常 / 返回 None / 未通过 validate）的请求不会占用名额，引擎会自动补发，
+    直到达到目标或该 key 的尝试次数用尽。调度时总是优先补缺口最大的 key，
+    使各领域的产出交错推进，而不是一个领域跑完再跑下一个。
+
+    Args:
+        targets: {key: 需要的有效结果数}。
+        produce: async 函数，produce(key) -> 结果或 None。
+        on_result: 同步回调，on_result(key, result)，每条有效结果调用一次（如写入文件）。
+        concurrency: 同时在途的请求数上限。
+        max_attempts: {key: 最多尝试次数}，缺省为目标数的 3 倍。
+        validate: 可选，validate(key, result) -> bool，返回 False 视为无效结果。
+        should_continue: 可选，should_continue(key) -> bool，返回 False 后不再为该 key 发新请求
+            （如去重闸门判定该领域已饱和）。
+        deadline: 可选，单个请求的截止秒数，超时的请求被取消并按失败补发。
+
+    Returns:
+        {key: {"target", "accepted", "attempts", "failed"}} 统计信息。
+    """
+    stats = {k: {"target": n, "accepted": 0, "attempts": 0, "failed": 0} for k, n in targets.items()}
+    if max_attempts is None:
+        max_attempts = {k: n * 3 for k, n in targets.items()}
+    pending = {k: 0 for k in targets}
+    in_flight = {}
+
+    def next_key():
+        # 缺口 = 目标 - 已接受 - 在途；在途请求若失败会在返回后再补
+        best, best_gap = None, 0
+        for k, s in stats.items():
+            gap = s["target"] - s["accepted"] - pending[k]
+            if gap > best_gap and s["attempts"] < max_attempts[k]:
+                if should_continue is not None and not should_continue(k):
+                    continue
+                best, best_gap = k, gap
+        return best
+
+    while True:
+        while len(in_flight) < concurrency:
+            key = next_key()
+            if key is None:
+                break
+            stats[key]["attempts"] += 1
+            pending[key] += 1
+            call = produce(key) if deadline is None else asyncio.wait_for(produce(key), deadline)
+            in_flight[asyncio.ensure_future(call)] = key
+
+        if not in_flight:
+            break
+
+        done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            key = in_flight.pop(task)
+            pending[key] -= 1
+            try:
+                result = task.result()
+            except asyncio.TimeoutError:
+                print(f"⚠️ {key} 请求超过 {deadline}s 未返回，将自动补发")
+                result = None
+            except Exception as e:
+                print(f"⚠️ {key} 请求失败，将自动补发：{e}")
+                result = None
+
+            if result is None or (validate is not None and not validate(key, result)):
+                stats[key]["failed"] += 1
+                continue
+            if stats[key]["accepted"] >= stats[key]["target"]:
+                continue
+            stats[key]["accepted"] += 1
+            on_result(key, result)
+
+    return stats
+
+
+def run_claimed(store, stage: str, process, concurrency: int = 8, batch_size: int = 4,
+                lease_seconds: float = 600, heartbeat: float = None) -> dict:
+    """
+    并发执行流水线的一个阶段：concurrency 个线程各自从 TurnStore 领取一批 pending 行，
+    逐行调用 process(row) -> result，成功记为 done，抛异常记为 failed（保存错误信息）。
+
+    领取是原子的，多个线程（或多个进程、多台机器共用同一个库）不会重复处理同一行；
+    结果按批提交，每批一个事务，且只写入本线程仍持有租约的行（租约过期已被他人领取的行丢弃本次结果）。给定 heartbeat 时每隔该秒数为本进程领取的行续租，
+    慢调用不会因租约过期被其他进程重复领取。
+
+    Returns:
+        {"done": 本次成功行数, "failed": 本次失败行数, "stale": 租约已被他人接管而未写入的行数}
+    """
+    counts = {"done": 0, "failed": 0, "stale": 0}
+    lock = threading.Lock()
+    worker_prefix = f"{socket.gethostname()}-{os.getpid()}"
+
+    def loop(i):
+        name = f"{worker_prefix}-{i}"
+        while True:
+            rows = store.claim(stage, name, batch_size, lease_seconds)
+            if not rows:
+                return
+            ok, bad = [], []
+            for row in rows:
+                try:
+                    ok.append((row["id"], process(row)))
+                except Exception as e:
+                    bad.append((row["id"], str(e)))
+            done = store.complete(stage, ok, worker=name)
+            failed = store.fail(stage, bad, worker=name)
+            stale = len(ok) + len(bad) - done - failed
+            if stale:
+                print(f"⚠️ {stage}：{stale} 行的租约已过期并被其他 worker 领取，本次结果不写入")
+            with lock:
+                counts["done"] += done
+                counts["failed"] += failed
+                counts["stale"] += stale
+
+    def run_all():
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for f in [executor.submit(loop, i) for i in range(concurrency)]:
+                f.result()
+
+    if heartbeat:
+        from job_queue import Heartbeat
+
+        with Heartbeat(lambda: store.renew(stage, worker_prefix + "-"), heartbeat):
+            run_all()
+    else:
+        run_all()
+    return counts
+
+
+def percentile(values, q: float):
+    """最近秩法分位数，values 为空时返回 None。"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def latency_report(records) -> dict:
+    """
+    汇总调用记录 [{"seconds", "hedged", "hedge_won", "timeout", "error"}]：
+    调用数、延迟分位数（秒）、对冲率、对冲请求先返回的次数、超时与失败次数。
+    """
+    records = list(records)
+    seconds = [r["seconds"] for r in records]
+    calls = len(records)
+    hedged = sum(r["hedged"] for r in records)
+
+    def rounded(q):
+        value = percentile(seconds, q)
+        return None if value is None else round(value, 3)
+
+    return {
+        "calls": calls,
+        "p50": rounded(0.5),
+        "p95": rounded(0.95),
+        "p99": rounded(0.99),
+        "max": round(max(seconds), 3) if seconds else None,
+        "hedged": hedged,
+        "hedge_rate": round(hedged / calls, 4) if calls else 0.0,
+        "hedge_wins": sum(r["hedge_won"] for r in records),
+        "timeouts": sum(r["timeout"] for r in records),
+        "errors": sum(r["error"] for r in records),
+    }
+
+
+def format_latency(report: dict) -> str:
+    if not report["calls"]:
+        return "延迟：无模型调用"
+    return (f"延迟：{report['calls']} 次调用，p50 {report['p50']}s / p99 {report['p99']}s / 最长 {report['max']}s；"
+            f"对冲 {report['hedged']} 次（{report['hedge_rate']:.1%}，其中 {report['hedge_wins']} 次先返回），"
+            f"超时 {report['timeouts']} 次")
+
+
+def _in_thread(fn, args, kwargs) -> Future:
+    """在守护线程中执行 fn：卡住的请求不会阻止进程退出。"""
+    future = Future()
+
+    def target():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=target, daemon=True).start()
+    return future
+
+
+class Hedger:
+    """
+    同步调用的截止时间与对冲请求，线程安全，可由 run_claimed 的各线程共用。
+
+    每次调用在后台线程中发出；超过近期延迟的 quantile 分位数仍未返回时，再发出一个相同的请求，
+    取先成功返回的结果。对冲请求数不超过调用数的 budget 比例，budget 为 0 时只做截止时间。
+    超过 deadline 秒仍没有结果时抛出 TimeoutError，未返回的请求留在后台线程中直到 HTTP 读取超时，
+    结果丢弃。每次调用的记录追加到 records，由 latency_report 汇总。
+    """
+
+    def __init__(self, deadline: float = None, quantile: float = 0.95, budget: float = 0.1,
+                 min_samples: int = HEDGE_MIN_SAMPLES):
+        self.deadline = deadline
+        self.quantile = quantile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.records = []
+        self._samples = deque(maxlen=HEDGE_WINDOW)   # 各次成功请求自身的耗时
+        self._calls = 0
+        self._hedged = 0
+        self._lock = threading.Lock()
+
+    def hedge_delay(self):
+        """当前的对冲阈值（秒）；样本不足或不允许对冲时为 None。"""
+        with self._lock:
+            if self.budget <= 0 or len(self._samples) < self.min_samples:
+                return None
+            return percentile(self._samples, self.quantile)
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self._hedged + 1 > self.budget * self._calls:
+                return False
+            self._hedged += 1
+            return True
+
+    def _record(self, started, hedged, hedge_won=False, timeout=False, error=False, sample=None):
+        with self._lock:
+            if sample is not None:
+                self._samples.append(sample)
+            self.records.append({"seconds": time.monotonic() - started, "hedged": hedged,
+                                 "hedge_won": hedge_won, "timeout": timeout, "error": error})
+
+    def call(self, fn, *args, **kwargs):
+        """调用 fn(*args, **kwargs)，返回先成功的结果；全部失败时抛出最后一个异常。"""
+        with self._lock:
+            self._calls += 1
+        started = time.monotonic()
+        deadline_at = started + self.deadline if self.deadline else None
+        delay = self.hedge_delay()
+        hedge_at = started + delay if delay is not None else None
+        attempts = {_in_thread(fn, args, kwargs): (started, False)}
+        hedged, error = False, None
+
+        while True:
+            now = time.monotonic()
+            waits = [t - now for t in (deadline_at, hedge_at) if t is not None]
+            done, _ = wait_futures(list(attempts), timeout=max(0.0, min(waits)) if waits else None,
+                                   return_when=FIRST_COMPLETED)
+            for future in done:
+                attempt_started, is_hedge = attempts.pop(future)
+                if future.exception() is None:
+                    self._record(started, hedged, hedge_won=is_hedge,
+                                 sample=time.monotonic() - attempt_started)
+                    return future.result()
+                error = future.exception()
+            if not attempts:
+                self._record(started, hedged, error=True)
+                raise error
+
+            now = time.monotonic()
+            if deadline_at is not None and now >= deadline_at:
+                self._record(started, hedged, timeout=True)
+                raise TimeoutError(f"调用超过 {self.deadline}s 未返回")
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                if self._take_budget():
+                    hedged = True
+                    attempts[_in_thread(fn, args, kwargs)] = (now, True)
+
+    def report(self) -> dict:
+        with self._lock:
+            return latency_report(self.records)
@@ -0,0 +1,195 @@
+import re
+import random
+import hashlib
+from collections import defaultdict, deque
+
+
+# 字符 n-gram MinHash + LSH 分桶的近重复检测。
+# 中文短句没有天然的词边界，直接按字符 n-gram（默认 2-gram）做 shingle 即可，
+# 标点和空白在比较前去掉，"他猛地抬起手臂。" 与 "他猛地抬起手臂！" 视为相同。
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_PUNCT_PATTERN = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def normalize_text(text: str) -> str:
+    return _PUNCT_PATTERN.sub("", str(text)).lower()
+
+
+def char_ngrams(text: str, n: int = 2) -> set:
+    """返回规范化后文本的字符 n-gram 集合，不足 n 个字符时整体作为一个 shingle。"""
+    text = normalize_text(text)
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _shingle_hash(shingle: str) -> int:
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+def _optimal_bands(threshold: float, num_perm: int) -> tuple:
+    """在 b*r <= num_perm 的组合中，选择 S 曲线拐点 (1/b)^(1/r) 最接近阈值的 (b, r)。"""
+    best, best_err = (num_perm, 1), float("inf")
+    for b in range(1, num_perm + 1):
+        if num_perm % b:
+            continue
+        r = num_perm // b
+        err = abs((1 / b) ** (1 / r) - threshold)
+        if err < best_err:
+            best, best_err = (b, r), err
+    return best
+
+
+class MinHasher:
+    """用 num_perm 个 (a*x + b) mod p 随机置换生成 MinHash 签名；相同 seed 的签名可直接比较。"""
+
+    def __init__(self, num_perm: int = 64, ngram: int = 2, seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.ngram = ngram
+        self._params = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)]
+
+    def signature(self, text: str) -> tuple:
+        hashes = [_shingle_hash(s) for s in char_ngrams(text, self.ngram)]
+        if not hashes:
+            return tuple([_MAX_HASH] * self.num_perm)
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self._params
+        )
+
+
+class NumpyMinHasher:
+    """
+    MinHasher 的 numpy 向量化版本，用于语料级批量计算（长文本的 shingle 数以千计）。
+    置换取 (a*x + b) mod (2^31 - 1)，乘积不超出 uint64；签名与 MinHasher 的不可混用。
+    """
+
+    _PRIME = (1 << 31) - 1
+
+    def __init__(self, num_perm: int = 128, ngram: int = 2, seed: int = 1):
+        import numpy as np
+
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.ngram = ngram
+        self._np = np
+        self._a = rng.integers(1, self._PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, self._PRIME, num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> tuple:
+        np = self._np
+        shingles = char_ngrams(text, self.ngram)
+        if not shingles:
+            return tuple([_MAX_HASH] * self.num_perm)
+        h = np.fromiter((_shingle_hash(s) for s in shingles), dtype=np.uint64, count=len(shingles))
+        h %= np.uint64(self._PRIME)
+        values = (h[:, None] * self._a[None, :] + self._b[None, :]) % np.uint64(self._PRIME)
+        return tuple(values.min(axis=0).tolist())
+
+
+def estimate_jaccard(sig_a: tuple, sig_b: tuple) -> float:
+    return sum(x == y for x, y in zip(sig_a, sig_b)) / len(sig_a)
+
+
+class NearDupIndex:
+    """
+    在线近重复索引：逐条加入文本，估计 Jaccard 相似度不低于 threshold 的视为近重复。
+
+    LSH 分带只用于快速找出候选，最终是否重复由完整签名估计的相似度决定，
+    因此单次查询的代价与已入库的条数无关，只与候选桶大小有关。
+    """
+
+    def __init__(self, threshold: float = 0.6, num_perm: int = 64, ngram: int = 2, seed: int = 1):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm=num_perm, ngram=ngram, seed=seed)
+        self.bands, self.rows = _optimal_bands(threshold, num_perm)
+        self._buckets = [defaultdict(list) for _ in range(self.bands)]
+        self._signatures = []
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def _band_keys(self, sig: tuple):
+        for i in range(self.bands):
+            yield i, sig[i * self.rows:(i + 1) * self.rows]
+
+    def query(self, text: str, sig: tuple = None) -> float:
+        """返回与已入库文本的最大估计相似度（无候选时为 0）。"""
+        sig = sig or self.hasher.signature(text)
+        candidates = set()
+        for i, key in self._band_keys(sig):
+            candidates.update(self._buckets[i].get(key, ()))
+        return max((estimate_jaccard(sig, self._signatures[c]) for c in candidates), default=0.0)
+
+    def add(self, text: str, sig: tuple = None) -> int:
+        sig = sig or self.hasher.signature(text)
+        idx = len(self._signatures)
+        self._signatures.append(sig)
+        for i, key in self._band_keys(sig):
+            self._buckets[i][key].append(idx)
+        return idx
+
+    def add_if_novel(self, text: str) -> tuple:
+        """不是近重复时加入索引；返回 (是否新样本, 最大相似度)。"""
+        sig = self.hasher.signature(text)
+        similarity = self.query(text, sig)
+        if similarity >= self.threshold:
+            return False, similarity
+        self.add(text, sig)
+        return True, similarity
+
+
+class DiversityGate:
+    """
+    生成数据的在线去重/多样性闸门，按 key（领域）统计唯一样本产出率。
+
+    check() 作为 llm_engine.generate_until 的 validate 钩子：近重复返回 False，
+    引擎会自动补发；should_continue() 作为调度钩子：某领域最近 window 条有效
+    返回中唯一样本占比低于 min_yield 时判定为饱和，不再为它发请求。
+    """
+
+    def __init__(self, index: NearDupIndex = None, min_yield: float = 0.2, window: int = 20, text_fn=None):
+        self.index = index or NearDupIndex()
+        self.min_yield = min_yield
+        self.window = window
+        self.text_fn = text_fn or (lambda item: str(item))
+        self.stats = defaultdict(lambda: {"checked": 0, "unique": 0, "duplicate": 0})
+        self.saturated = set()
+        self._recent = defaultdict(lambda: deque(maxlen=self.window))
+
+    def seed(self, items):
+        """用已有数据预热索引，使与历史数据重复的新样本同样被拒绝。"""
+        for item in items:
+            self.index.add(self.text_fn(item))
+
+    def check(self, key, item) -> bool:
+        is_new, _ = self.index.add_if_novel(self.text_fn(item))
+        s = self.stats[key]
+        s["checked"] += 1
+        s["unique" if is_new else "duplicate"] += 1
+        self._recent[key].append(is_new)
+        return is_new
+
+    def recent_yield(self, key) -> float:
+        recent = self._recent[key]
+        return sum(recent) / len(recent) if recent else 1.0
+
+    def should_continue(self, key) -> bool:
+        if key in self.saturated:
+            return False
+        if len(self._recent[key]) >= self.window and self.recent_yield(key) < self.min_yield:
+            print(f"⏹️ 领域 {key} 已饱和：最近 {self.window} 条有效返回中唯一样本占比 {self.recent_yield(key):.0%}，停止请求")
+            self.saturated.add(key)
+            return False
+        return True
+
+    def report(self) -> dict:
+        """返回 {key: {checked, unique, duplicate, unique_yield, saturated}}。"""
+        out = {}
+        for key, s in self.stats.items():
+            out[key] = dict(s, unique_yield=s["unique"] / s["checked"] if s["checked"] else 0.0,
+                            saturated=key in self.saturated)
+        return out
@@ -0,0 +1,150 @@
+import os
+import json
+import heapq
+import threading
+
+
+# 任务调度：按预测耗时从长到短派发（LPT），避免几个特别长的滑窗或提示落在最后拖长整体完成时间（makespan）。
+#
+# 每个阶段的耗时模型为 秒 = a + b × 提示 token，用历史调用的（提示 token, 实际秒数）按最小二乘拟合；
+# 累计量保存在 cost_model.json 中跨运行复用，样本不足时使用默认系数（此时预测值只是粗估，但排序仍按提示长度）。
+# 多机共用时每个 worker 只写自己的分片 cost_model.parts/<worker>.json，读取时与 cost_model.json 逐项相加。
+# 派发顺序先按优先级（数值小的先做），同一优先级内预测耗时长的先做；
+# 按这个顺序在给定 worker 数下做贪心列表调度，得到预测的 makespan，与实际 makespan 一同写入报告。
+
+DEFAULT_INTERCEPT = 3.0     # 无历史数据时：每次调用的固定耗时（秒）
+DEFAULT_SLOPE     = 0.01    # 无历史数据时：每个提示 token 的耗时（秒）
+MIN_FIT_SAMPLES   = 20      # 某阶段样本数达到该值后才使用拟合系数
+SCHEDULE_REPORT   = "schedule_report.json"
+
+
+def _load_sums(path: str) -> dict:
+    if not os.path.isfile(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _add_sums(total: dict, sums: dict):
+    for stage, s in sums.items():
+        t = total.setdefault(stage, {"n": 0, "x": 0.0, "y": 0.0, "xx": 0.0, "xy": 0.0})
+        for k, v in s.items():
+            t[k] += v
+
+
+class CostModel:
+    """
+    按阶段累计 n、Σx、Σy、Σx²、Σxy 做在线线性回归，线程安全。
+    给定 worker 时（多机模式）观测只写入 <path 去掉扩展名>.parts/<worker>.json，不改写共用的 path。
+    """
+
+    def __init__(self, path: str = None, worker: str = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.sums = {}   # 预测用：path 与全部分片之和
+        self.own = {}    # save 写回的部分：path 本身，多机模式下为本 worker 的分片
+        self.part = None
+        if not path:
+            return
+        parts_dir = os.path.splitext(path)[0] + ".parts"
+        if worker:
+            self.part = os.path.join(parts_dir, f"{worker}.json")
+        self.own = _load_sums(self.part or path)
+        _add_sums(self.sums, _load_sums(path))
+        for name in sorted(os.listdir(parts_dir)) if os.path.isdir(parts_dir) else []:
+            if name.endswith(".json"):
+                _add_sums(self.sums, _load_sums(os.path.join(parts_dir, name)))
+
+    def observe(self, stage: str, tokens: float, seconds: float):
+        sample = {stage: {"n": 1, "x": tokens, "y": seconds, "xx": tokens * tokens, "xy": tokens * seconds}}
+        with self._lock:
+            _add_sums(self.sums, sample)
+            _add_sums(self.own, sample)
+
+    def coefficients(self, stage: str) -> tuple:
+        """(a, b)：样本不足或提示长度没有差异时返回默认系数；斜率不会小于 0。"""
+        with self._lock:
+            s = self.sums.get(stage)
+            if not s or s["n"] < MIN_FIT_SAMPLES:
+                return DEFAULT_INTERCEPT, DEFAULT_SLOPE
+            n = s["n"]
+            var = s["xx"] - s["x"] * s["x"] / n
+            if var <= 0:
+                return s["y"] / n, DEFAULT_SLOPE
+            b = max(0.0, (s["xy"] - s["x"] * s["y"] / n) / var)
+            a = max(0.0, (s["y"] - b * s["x"]) / n)
+            return a, b
+
+    def predict(self, stage: str, tokens: float) -> float:
+        a, b = self.coefficients(stage)
+        return a + b * tokens
+
+    def save(self):
+        if not self.path:
+            return
+        path = self.part or self.path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._lock:
+            data = json.dumps(self.own, ensure_ascii=False, indent=2)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+
+def order(tasks, cost, priority=None) -> list:
+    """按 (优先级, -预测耗时) 排序；优先级与耗时都相同的任务保持原顺序。"""
+    if priority is None:
+        return sorted(tasks, key=lambda t: -cost(t))
+    return sorted(tasks, key=lambda t: (priority(t), -cost(t)))
+
+
+def simulate_makespan(costs, workers: int) -> float:
+    """按给定顺序把任务依次交给最早空闲的 worker（共享队列的行为），返回预测的完成时间。"""
+    finish = [0.0] * max(1, workers)
+    for c in costs:
+        heapq.heapreplace(finish, finish[0] + c)
+    return max(finish)
+
+
+def makespan_report(stage: str, costs, workers: int, actual: float, model: CostModel = None,
+                    input_order=None) -> dict:
+    """
+    costs 为按派发顺序排列的预测耗时；input_order 为排序前的同一组耗时，
+    给出时一并报告按原顺序派发的预测 makespan 作对比。
+    """
+    costs = list(costs)
+    report = {
+        "stage": stage,
+        "tasks": len(costs),
+        "workers": workers,
+        "predicted_makespan": round(simulate_makespan(costs, workers), 2),
+        "actual_makespan": round(actual, 2),
+        "predicted_total": round(sum(costs), 2),
+        "longest_task": round(max(costs), 2) if costs else 0.0,
+    }
+    if input_order is not None:
+        report["input_order_makespan"] = round(simulate_makespan(input_order, workers), 2)
+    if model is not None:
+        a, b = model.coefficients(stage)
+        report["model"] = {"intercept": round(a, 4), "slope": round(b, 6)}
+    return report
+
+
+def format_makespan(report: dict) -> str:
+    text = (f"调度 {report['stage']}：{report['tasks']} 个任务 / {report['workers']} 个 worker，"
+            f"预测 makespan {report['predicted_makespan']}s，实际 {report['actual_makespan']}s")
+    if "input_order_makespan" in report:
+        text += f"（按原顺序派发预测为 {report['input_order_makespan']}s）"
+    return text
+
+
+def save_report(store_dir: str, report: dict):
+    """按阶段合并写入 <store_dir>/schedule_report.json。"""
+    path = os.path.join(store_dir, SCHEDULE_REPORT)
+    data = {}
+    if os.path.isfile(path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    data[report["stage"]] = report
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
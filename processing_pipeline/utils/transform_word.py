@@ -1,14 +1,192 @@
-import pandas as pd
-import opencc
+import os
+import csv
+import json
+import argparse
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 
-# 加载数据集
-df = pd.read_csv('未处理数据/情绪训练数据集（繁体）.csv')
+# ———— 配置 ————
+INPUT_PATH     = '未处理数据/情绪训练数据集（繁体）.csv'
+OUTPUT_PATH    = '处理后数据/情绪训练数据集（简体）.csv'
+CSV_COLUMNS    = ['text', 'emotion']   # CSV 默认转换的列
+OPENCC_CONFIG  = 't2s.json'            # t2s.json 是繁体转简体的配置文件
+CHUNK_ROWS     = 2000                  # 每个任务块的行数 / 记录数
+NUM_WORKERS    = os.cpu_count() or 1
+CACHE_MAX_LEN  = 16                    # 不超过该长度的字符串（如 emotion 标签）走缓存
+# —————————————————
 
-# 初始化 OpenCC 转换器 (繁体到简体)
-converter = opencc.OpenCC('t2s.json')  # t2s.json 是繁体转简体的配置文件
+# 每个工作进程持有自己的 OpenCC 实例，由进程池 initializer 创建
+_converter = None
 
-# 将 text 与emotion 列中的繁体字转换为简体字
-df['text'] = df['text'].apply(converter.convert)
-df['emotion'] = df['emotion'].apply(converter.convert)
-# 保存转换后的数据到新文件
-df.to_csv('处理后数据/情绪训练数据集（简体）.csv', index=False)
+
+def _init_worker(config: str):
+    global _converter
+    import opencc
+    _converter = opencc.OpenCC(config)
+    _cached_convert.cache_clear()
+
+
+@lru_cache(maxsize=65536)
+def _cached_convert(text: str) -> str:
+    return _converter.convert(text)
+
+
+def convert_text(value):
+    """转换单个值；非字符串原样返回，短字符串命中缓存时不再调用 OpenCC。"""
+    if not isinstance(value, str) or not value:
+        return value
+    if len(value) <= CACHE_MAX_LEN:
+        return _cached_convert(value)
+    return _converter.convert(value)
+
+
+def convert_obj(obj, keys=None):
+    """递归转换 JSON 对象中的字符串；指定 keys 时只转换这些键下的值（含嵌套内容）。"""
+    if isinstance(obj, dict):
+        return {k: convert_obj(v, None if keys is None or k in keys else keys) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [convert_obj(v, keys) for v in obj]
+    return convert_text(obj) if keys is None else obj
+
+
+def _convert_csv_chunk(args):
+    rows, col_indices = args
+    for row in rows:
+        for i in col_indices:
+            if i < len(row):
+                row[i] = convert_text(row[i])
+    return rows
+
+
+def _convert_jsonl_chunk(args):
+    lines, keys = args
+    out = []
+    for line in lines:
+        if line.strip():
+            out.append(json.dumps(convert_obj(json.loads(line), keys), ensure_ascii=False))
+    return out
+
+
+def _convert_records_chunk(args):
+    records, keys = args
+    return [convert_obj(r, keys) for r in records]
+
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _ordered_map(executor, fn, tasks, max_pending):
+    """
+    按提交顺序产出结果，同时最多只有 max_pending 个任务在途。
+    executor.map 会一次性提交全部任务，输入很大时内存不受控，因此这里用滑动窗口。
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(fn, task))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def convert_csv(input_path, output_path, columns, executor, max_pending, encoding='utf-8-sig'):
+    # utf-8-sig 读取时去掉 BOM（否则首列列名带 BOM 而匹配不到），写出时保留，与仓库中各 CSV 一致
+    with open(input_path, 'r', encoding=encoding, newline='') as fin, \
+         open(output_path, 'w', encoding=encoding, newline='') as fout:
+        reader = csv.reader(fin)
+        writer = csv.writer(fout)
+        header = next(reader, None)
+        if header is None:
+            return 0
+        missing = [c for c in columns if c not in header]
+        if missing:
+            raise ValueError(f"CSV 中缺少待转换的列：{missing}")
+        col_indices = [header.index(c) for c in columns]
+        writer.writerow(header)
+
+        total = 0
+        tasks = ((chunk, col_indices) for chunk in _chunked(reader, CHUNK_ROWS))
+        for rows in _ordered_map(executor, _convert_csv_chunk, tasks, max_pending):
+            writer.writerows(rows)
+            total += len(rows)
+        return total
+
+
+def convert_jsonl(input_path, output_path, keys, executor, max_pending):
+    with open(input_path, 'r', encoding='utf-8-sig') as fin, open(output_path, 'w', encoding='utf-8') as fout:
+        total = 0
+        tasks = ((chunk, keys) for chunk in _chunked(fin, CHUNK_ROWS))
+        for lines in _ordered_map(executor, _convert_jsonl_chunk, tasks, max_pending):
+            for line in lines:
+                fout.write(line + '\n')
+            total += len(lines)
+        return total
+
+
+def convert_json(input_path, output_path, keys, executor, max_pending):
+    # JSON 数组用 stream_io.iter_records 逐条流式解析，读取、转换与写出按块流水进行；
+    # 顶层不是数组（单个对象）时整体解析，作为一条记录
+    from stream_io import iter_records
+
+    with open(input_path, 'r', encoding='utf-8-sig') as fin:
+        first = fin.read(1)
+        while first.isspace():
+            first = fin.read(1)
+        if first == '[':
+            records = iter_records(input_path)
+        else:
+            fin.seek(0)
+            records = [json.load(fin)]
+
+    with open(output_path, 'w', encoding='utf-8') as fout:
+        fout.write('[\n')
+        total = 0
+        tasks = ((chunk, keys) for chunk in _chunked(records, CHUNK_ROWS))
+        for converted in _ordered_map(executor, _convert_records_chunk, tasks, max_pending):
+            for record in converted:
+                fout.write((',\n' if total else '') + json.dumps(record, ensure_ascii=False, indent=4))
+                total += 1
+        fout.write('\n]\n')
+        return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="繁体 → 简体 批量转换（CSV / JSON / JSONL，分块多进程）")
+    parser.add_argument("--input", default=INPUT_PATH)
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--columns", nargs="+", default=None,
+                        help=f"CSV 待转换的列（默认 {CSV_COLUMNS}）；JSON/JSONL 为待转换的键，缺省转换全部字符串")
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--config", default=OPENCC_CONFIG, help="OpenCC 配置文件")
+    args = parser.parse_args(argv)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    suffix = os.path.splitext(args.input)[1].lower()
+    max_pending = args.workers * 2
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(args.config,)) as executor:
+        if suffix == '.csv':
+            total = convert_csv(args.input, args.output, args.columns or CSV_COLUMNS, executor, max_pending)
+        elif suffix == '.jsonl':
+            keys = set(args.columns) if args.columns else None
+            total = convert_jsonl(args.input, args.output, keys, executor, max_pending)
+        elif suffix == '.json':
+            keys = set(args.columns) if args.columns else None
+            total = convert_json(args.input, args.output, keys, executor, max_pending)
+        else:
+            raise ValueError(f"不支持的文件类型：{suffix}")
+
+    print(f"✅ 转换完成，共 {total} 条，已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import os
+import re
+import csv
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+# 阶段间的列式中间存储（Arrow IPC）。
+#
+# 每部小说一个目录，基础列（id, role, text, window_idx）写一次，之后每个阶段只追加
+# 自己产出的那一列（emo_label / behaviour / dialogue / speaking_style），以 id 为键：
+#
+#   <root>/base/part-00000.arrow            id, role, text, window_idx
+#   <root>/<column>/part-00000.arrow        id, value
+#   <root>/<column>/part-00001.arrow        ...（续跑或补跑时追加的新分片）
+#
+# 读取通过 memory_map 零拷贝完成，阶段间 I/O 只与新增列的大小成正比；
+# 同一 id 在多个分片中出现时以最新分片为准，补跑失败行只需追加一个小分片。
+# CSV 仅作为导出格式（export_csv）。
+
+BASE = "base"
+BASE_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("role", pa.string()),
+    ("text", pa.string()),
+    ("window_idx", pa.int64()),
+])
+COLUMN_SCHEMA = pa.schema([("id", pa.int64()), ("value", pa.string())])
+
+_PART_PATTERN = re.compile(r"^part-(\d+)\.arrow$")
+
+
+def _write_ipc(path: str, table: pa.Table):
+    tmp = path + ".tmp"
+    with pa.OSFile(tmp, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, path)
+
+
+def _read_ipc(path: str) -> pa.Table:
+    # 不使用 with：表中的缓冲区直接引用映射内存，由表的生命周期决定何时释放
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+class TurnColumns:
+    """一部小说的列式台词存储，见模块说明。"""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    # ———— 分片管理 ————
+
+    def _parts(self, column: str) -> list:
+        folder = os.path.join(self.root, column)
+        if not os.path.isdir(folder):
+            return []
+        parts = sorted((int(m.group(1)), name) for name in os.listdir(folder)
+                       if (m := _PART_PATTERN.match(name)))
+        return [os.path.join(folder, name) for _, name in parts]
+
+    def _next_part(self, column: str) -> str:
+        folder = os.path.join(self.root, column)
+        os.makedirs(folder, exist_ok=True)
+        parts = self._parts(column)
+        seq = int(_PART_PATTERN.match(os.path.basename(parts[-1])).group(1)) + 1 if parts else 0
+        return os.path.join(folder, f"part-{seq:05d}.arrow")
+
+    def columns(self) -> list:
+        """已有的阶段列名（不含基础列）。"""
+        return sorted(name for name in os.listdir(self.root)
+                      if name != BASE and self._parts(name))
+
+    def has_base(self) -> bool:
+        return bool(self._parts(BASE))
+
+    # ———— 写入 ————
+
+    def write_base(self, turns: list):
+        """写入（覆盖）基础列，turns 为 [{id, role, text, window_idx}, …]。"""
+        table = pa.Table.from_pylist(
+            [{k: t.get(k) for k in BASE_SCHEMA.names} for t in turns], schema=BASE_SCHEMA
+        )
+        for path in self._parts(BASE):
+            os.remove(path)
+        _write_ipc(self._next_part(BASE), table)
+
+    def append(self, column: str, ids: list, values: list):
+        """为某一列追加一个分片；同一 id 已存在时，新值覆盖旧值。"""
+        if not ids:
+            return
+        values = [None if v is None or v != v else str(v) for v in values]  # NaN → null
+        table = pa.table({"id": pa.array(ids, pa.int64()), "value": pa.array(values, pa.string())},
+                         schema=COLUMN_SCHEMA)
+        _write_ipc(self._next_part(column), table)
+
+    def replace(self, column: str, ids: list, values: list):
+        """用一组完整结果替换某列的全部分片（由状态库物化阶段结果时使用）。"""
+        parts = self._parts(column)
+        self.append(column, ids, values)
+        for path in parts:
+            os.remove(path)
+
+    def compact(self, column: str):
+        """把某列的全部分片合并为一个（阶段结束时调用，减少小文件数量）。"""
+        parts = self._parts(column)
+        if len(parts) <= 1:
+            return
+        table = self.read(column)
+        merged = self._next_part(column)
+        _write_ipc(merged, table)
+        for path in parts:
+            os.remove(path)
+
+    # ———— 读取 ————
+
+    def read_base(self) -> pa.Table:
+        parts = self._parts(BASE)
+        if not parts:
+            raise FileNotFoundError(f"{self.root} 中没有基础列，请先运行抽取阶段")
+        return pa.concat_tables([_read_ipc(p) for p in parts])
+
+    def read(self, column: str) -> pa.Table:
+        """读取某列的 (id, value) 表，多分片中同一 id 取最新值。"""
+        tables = [_read_ipc(p) for p in self._parts(column)]
+        if not tables:
+            return COLUMN_SCHEMA.empty_table()
+        if len(tables) == 1:
+            return tables[0]
+
+        kept, seen = [], None
+        for table in reversed(tables):
+            if seen is not None:
+                table = table.filter(pc.invert(pc.is_in(table["id"], value_set=seen)))
+            kept.append(table)
+            ids = table["id"].combine_chunks()
+            seen = ids if seen is None else pa.concat_arrays([seen, ids])
+        return pa.concat_tables(reversed(kept))
+
+    def done_ids(self, column: str) -> set:
+        return set(self.read(column)["id"].to_pylist())
+
+    def read_table(self, columns: list = None) -> pa.Table:
+        """基础列按 id 左连接指定的阶段列（缺省为全部），按 id 排序返回。"""
+        table = self.read_base()
+        for name in columns if columns is not None else self.columns():
+            col = self.read(name).rename_columns(["id", name])
+            table = table.join(col, keys="id", join_type="left outer")
+        return table.sort_by("id")
+
+    # ———— 导出 ————
+
+    def export_csv(self, path: str, columns: list = None, encoding: str = "utf-8-sig", batch_rows: int = 10000):
+        """按批导出 CSV（基础列 + 指定阶段列），供下游沿用 CSV 的脚本使用；path 以 .zst / .gz 结尾时流式压缩。"""
+        from stream_io import open_stream
+
+        table = self.read_table(columns)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open_stream(path, "w", encoding=encoding, newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=table.column_names)
+            writer.writeheader()
+            for batch in table.to_batches(max_chunksize=batch_rows):
+                writer.writerows(batch.to_pylist())
+        return table.num_rows
@@ -0,0 +1,347 @@
+import os
+import csv
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+# 基于 SQLite 的台词状态库：流水线续跑/重试的唯一依据。
+#
+# turns        每条台词一行（id, role, text, window_idx）
+# stage_status 每条台词在每个阶段的状态：pending / running / done / failed，
+#              以及结果、错误信息、尝试次数、领取者与时间戳
+#
+# (stage, status, turn_id) 上有索引，"某阶段的待处理行" 查询为 O(log n)；
+# priority 越大越先被领取（如调度器写入的预测耗时），相同时按 id 顺序；
+# 领取在 BEGIN IMMEDIATE 事务内完成，多个线程或进程并发领取不会重复处理同一行；
+# running 状态超过租约时间未完成（进程崩溃）的行会被重新领取，长时间运行的领取者可用 renew 续租。
+# 库文件放在网络文件系统上由多台机器共用时须以 wal=False 打开（WAL 只在单机上有效）。
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+# 旧版脚本把异常写成占位结果，以此前缀区分
+LEGACY_FAILURE_PREFIX = "(生成失败"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id          INTEGER PRIMARY KEY,
+    role        TEXT,
+    text        TEXT,
+    window_idx  INTEGER
+);
+CREATE TABLE IF NOT EXISTS stage_status (
+    stage       TEXT    NOT NULL,
+    turn_id     INTEGER NOT NULL,
+    status      TEXT    NOT NULL,
+    result      TEXT,
+    error       TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    worker      TEXT,
+    claimed_at  REAL,
+    created_at  REAL    NOT NULL,
+    updated_at  REAL    NOT NULL,
+    priority    REAL    NOT NULL DEFAULT 0,
+    PRIMARY KEY (stage, turn_id)
+);
+CREATE INDEX IF NOT EXISTS idx_stage_status ON stage_status(stage, status, turn_id);
+"""
+# 旧库没有 priority 列：补列后再建索引
+_PRIORITY_INDEX = "CREATE INDEX IF NOT EXISTS idx_stage_priority ON stage_status(stage, status, priority DESC, turn_id)"
+
+
+class TurnStore:
+    """见模块说明。每个线程使用各自的连接，实例本身可在线程间共享。"""
+
+    def __init__(self, path: str, timeout: float = 30.0, wal: bool = True):
+        self.path = path
+        self.timeout = timeout
+        self.wal = wal
+        self._local = threading.local()
+        self._conn.executescript(_SCHEMA)
+        columns = {r[1] for r in self._conn.execute("PRAGMA table_info(stage_status)")}
+        if "priority" not in columns:
+            self._conn.execute("ALTER TABLE stage_status ADD COLUMN priority REAL NOT NULL DEFAULT 0")
+        self._conn.execute(_PRIORITY_INDEX)
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            # 日志模式写在库文件中：以 wal=False 打开时显式切回回滚日志
+            conn.execute(f"PRAGMA journal_mode={'WAL' if self.wal else 'DELETE'}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # ———— 台词 ————
+
+    def reset_turns(self, turns):
+        """用新的抽取结果替换全部台词，并清空各阶段状态（重新抽取后旧结果已无意义）。"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM stage_status")
+            conn.execute("DELETE FROM turns")
+            conn.executemany(
+                "INSERT INTO turns (id, role, text, window_idx) VALUES (:id, :role, :text, :window_idx)",
+                ({k: t.get(k) for k in ("id", "role", "text", "window_idx")} for t in turns),
+            )
+
+    def turn_count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM turns").fetchone()[0]
+
+    # ———— 阶段状态 ————
+
+    def ensure_stage(self, stage: str, depends_on: str = None) -> int:
+        """
+        为尚无状态的台词登记 pending 行，返回新增行数。
+        指定 depends_on 时只登记该前置阶段已 done 的台词，前置阶段补跑成功后再次调用即可补登记。
+        """
+        now = time.time()
+        sql = ("INSERT OR IGNORE INTO stage_status (stage, turn_id, status, created_at, updated_at) "
+               "SELECT ?, t.id, ?, ?, ? FROM turns t")
+        params = [stage, PENDING, now, now]
+        if depends_on:
+            sql += " JOIN stage_status d ON d.turn_id = t.id AND d.stage = ? AND d.status = ?"
+            params += [depends_on, DONE]
+        with self._transaction() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def claim(self, stage: str, worker: str, limit: int = 1, lease_seconds: float = 600) -> list:
+        """
+        原子地领取最多 limit 条待处理行（含租约过期的 running 行），置为 running 并累加尝试次数。
+        按 priority 从大到小、再按 id 领取；返回 [{id, role, text, window_idx, attempts}, …]，按 id 升序。
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            ids = [r[0] for r in conn.execute(
+                "SELECT turn_id FROM stage_status WHERE stage = ? AND status = ? "
+                "ORDER BY priority DESC, turn_id LIMIT ?",
+                (stage, PENDING, limit),
+            )]
+            if len(ids) < limit:
+                ids += [r[0] for r in conn.execute(
+                    "SELECT turn_id FROM stage_status WHERE stage = ? AND status = ? AND claimed_at < ? "
+                    "ORDER BY priority DESC, turn_id LIMIT ?",
+                    (stage, RUNNING, now - lease_seconds, limit - len(ids)),
+                )]
+            if not ids:
+                return []
+            conn.executemany(
+                "UPDATE stage_status SET status = ?, worker = ?, claimed_at = ?, updated_at = ?, "
+                "attempts = attempts + 1 WHERE stage = ? AND turn_id = ?",
+                ((RUNNING, worker, now, now, stage, i) for i in ids),
+            )
+            placeholders = ",".join("?" * len(ids))
+            rows = conn.execute(
+                f"SELECT t.id, t.role, t.text, t.window_idx, s.attempts FROM turns t "
+                f"JOIN stage_status s ON s.turn_id = t.id AND s.stage = ? "
+                f"WHERE t.id IN ({placeholders}) ORDER BY t.id",
+                [stage, *ids],
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def renew(self, stage: str, worker_prefix: str) -> int:
+        """续租：名称以 worker_prefix 开头的领取者持有的 running 行重新计时，返回续租行数。"""
+        now = time.time()
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE stage_status SET claimed_at = ? WHERE stage = ? AND status = ? "
+                "AND substr(worker, 1, ?) = ?",
+                (now, stage, RUNNING, len(worker_prefix), worker_prefix),
+            ).rowcount
+
+    def hold(self, stage: str, turn_ids, seconds: float) -> int:
+        """
+        延长租约：指定的 running 行在 seconds 秒内不会被当作过期行重新领取（claimed_at 推后到 seconds 秒之后），
+        用于已提交到批任务、结果要很久之后才合并的行。返回延长的行数。
+        """
+        until = time.time() + seconds
+        with self._transaction() as conn:
+            return conn.executemany(
+                "UPDATE stage_status SET claimed_at = ? WHERE stage = ? AND turn_id = ? AND status = ?",
+                ((until, stage, turn_id, RUNNING) for turn_id in turn_ids),
+            ).rowcount
+
+    def set_priority(self, stage: str, priorities):
+        """批量设置领取优先级：priorities 为 [(turn_id, priority), …]，越大越先被领取。"""
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE stage_status SET priority = ? WHERE stage = ? AND turn_id = ?",
+                ((p, stage, turn_id) for turn_id, p in priorities),
+            )
+
+    def pending(self, stage: str) -> list:
+        """某阶段 pending 行的 id，按 id 升序。"""
+        return [r[0] for r in self._conn.execute(
+            "SELECT turn_id FROM stage_status WHERE stage = ? AND status = ? ORDER BY turn_id", (stage, PENDING)
+        )]
+
+    def _finish(self, stage: str, items, status: str, column: str, worker: str = None) -> int:
+        items = list(items)
+        if not items:
+            return 0
+        now = time.time()
+        if worker is not None:
+            # 只有仍持有租约的领取者能写入：租约过期后被其他 worker 重新领取的行不覆盖新持有者的结果
+            with self._transaction() as conn:
+                return conn.executemany(
+                    f"UPDATE stage_status SET status = ?, {column} = ?, updated_at = ?, worker = NULL "
+                    f"WHERE stage = ? AND turn_id = ? AND status = ? AND worker = ?",
+                    ((status, value, now, stage, turn_id, RUNNING, worker) for turn_id, value in items),
+                ).rowcount
+        # 未经 claim 直接记录结果的行（独立脚本逐行调用）在这里计一次尝试
+        with self._transaction() as conn:
+            conn.executemany(
+                f"INSERT INTO stage_status (stage, turn_id, status, {column}, attempts, created_at, updated_at) "
+                f"VALUES (?, ?, ?, ?, 1, ?, ?) "
+                f"ON CONFLICT (stage, turn_id) DO UPDATE SET status = excluded.status, "
+                f"{column} = excluded.{column}, updated_at = excluded.updated_at, worker = NULL, "
+                f"attempts = CASE WHEN stage_status.status = '{RUNNING}' THEN stage_status.attempts "
+                f"ELSE stage_status.attempts + 1 END",
+                ((stage, turn_id, status, value, now, now) for turn_id, value in items),
+            )
+        return len(items)
+
+    def import_results(self, stage: str, done=(), failed=()) -> int:
+        """导入外部已有的结果，不覆盖库中已有状态；返回新增行数。"""
+        now = time.time()
+        rows = [(stage, i, DONE, r, None, now, now) for i, r in done]
+        rows += [(stage, i, FAILED, None, e, now, now) for i, e in failed]
+        with self._transaction() as conn:
+            return conn.executemany(
+                "INSERT OR IGNORE INTO stage_status (stage, turn_id, status, result, error, attempts, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, 1, ?, ?)",
+                rows,
+            ).rowcount
+
+    def complete(self, stage: str, results, worker: str = None) -> int:
+        """
+        批量记录成功结果：results 为 [(turn_id, result), …]。
+        给定 worker（claim 时的领取者）时只写入该 worker 仍持有的 running 行；返回实际写入的行数。
+        """
+        return self._finish(stage, results, DONE, "result", worker)
+
+    def fail(self, stage: str, failures, worker: str = None) -> int:
+        """批量记录失败：failures 为 [(turn_id, 错误信息), …]；worker 与返回值同 complete。"""
+        return self._finish(stage, failures, FAILED, "error", worker)
+
+    def retry_failed(self, stage: str, turn_ids=None, max_attempts: int = None) -> int:
+        """把失败行重新置为 pending，可限定 id 或最大尝试次数；返回重置行数。"""
+        sql = "UPDATE stage_status SET status = ?, updated_at = ? WHERE stage = ? AND status = ?"
+        params = [PENDING, time.time(), stage, FAILED]
+        if max_attempts is not None:
+            sql += " AND attempts < ?"
+            params.append(max_attempts)
+        if turn_ids is not None:
+            turn_ids = list(turn_ids)
+            if not turn_ids:
+                return 0
+            sql += f" AND turn_id IN ({','.join('?' * len(turn_ids))})"
+            params += turn_ids
+        with self._transaction() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def status(self, stage: str, turn_id: int):
+        row = self._conn.execute(
+            "SELECT status FROM stage_status WHERE stage = ? AND turn_id = ?", (stage, turn_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def status_counts(self, stage: str) -> dict:
+        return {r[0]: r[1] for r in self._conn.execute(
+            "SELECT status, COUNT(*) FROM stage_status WHERE stage = ? GROUP BY status", (stage,)
+        )}
+
+    def results(self, stage: str) -> list:
+        """某阶段全部成功结果 [(turn_id, result), …]，按 id 升序。"""
+        return [tuple(r) for r in self._conn.execute(
+            "SELECT turn_id, result FROM stage_status WHERE stage = ? AND status = ? ORDER BY turn_id",
+            (stage, DONE),
+        )]
+
+    def changes(self, stage: str, since: float) -> list:
+        """
+        某时刻之后状态变为 done / failed 的行 [(turn_id, result), …]，失败行的 result 为 None。
+        since=0 时为全部已结束的行，用于与列式存储逐行比较后补写。
+        """
+        return [tuple(r) for r in self._conn.execute(
+            "SELECT turn_id, CASE WHEN status = ? THEN result END FROM stage_status "
+            "WHERE stage = ? AND status IN (?, ?) AND updated_at >= ? ORDER BY turn_id",
+            (DONE, stage, DONE, FAILED, since),
+        )]
+
+    def failures(self, stage: str) -> list:
+        """某阶段全部失败行 [(turn_id, error, attempts), …]，按 id 升序。"""
+        return [tuple(r) for r in self._conn.execute(
+            "SELECT turn_id, error, attempts FROM stage_status WHERE stage = ? AND status = ? ORDER BY turn_id",
+            (stage, FAILED),
+        )]
+
+
+def migrate_legacy_csv(store: TurnStore, stage: str, path: str, column: str, encoding: str = "utf-8-sig") -> int:
+    """
+    把旧版逐行追加的输出 CSV 导入状态库：正常行记为 done，"(生成失败" 占位行记为 failed，
+    并从 CSV 中删去占位行（重试成功后由 write_results_csv 写回原位置）。可重复调用；返回新增状态行数。
+    """
+    if not os.path.isfile(path):
+        return 0
+    with open(path, newline="", encoding=encoding) as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        rows = list(reader)
+    done, failed, kept = [], [], []
+    for row in rows:
+        value = row.get(column) or ""
+        if value.startswith(LEGACY_FAILURE_PREFIX):
+            failed.append((int(row["id"]), value))
+        else:
+            done.append((int(row["id"]), value))
+            kept.append(row)
+    added = store.import_results(stage, done, failed)
+    if failed:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", newline="", encoding=encoding) as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(kept)
+        os.replace(tmp_path, path)
+    return added
+
+
+def write_results_csv(store: TurnStore, stage: str, path: str, header: list, rows, encoding: str = "utf-8-sig") -> int:
+    """
+    按输入顺序重写逐行脚本的输出 CSV：rows 为 [(turn_id, 输入行的各列值), …]，
+    只写出该阶段已 done 的行，结果作为最后一列。输出文件完全由输入与状态库决定，
+    补跑成功的行回到原来的位置，中断后重跑也不会出现重复行。返回写出的行数。
+    """
+    results = dict(store.results(stage))
+    count = 0
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", newline="", encoding=encoding) as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for turn_id, values in rows:
+            if turn_id in results:
+                writer.writerow(list(values) + [results[turn_id]])
+                count += 1
+    os.replace(tmp_path, path)
+    return count